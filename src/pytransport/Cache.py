@@ -0,0 +1,346 @@
+"""
+Cache
+
+On-disk cache of data read from Transport output files, so that a file that has
+already been read does not have to be parsed again.
+
+Classes:
+OpticsCache - cache of the optics, lattice and fitting sections of output files.
+ConversionCache - cache of the gmad and madx files converted from Transport files.
+
+"""
+
+import hashlib as _hashlib
+import os as _os
+import shutil as _shutil
+import tempfile as _tempfile
+
+import numpy as _np
+
+from . import Convert as _Convert
+from . import Reader as _Reader
+from .Data import ColumnarData as _ColumnarData
+
+_defaultDirectory = _os.path.join(_os.path.expanduser('~'), '.cache', 'pytransport')
+# The files written by the pybdsim/pymadx builders besides the main file, named <main>_<part>.
+_builderFileParts = ['components', 'sequence', 'samplers', 'beam', 'options']
+
+
+def _FileHash(inputfile, blocksize=1 << 20):
+    """
+    Hash of the contents of a file.
+    """
+    filehash = _hashlib.blake2b(digest_size=20)
+    with open(inputfile, 'rb') as f:
+        block = f.read(blocksize)
+        while block:
+            filehash.update(block)
+            block = f.read(blocksize)
+    return filehash.hexdigest()
+
+
+def _KnownFileHash(hashes, filename):
+    """
+    Hash of the contents of a file, kept in the dict hashes by path, size and modification
+    time so an unchanged file is only hashed once.
+    """
+    stat = _os.stat(filename)
+    statkey = (filename, stat.st_size, stat.st_mtime_ns)
+    if statkey not in hashes:
+        hashes[statkey] = _FileHash(filename)
+    return hashes[statkey]
+
+
+def _FileName(inputFile):
+    """
+    File name of inputFile, which can be a file name or an index returned by Reader.IndexFile.
+    """
+    if isinstance(inputFile, _Reader._SectionIndex):
+        return inputFile.filename
+    return inputFile
+
+
+class OpticsCache:
+    """
+    Cache of data read from Transport output files, stored as .npz files in a directory.
+
+    Entries are keyed by the contents of the file, the version of the Reader and the
+    arguments used, so a changed file or a change to the Reader gives a new entry. When the
+    total size of the cache exceeds maxBytes, the least recently used entries are removed.
+
+    directory: string, default = ~/.cache/pytransport. Directory the cache is stored in.
+    maxBytes:  int, default = 1 GB. Maximum total size of the cache.
+
+    >>> cache = pytransport.Cache.OpticsCache()
+    >>> optics = cache.GetOptics('FOR002.DAT')
+    >>> lattice = cache.GetLattice('FOR002.DAT')
+    """
+    def __init__(self, directory=None, maxBytes=1 << 30):
+        if directory is None:
+            directory = _defaultDirectory
+        self.directory = directory
+        self.maxBytes = maxBytes
+        _os.makedirs(self.directory, exist_ok=True)
+        # file hashes of files already seen, keyed by path, size and modification time.
+        self._hashes = {}
+
+    def GetOptics(self, inputFile, inputType=None, columnar=False, matrices=False):
+        """
+        Cached version of pytransport.Reader.GetOptics.
+        """
+        key = self._Key(inputFile, 'optics', inputType, matrices)
+        stored = self._Load(key)
+        if stored is None:
+            optics = _Reader.GetOptics(inputFile, inputType, columnar=True, matrices=matrices)
+            arrays = {'names': _np.array(optics.names, dtype=str), 'units': _np.array(optics.units, dtype=str)}
+            for name in optics.names:
+                arrays['column_' + name] = optics.GetColumn(name)
+            if matrices and hasattr(optics, 'sigmaMatrices'):
+                arrays['sigmaMatrices'] = optics.sigmaMatrices
+                arrays['rMatrices'] = optics.rMatrices
+            self._Store(key, arrays)
+        else:
+            optics = _ColumnarData()
+            for name, unit in zip(stored['names'], stored['units']):
+                optics._AddProperty(str(name), stored['column_' + name], str(unit))
+            if 'sigmaMatrices' in stored:
+                optics.sigmaMatrices = stored['sigmaMatrices']
+                optics.rMatrices = stored['rMatrices']
+
+        if columnar:
+            return optics
+        data = optics.ToBDSData()
+        if hasattr(optics, 'sigmaMatrices'):
+            data.sigmaMatrices = optics.sigmaMatrices
+            data.rMatrices = optics.rMatrices
+        return data
+
+    def GetLattice(self, inputFile):
+        """
+        Cached version of pytransport.Reader.GetLattice.
+        """
+        return self._GetLines(inputFile, 'lattice', _Reader.GetLattice)
+
+    def GetFitsSection(self, inputFile):
+        """
+        Cached version of pytransport.Reader.GetFitsSection.
+        """
+        return self._GetLines(inputFile, 'fits', _Reader.GetFitsSection)
+
+    def Clear(self):
+        """
+        Remove all entries from the cache.
+        """
+        for entry, size, lastused in self._Entries():
+            _os.remove(entry)
+
+    def _GetLines(self, inputFile, section, reader):
+        """
+        Get a section that is a list of lines, reading it with reader if it is not cached.
+        """
+        key = self._Key(inputFile, section)
+        stored = self._Load(key)
+        if stored is None:
+            lines = reader(inputFile)
+            # a section that is not in the file is stored as missing rather than as the text 'None'.
+            missing = lines is None
+            self._Store(key, {'lines': _np.array([] if missing else lines, dtype=str),
+                              'missing': _np.array(missing)})
+            return lines
+        if stored['missing']:
+            return None
+        return stored['lines'].tolist()
+
+    def _Key(self, inputFile, *args):
+        """
+        Cache key from the file contents, Reader version and the arguments.
+        """
+        filename = _os.path.abspath(_FileName(inputFile))
+        key = _hashlib.blake2b(digest_size=20)
+        key.update(_KnownFileHash(self._hashes, filename).encode())
+        key.update(repr((_Reader._parserVersion,) + args).encode())
+        return key.hexdigest()
+
+    def _Path(self, key):
+        return _os.path.join(self.directory, key + '.npz')
+
+    def _Load(self, key):
+        """
+        Dict of the arrays stored for key, or None if it is not in the cache.
+        """
+        path = self._Path(key)
+        try:
+            with _np.load(path) as stored:
+                arrays = {name: stored[name] for name in stored.files}
+        except (IOError, ValueError):
+            return None
+        _os.utime(path)  # mark as recently used
+        return arrays
+
+    def _Store(self, key, arrays):
+        """
+        Write the arrays for key and remove old entries if the cache is too large.
+        """
+        # write to a temporary file first so other processes never load a partial entry.
+        handle, temppath = _tempfile.mkstemp(suffix='.npz.tmp', dir=self.directory)
+        with _os.fdopen(handle, 'wb') as f:
+            _np.savez(f, **arrays)
+        _os.replace(temppath, self._Path(key))
+        self._Evict()
+
+    def _Entries(self):
+        """
+        List of (path, size, last used time) of each entry in the cache.
+        """
+        entries = []
+        for entry in _os.scandir(self.directory):
+            if entry.name.endswith('.npz'):
+                stat = entry.stat()
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _Evict(self):
+        """
+        Remove the least recently used entries until the cache is within maxBytes.
+        """
+        entries = self._Entries()
+        totalsize = sum(size for entry, size, lastused in entries)
+        for entry, size, lastused in sorted(entries, key=lambda e: e[2]):
+            if totalsize <= self.maxBytes:
+                break
+            try:
+                _os.remove(entry)
+            except OSError:
+                pass
+            totalsize -= size
+
+
+class ConversionCache:
+    """
+    Cache of the files written by pytransport.Convert.Convert, stored as one directory per
+    conversion. If a file is converted again with the same options, the converted files are
+    copied from the cache instead of converting the file again.
+
+    Entries are keyed by the name and contents of the file, the version of the converter and the
+    conversion options (particle, distrType, output, dontSplit, keepName, combineDrifts and the contents
+    of the pybdsim options). When the total size of the cache exceeds maxBytes, the least
+    recently used entries are removed.
+
+    directory: string, default = ~/.cache/pytransport/conversions. Directory the cache is stored in.
+    maxBytes:  int, default = 1 GB. Maximum total size of the cache.
+
+    >>> cache = pytransport.Cache.ConversionCache()
+    >>> cache.Convert('FOR001.DAT', machine=pybdsim.Builder.Machine(), options=pybdsim.Options.Options())
+    """
+    def __init__(self, directory=None, maxBytes=1 << 30):
+        if directory is None:
+            directory = _os.path.join(_defaultDirectory, 'conversions')
+        self.directory = directory
+        self.maxBytes = maxBytes
+        _os.makedirs(self.directory, exist_ok=True)
+        self._hashes = {}
+
+    def Convert(self, inputfile, particle='proton', distrType='gauss', output='bdsim', outputDir='',
+                debug=False, dontSplit=False, keepName=False, combineDrifts=False, options=None, machine=None):
+        """
+        Cached version of pytransport.Convert.Convert. Returns True if the converted files were
+        copied from the cache, False if the file was converted.
+        """
+        gmad, madx, gmadDir, madxDir = _Convert._OutputDirectories(output, outputDir)
+        directories = {}
+        if gmad:
+            directories['gmad'] = gmadDir
+        if madx:
+            directories['madx'] = madxDir
+        prefix = _os.path.splitext(_os.path.basename(inputfile))[0]
+
+        optionsItems = sorted((str(k), repr(v)) for k, v in options.items()) if hasattr(options, 'items') else None
+        # the names of the files written depend on the name of the input file as well as its contents.
+        key = self._Key(inputfile, prefix, particle, distrType, output.lower(), dontSplit, keepName, combineDrifts,
+                        optionsItems)
+        entry = _os.path.join(self.directory, key)
+        if _os.path.isdir(entry):
+            for target, directory in directories.items():
+                self._Copy(_os.path.join(entry, target), directory)
+            _os.utime(entry)  # mark as recently used
+            print("Converted files of " + inputfile + " copied from the cache.")
+            return True
+
+        written = _Convert.Convert(inputfile, particle=particle, distrType=distrType, output=output,
+                                   outputDir=outputDir, debug=debug, dontSplit=dontSplit, keepName=keepName,
+                                   combineDrifts=combineDrifts, options=options, machine=machine)
+
+        # store the files written by this conversion.
+        tempentry = _tempfile.mkdtemp(suffix='.tmp', dir=self.directory)
+        for target in directories:
+            _os.makedirs(_os.path.join(tempentry, target))
+        for path in written:
+            target = 'gmad' if path.endswith('.gmad') else 'madx'
+            for filepath in self._BuilderFiles(path):
+                _shutil.copy2(filepath, _os.path.join(tempentry, target, _os.path.basename(filepath)))
+        try:
+            _os.rename(tempentry, entry)
+        except OSError:
+            _shutil.rmtree(tempentry, ignore_errors=True)  # stored by another process in the meantime
+        self._Evict()
+        return False
+
+    def Clear(self):
+        """
+        Remove all entries from the cache.
+        """
+        for entry, size, lastused in self._Entries():
+            _shutil.rmtree(entry, ignore_errors=True)
+
+    def _Key(self, inputfile, *args):
+        """
+        Cache key from the file contents, converter version and the arguments.
+        """
+        key = _hashlib.blake2b(digest_size=20)
+        key.update(_KnownFileHash(self._hashes, _os.path.abspath(inputfile)).encode())
+        key.update(repr((_Convert._converterVersion,) + args).encode())
+        return key.hexdigest()
+
+    @staticmethod
+    def _BuilderFiles(path):
+        """
+        List of path and the files the pybdsim/pymadx builders write alongside it, which are
+        named after it, e.g. FOR001_components.gmad for FOR001.gmad.
+        """
+        stem, extension = _os.path.splitext(path)
+        files = [path]
+        for part in _builderFileParts:
+            filepath = stem + '_' + part + extension
+            if _os.path.isfile(filepath):
+                files.append(filepath)
+        return files
+
+    @staticmethod
+    def _Copy(source, directory):
+        if directory:
+            _os.makedirs(directory, exist_ok=True)
+        for entry in _os.scandir(source):
+            _shutil.copy2(entry.path, _os.path.join(directory, entry.name))
+
+    def _Entries(self):
+        """
+        List of (path, size, last used time) of each entry in the cache.
+        """
+        entries = []
+        for entry in _os.scandir(self.directory):
+            if entry.is_dir() and not entry.name.endswith('.tmp'):
+                size = sum(f.stat().st_size for target in _os.scandir(entry.path) for f in _os.scandir(target.path))
+                entries.append((entry.path, size, entry.stat().st_mtime))
+        return entries
+
+    def _Evict(self):
+        """
+        Remove the least recently used entries until the cache is within maxBytes.
+        """
+        entries = self._Entries()
+        totalsize = sum(size for entry, size, lastused in entries)
+        for entry, size, lastused in sorted(entries, key=lambda e: e[2]):
+            if totalsize <= self.maxBytes:
+                break
+            _shutil.rmtree(entry, ignore_errors=True)
+            totalsize -= size
@@ -9,13 +9,30 @@ _Convert - a class used to convert different element types.
 
 """
 
+import glob as _glob
+import os as _os
+import time as _time
+
 import numpy as _np
 
+from . import _Emitter
 from . import _General
 from ._General import _Writer
 from .Data import ConversionData as _convData
+from .Data import _BothMachines
 from . import Reader as _Reader
 
+# Version of the converted output, increase when a change to the converter changes the files written.
+# Used to invalidate cached conversions (see pytransport.Cache.ConversionCache).
+_converterVersion = 2
+
+# Changes made to the element registry from the results of fitting.
+_fitChangeDtype = _np.dtype([('element', _np.intp),
+                             ('fit', _np.intp),
+                             ('parameter', 'U6'),
+                             ('old', _np.float64),
+                             ('new', _np.float64)])
+
 
 def Convert(inputfile,
             particle='proton',
@@ -68,32 +85,170 @@ def Convert(inputfile,
     |                               | combine multiple consecutive drifts into a single drift           |
     +-------------------------------+-------------------------------------------------------------------+
     | **machine**                   | dtype = pybdsim.Builder.Machine or pymadx.Builder.Machine         |
-    |                               | required, default = None                                          |
-    |                               | machine instance required for conversion.                         |
+    |                               | Optional, default = None                                          |
+    |                               | machine instance used for conversion. If None, the gmad or madx   |
+    |                               | text is written by pytransport as the elements are converted,     |
+    |                               | without needing pybdsim or pymadx. For output "both", a pair of   |
+    |                               | (pybdsim, pymadx) machines can be given. The elements are         |
+    |                               | converted once and added to both machines.                        |
     +-------------------------------+-------------------------------------------------------------------+
     | **options**                   | dtype = pybdsim.Options.Options. Optional, default = None         |
-    |                               | options instance required to write options in bdsim conversion.   |
-    |                               | Ignored if converting to "madx" format.                           |
+    |                               | options instance required to write options in bdsim conversion    |
+    |                               | with a pybdsim machine. Ignored if converting to "madx" format.   |
     +-------------------------------+-------------------------------------------------------------------+
 
     Example:
 
     >>> Convert(inputfile, machine=pybdsim.Builder.Machine(), options=pybdsim.Options.Options())
     >>> Convert(inputfile, output="madx", machine=pymadx.Builder.Machine())
+    >>> Convert(inputfile, output="madx")
 
     Writes converted machine to disk. Reader automatically detects if the supplied input file is a Transport input
-    file or Transport output file.
+    file or Transport output file. Returns the list of the paths of the machine files written.
 
     """
     outputType = output.lower()
 
-    if machine is None:
-        raise TypeError("machine instance must be supplied")
-    if ((outputType == 'bdsim') or (output == 'both')) and (options is None):
+    if ((outputType == 'bdsim') or (output == 'both')) and (options is None) and (machine is not None):
         raise TypeError("pybdsim.Options.Options must be supplied for bdsim conversion")
     if (outputType == 'madx') and (options is not None):
         print("Ignoring supplied options for madx conversion")
 
+    gmad, madx, gmadDir, madxDir = _OutputDirectories(output, outputDir)
+    machine, options = _ConversionMachine(machine, gmad, madx, options)
+
+    converter = _Convert(_convData(inputfile=inputfile,
+                                   particle=particle,
+                                   distrType=distrType,
+                                   gmad=gmad,
+                                   madx=madx,
+                                   gmadDir=gmadDir,
+                                   madxDir=madxDir,
+                                   debug=debug,
+                                   dontSplit=dontSplit,
+                                   keepName=keepName,
+                                   combineDrifts=combineDrifts,
+                                   options=options,
+                                   machine=machine))
+    return converter.Convert()
+
+
+def ConvertBatch(inputfiles,
+                 machineFactory,
+                 optionsFactory=None,
+                 output='bdsim',
+                 outputDir=None,
+                 workers=None,
+                 ordered=True,
+                 **kwargs):
+    """
+    **ConvertBatch** convert many Transport input or output files in parallel.
+    Generator that yields (filename, error, seconds) for each file, where error is None if the
+    file was converted or the exception raised otherwise, and seconds is the time taken.
+
+    +-------------------------------+-------------------------------------------------------------------+
+    | **inputfiles**                | dtype = list of strings, or a glob pattern string                 |
+    |                               | e.g. 'settings/*/FOR002.DAT'                                      |
+    +-------------------------------+-------------------------------------------------------------------+
+    | **machineFactory**            | dtype = callable, e.g. pybdsim.Builder.Machine                    |
+    |                               | called with no arguments to make the machine for each file. Must  |
+    |                               | be a class or module level function to be used by other processes |
+    |                               | If None, the text is written by pytransport as in Convert.        |
+    +-------------------------------+-------------------------------------------------------------------+
+    | **optionsFactory**            | dtype = callable, e.g. pybdsim.Options.Options. Optional          |
+    |                               | called to make the options for each file, needed for bdsim output |
+    +-------------------------------+-------------------------------------------------------------------+
+    | **output**                    | dtype=string. Optional, default = "bdsim"                         |
+    |                               | the output type, can be "bdsim", "madx", or "both"                |
+    +-------------------------------+-------------------------------------------------------------------+
+    | **outputDir**                 | dtype=string. Optional, default = None                            |
+    |                               | as for Convert. A relative directory is in the directory of each  |
+    |                               | input file, so files of the same name do not overwrite each other |
+    +-------------------------------+-------------------------------------------------------------------+
+    | **workers**                   | dtype = int. Optional, default = number of CPUs                   |
+    |                               | number of processes used. 1 converts the files in this process    |
+    +-------------------------------+-------------------------------------------------------------------+
+    | **ordered**                   | dtype = bool. Optional, default = True                            |
+    |                               | yield the files in the order given, otherwise as they finish      |
+    +-------------------------------+-------------------------------------------------------------------+
+
+    Other keyword arguments (particle, distrType, debug, dontSplit, keepName, combineDrifts) are
+    passed to Convert.
+
+    Example:
+
+    >>> for filename, error, seconds in ConvertBatch('settings/*/FOR002.DAT', pybdsim.Builder.Machine,
+    ...                                              pybdsim.Options.Options, workers=8):
+    ...     print(filename, 'failed: ' + str(error) if error else 'converted in %.1f s' % seconds)
+    """
+    if isinstance(inputfiles, str):
+        inputfiles = sorted(_glob.glob(inputfiles))
+    inputfiles = list(inputfiles)
+    _OutputDirectories(output, '')  # check the output type before starting any conversions
+    arguments = [(inputfile, machineFactory, optionsFactory, output, outputDir, kwargs) for inputfile in inputfiles]
+    for num, result, error in _General._ParallelMap(_ConvertTimed, arguments, workers, ordered):
+        if error is None:
+            error, seconds = result
+        else:
+            seconds = None
+        yield inputfiles[num], error, seconds
+
+
+def _ConvertTimed(inputfile, machineFactory, optionsFactory, output, outputDir, kwargs):
+    """
+    Convert one file of a batch. Returns the exception raised (or None) and the time taken.
+    """
+    start = _time.time()
+    try:
+        gmad, madx, gmadDir, madxDir = _OutputDirectories(output, outputDir or '')
+        directory = _os.path.dirname(_os.path.abspath(inputfile))
+        gmadDir = _os.path.join(directory, gmadDir) if gmadDir else gmadDir
+        madxDir = _os.path.join(directory, madxDir) if madxDir else madxDir
+        options = optionsFactory() if (optionsFactory is not None) and gmad else None
+        machine = machineFactory() if machineFactory is not None else None
+        machine, options = _ConversionMachine(machine, gmad, madx, options)
+        converter = _Convert(_convData(inputfile=inputfile,
+                                       gmad=gmad,
+                                       madx=madx,
+                                       gmadDir=gmadDir,
+                                       madxDir=madxDir,
+                                       options=options,
+                                       machine=machine,
+                                       **kwargs))
+        converter.Convert()
+        error = None
+    except Exception as exception:
+        error = exception
+    return error, _time.time() - start
+
+
+def _ConversionMachine(machine, gmad, madx, options):
+    """
+    Machine to convert with and the options to use with it. If machine is None, the gmad
+    (or madx) text is written directly. When converting to both formats, the elements are
+    converted once and added to a gmad and a madx machine: machine can be a pair of
+    (gmad, madx) machines, or a single gmad machine, in which case the madx text is written
+    directly.
+    """
+    if gmad and (options is None) and (machine is None):
+        options = _Emitter.Options()
+    if gmad and madx:
+        if machine is None:
+            machine = _Emitter.Machine('gmad')
+        if isinstance(machine, (tuple, list)):
+            return _BothMachines(*machine), options
+        return _BothMachines(machine, _Emitter.Machine('madx')), options
+    if machine is None:
+        machine = _Emitter.Machine('gmad' if gmad else 'madx')
+    return machine, options
+
+
+def _OutputDirectories(output, outputDir):
+    """
+    Whether gmad and madx are written and their directories, for Convert's output and outputDir.
+    """
+    outputType = output.lower()
+
     # default for output='bdsim'
     gmadDir = outputDir
     madxDir = outputDir
@@ -121,21 +276,7 @@ def Convert(inputfile,
             madxDir += '_madx'
     else:
         raise IOError("Unknown output type '"+output+"'")
-
-    converter = _Convert(_convData(inputfile=inputfile,
-                                   particle=particle,
-                                   distrType=distrType,
-                                   gmad=gmad,
-                                   madx=madx,
-                                   gmadDir=gmadDir,
-                                   madxDir=madxDir,
-                                   debug=debug,
-                                   dontSplit=dontSplit,
-                                   keepName=keepName,
-                                   combineDrifts=combineDrifts,
-                                   options=options,
-                                   machine=machine))
-    converter.Convert()
+    return gmad, madx, gmadDir, madxDir
 
 
 class _Convert:
@@ -164,59 +305,29 @@ class _Convert:
         infile = inputfile.split('/')[-1]  # Remove filepath, leave just filename
         self.Transport._file = infile[:-4]  # Remove extension
         self.Transport._filename = inputfile
-        isOutput = _General.CheckIsOutput(inputfile)  # Is a TRANSPORT standard output file.
+        # Read the file once, all sections are then taken from the index.
+        self.Transport.index = _Reader.IndexFile(inputfile)
+        isOutput = _General.CheckIsOutput(self.Transport.index)  # Is a TRANSPORT standard output file.
         self.Writer.DebugPrintout("File Read.")
         if isOutput:
-            lattice = _Reader.GetLattice(inputfile)
-            fitres = _Reader.GetResultsFromFitting(inputfile)
+            lattice = _Reader.GetLattice(self.Transport.index)
+            fitres = _Reader.GetResultsFromFitting(self.Transport.index)
             self.Transport = _General.OutputFitsToRegistry(self.Transport, fitres)
             self.Writer.DebugPrintout('Adding any fitting output to the fitting registry (self.FitRegistry)')
 
             self.Writer.DebugPrintout('Processing file and adding to Transport class.')
-            for linenum, latticeline in enumerate(lattice):
-                latticeline = latticeline.replace(';', '')
-                line = _np.array(latticeline.split(' '), dtype=_np.str)
-                line = _General.RemoveIllegals(line)
-
-                # Method of dealing with split lines in the output
-                # Should only be applicable to type 12 entry (up to 15 variables)
-                # It is assumed that the line is always split, so be careful.
-                prevline = lattice[linenum - 1].replace(';', '')
-                prevline = _np.array(prevline.split(' '), dtype=_np.str)
-                prevline = _General.RemoveIllegals(prevline)
-
-                try:
-                    if (linenum > 0) and _np.abs(_np.float(line[0])) == 12.0:
-                        latticeline, line = _General.JoinSplitLines(linenum, lattice)
-                    # Ignore line after type 12 entry (second part of split line)
-                    if (linenum > 1) and _np.abs(_np.float(prevline[0])) == 12.0:
-                        pass
-                    else:
-                        self.Transport.data.append(line)
-                        self.Transport.filedata.append(latticeline)
-                except ValueError:
-                    self.Transport.data.append(line)
-                    self.Transport.filedata.append(latticeline)
-                except IndexError:
-                    pass
+            tokens, lines = _General.TokeniseLattice(lattice)
+            self.Transport.data.extend(tokens)
+            self.Transport.filedata.extend(lines)
 
         else:
-            f = open(inputfile)
-            for inputline in f:
-                endoflinepos = _General.FindEndOfLine(inputline)
-                templine = inputline
-                if endoflinepos > 0:
-                    templine = inputline[:endoflinepos]
-                line = _np.array(templine.split(' '), dtype=_np.str)
+            for linenum in range(len(self.Transport.index.lines)):
+                inputline = self.Transport.index.RawLine(linenum)
                 # skip malformed lines
-                if len(line[0]) == 0:
+                if (not inputline) or (inputline[0] in ' ;'):
                     continue
-                # do not change comment lines
-                if not line[0][0] == '(':
-                    line = _General.RemoveIllegals(line)
-                self.Transport.data.append(line)
+                self.Transport.data.append(_General.TokeniseLine(inputline))
                 self.Transport.filedata.append(inputline)
-            f.close()
         self.Transport.convprops.fileloaded = True
 
     def Write(self):
@@ -229,25 +340,30 @@ class _Convert:
             self.Transport.AddOptions()
         self.Transport.machine.AddSampler('all')
         self.Writer.BeamDebugPrintout(self.Transport.beamprops, self.Transport.units)
-        fname = _General.RemoveFileExt(self.Transport.convprops.file)
+        fname = _General.RemoveFileExt(_os.path.basename(self.Transport.convprops.file))
         if self.Transport.convprops.numberparts < 0:
             filename = fname
         else:
             self.Transport.convprops.numberparts += 1
             filename = fname + '_part' + _np.str(self.Transport.convprops.numberparts)
         self.Writer.Write(self.Transport, filename)
+        self.Writer.Flush()
 
     def Convert(self):
         """
-        Convert, process, and write.
+        Convert, process, and write. Returns the list of the paths of the machine files written.
         """
-        self.LoadFile(self.Transport.convprops.file)
+        try:
+            self.LoadFile(self.Transport.convprops.file)
 
-        if not self.Transport.convprops.fileloaded:
-            self.Writer.Printout('No file loaded.')
-            return
-        self.ProcessAndBuild()
-        self.Write()
+            if not self.Transport.convprops.fileloaded:
+                self.Writer.Printout('No file loaded.')
+                return self.Writer.written
+            self.ProcessAndBuild()
+            self.Write()
+        finally:
+            self.Writer.Close()
+        return self.Writer.written
 
     def ProcessAndBuild(self):
         """
@@ -257,40 +373,43 @@ class _Convert:
         """
         self.Writer.DebugPrintout('Processing tokenised lines from input file and adding to element registry.\n')
 
+        filetype = 'input'
+        if self.Transport.filedata and self.Transport.filedata[0].startswith('OUTPUT'):
+            filetype = 'output'
+
+        # Poleface rotations of every dipole, found in one pass rather than searching around each dipole.
+        self.Transport.polefaceAngles = _General.GetFaceRotationAngles(self.Transport.data)
+
         for linenum, line in enumerate(self.Transport.data):
-            self.Writer.DebugPrintout('Processing tokenised line ' + _np.str(linenum) + ' :')
-            self.Writer.DebugPrintout('\t' + str(line))
+            rawline = self.Transport.filedata[linenum]
+            self.Writer.DebugPrintout('Processing tokenised line %d :', linenum)
+            self.Writer.DebugPrintout('\t%s', line)
             self.Writer.DebugPrintout('\tOriginal :')
-            self.Writer.DebugPrintout('\t' + self.Transport.filedata[linenum])
+            self.Writer.DebugPrintout('\t%s', rawline)
 
             # Checks if the SENTINEL line is found. SENTINEL relates to TRANSPORT fitting routine and is only written
             # after the lattice definition, so there's no point reading lines beyond it.
-            if _General.CheckIsSentinel(line):
+            if _General.CheckIsSentinel(rawline):
                 self.Writer.DebugPrintout('Sentinel Found.')
                 break
             # Test for positive element, negative ones ignored in TRANSPORT so ignored here too.
-            try:
-                typeNum = _General.GetTypeNum(line)
-                if typeNum > 0:
-                    if self.Transport.data[0][0] == 'OUTPUT':
-                        self._ElementPrepper(line, linenum, 'output')
-                    else:
-                        line = _General.RemoveIllegals(line)
-                        self._ElementPrepper(line, linenum, 'input')
-                else:
-                    self.Writer.DebugPrintout('\tType code is 0 or negative, ignoring line.')
-            except ValueError:
+            if line.typecode is None:
                 errorline = '\tCannot process line ' + _np.str(linenum) + ', '
-                if line[0][0] == '(' or line[0][0] == '/':
+                firstchar = rawline.strip()[:1]
+                if line.comment is not None or firstchar == '/':
                     errorline += 'line is a comment.'
-                elif line[0][0] == 'S':  # S used as first character in SENTINEL command.
-                    errorline = 'line is for TRANSPORT fitting routine.'
-                elif line[0] == '\n':
-                    errorline = 'line is blank.'
+                elif firstchar == 'S':  # S used as first character in SENTINEL command.
+                    errorline += 'line is for TRANSPORT fitting routine.'
+                elif firstchar == '':
+                    errorline += 'line is blank.'
                 else:
-                    errorline = 'reason unknown.'
+                    errorline += 'reason unknown.'
                 self.Writer.DebugPrintout(errorline)
-        self._UpdateElementsFromFits()
+            elif line.typecode > 0:
+                self._ElementPrepper(line, linenum, filetype)
+            else:
+                self.Writer.DebugPrintout('\tType code is 0 or negative, ignoring line.')
+        self.Transport.fitChanges = self._UpdateElementsFromFits()
         self.Writer.DebugPrintout(
             'Converting registry elements to pybdsim compatible format and adding to machine builder.\n')
 
@@ -299,20 +418,21 @@ class _Convert:
         if self.Transport.convprops.combineDrifts:
             lastElementWasADrift = False
         for linenum, linedict in enumerate(self.Transport.ElementRegistry.elements):
-            self.Writer.DebugPrintout('Converting element number ' + _np.str(linenum) + ':')
-            convertline = '\t'
-            for keynum, key in enumerate(linedict.keys()):
-                if keynum != 0:
-                    convertline += ', '
-                if key == 'data':
-                    convertline += 'element data:'
-                    for ele in linedict[key]:
-                        convertline += ('\t' + _np.str(ele))
-                else:
-                    convertline += (key + ': ' + _np.str(linedict[key]))
-                if keynum == len(list(linedict.keys())):
-                    convertline += '.'
-            self.Writer.DebugPrintout(convertline)
+            self.Writer.DebugPrintout('Converting element number %d:', linenum)
+            if self.Writer.debug:
+                convertline = '\t'
+                for keynum, key in enumerate(linedict.keys()):
+                    if keynum != 0:
+                        convertline += ', '
+                    if key == 'data':
+                        convertline += 'element data:'
+                        for ele in linedict[key]:
+                            convertline += ('\t' + _np.str(ele))
+                    else:
+                        convertline += (key + ': ' + _np.str(linedict[key]))
+                    if keynum == len(list(linedict.keys())):
+                        convertline += '.'
+                self.Writer.DebugPrintout(convertline)
 
             if self.Transport.convprops.combineDrifts:
                 if lastElementWasADrift and linedict['elementnum'] != 3.0 and linedict['elementnum'] < 20.0:
@@ -320,7 +440,7 @@ class _Convert:
                     self.Writer.DebugPrintout('\n\tConvert delayed drift(s)')
                     self.Drift(linedictDrift)
                     lastElementWasADrift = False
-                    self.Writer.DebugPrintout('\n\tNow convert element number' + _np.str(linenum))
+                    self.Writer.DebugPrintout('\n\tNow convert element number%d', linenum)
 
             if linedict['elementnum'] == 15.0:
                 self.UnitChange(linedict)
@@ -400,89 +520,64 @@ class _Convert:
         Function to extract the data and prepare it for processing by each element function.
         This has been written as the lattice lines from an input file and output file are different,
         so it just a way of correctly ordering the information.
+        line is the Token of the line returned by _General.TokeniseLine. Named parameters
+        (e.g. a beam's momentum) are read from 'data' by the element registry (pytransport.Data.Lattice).
         """
         linedict = {'elementnum': 0.0,
                     'name': '',
                     'length': 0.0,
                     'isZeroLength': True}
-        numElements = _np.str(len(self.Transport.ElementRegistry.elements))
-        typeNum = _General.GetTypeNum(line)
+        numElements = len(self.Transport.ElementRegistry.elements)
+        typeNum = line.typecode
         linedict['elementnum'] = typeNum
 
         if typeNum == 15.0:
-            label = _General.GetLabel(line)
-            if filetype == 'output':
-                linedict['label'] = line[2].strip('"')
-            if filetype == 'input':
-                linedict['label'] = label
-            linedict['number'] = line[1]
+            if len(line.params) < 1:
+                raise IndexError("Unit control line has no unit type.")
+            linedict['label'] = line.label
+            linedict['data'] = list(line.params)
             self.Writer.ElementPrepDebugPrintout("Unit Control", numElements)
 
         if typeNum == 20.0:
-            angle = 0  # Default
-            if len(line) == 2:  # i.e has a label
-                endofline = _General.FindEndOfLine(line[1])
-                angle = line[1][:endofline]
-            else:
-                for index in line[1:]:
-                    try:
-                        angle = _np.float(index)
-                        break
-                    except ValueError:
-                        pass
-            linedict['angle'] = angle
+            linedict['data'] = list(line.params)  # angle is the first entry, default 0
             self.Writer.ElementPrepDebugPrintout("coordinate rotation", numElements)
 
         if typeNum == 1.0:
-            linedict['name'] = _General.GetLabel(line)
+            linedict['name'] = line.label
             linedict['isAddition'] = False
             if _General.CheckIsAddition(line, filetype):
                 linedict['isAddition'] = True
-            # line = self._remove_label(line)
-            if len(line) < 8:
+            if len(line.params) < 7:
                 raise IndexError("Incorrect number of beam parameters.")
-            n = 1
-            if filetype == 'input':
-                n = 0
-            elif filetype == 'output':
-                n = 1
-
-            linedict['momentum'] = line[7 + n]
-            linedict['Sigmax'] = line[1 + n]
-            linedict['Sigmay'] = line[3 + n]
-            linedict['Sigmaxp'] = line[2 + n]
-            linedict['Sigmayp'] = line[4 + n]
-            linedict['SigmaT'] = line[5 + n]
-            linedict['SigmaE'] = line[6 + n]
+            # Sigmax, Sigmaxp, Sigmay, Sigmayp, SigmaT, SigmaE, momentum
+            linedict['data'] = list(line.params)
             self.Writer.ElementPrepDebugPrintout("Beam definition or r.m.s addition", numElements)
 
         if typeNum == 2.0:
-            linedict['name'] = _General.GetLabel(line)
-            linedict['data'] = _General.GetElementData(line)
+            linedict['name'] = line.label
+            linedict['data'] = list(line.params)
             self.Writer.ElementPrepDebugPrintout("poleface rotation", numElements)
 
         if typeNum == 3.0:
-            linedict['name'] = _General.GetLabel(line)
-            data = _General.GetElementData(line)
+            linedict['name'] = line.label
+            data = list(line.params)
             linedict['length'] = data[0]
             linedict['isZeroLength'] = False
             self.Writer.ElementPrepDebugPrintout("drift", numElements)
 
         if typeNum == 4.0:
-            linedict['name'] = _General.GetLabel(line)
+            linedict['name'] = line.label
             linedict['linenum'] = linenum
-            data = _General.GetElementData(line)
+            data = list(line.params)
             linedict['data'] = data
             linedict['length'] = data[0]
             linedict['isZeroLength'] = False
-            e1, e2 = _General.GetFaceRotationAngles(self.Transport.data, linenum)
-            linedict['e1'] = e1
-            linedict['e2'] = e2
+            linedict['e1'], linedict['e2'] = self.Transport.polefaceAngles[linenum]
             self.Writer.ElementPrepDebugPrintout("dipole", numElements)
 
         if typeNum == 5.0:
-            linedict['name'] = _General.GetLabel(line)
-            data = _General.GetElementData(line)
+            linedict['name'] = line.label
+            data = list(line.params)
             linedict['data'] = data
             linedict['length'] = data[0]
             linedict['isZeroLength'] = False
@@ -503,13 +598,12 @@ class _Convert:
                 # element which can be ignored as it shouldnt affect the beamline. Ignore beam definition too in
                 # the case where machine splitting is not permitted.
                 for nextline in self.Transport.data[linenum + 1:]:
-                    nextTypeNum = _General.GetTypeNum(nextline)
+                    nextTypeNum = nextline.typecode
                     if nextTypeNum == 3.0:
-                        nextData = _General.GetElementData(nextline)
-                        linedict['length'] = nextData[0]
+                        linedict['length'] = nextline.params[0]
                         linedict['isZeroLength'] = False
-                        linedict['name'] = _General.GetLabel(line)
-                        data = _General.GetElementData(line)
+                        linedict['name'] = line.label
+                        data = list(line.params)
                         linedict['data'] = data
                         break
                     # stop if physical element or beam redef if splitting permitted
@@ -531,47 +625,43 @@ class _Convert:
             self.Writer.ElementPrepDebugPrintout("repetition control", numElements)
 
         if typeNum == 11.0:
-            linedict['name'] = _General.GetLabel(line)
-            data = _General.GetElementData(line)
+            linedict['name'] = line.label
+            data = list(line.params)
             linedict['data'] = data
-            linedict['length'] = data[0]
-            linedict['voltage'] = data[1]
+            linedict['length'] = data[0]  # followed by voltage, and phase_lag and wavel in older case for single element
             linedict['isZeroLength'] = False
-            if len(data) == 4:  # Older case for single element
-                linedict['phase_lag'] = data[2]
-                linedict['wavel'] = data[3]
             self.Writer.ElementPrepDebugPrintout("acceleration element", numElements)
 
         if typeNum == 12.0:
-            linedict['data'] = _General.GetElementData(line)
-            linedict['name'] = _General.GetLabel(line)
+            linedict['data'] = list(line.params)
+            linedict['name'] = line.label
 
-            prevline = self.Transport.data[linenum - 1]  # .split(' ')
-            linedict['prevlinenum'] = _np.float(prevline[0])
+            prevline = self.Transport.data[linenum - 1]
+            linedict['prevlinenum'] = prevline.typecode
             linedict['isAddition'] = False
-            if _General.CheckIsAddition(line):
+            if _General.CheckIsAddition(line, filetype):
                 linedict['isAddition'] = True
             self.Writer.ElementPrepDebugPrintout("beam rotation", numElements)
 
         if typeNum == 13.0:
-            linedict['data'] = _General.GetElementData(line)
+            linedict['data'] = list(line.params)
             self.Writer.ElementPrepDebugPrintout("Input/Output control", numElements)
 
         if typeNum == 16.0:
-            linedict['data'] = _General.GetElementData(line)
+            linedict['data'] = list(line.params)
             self.Writer.ElementPrepDebugPrintout("special input", numElements)
 
         if typeNum == 18.0:
-            linedict['name'] = _General.GetLabel(line)
-            data = _General.GetElementData(line)
+            linedict['name'] = line.label
+            data = list(line.params)
             linedict['data'] = data
             linedict['length'] = data[0]
             linedict['isZeroLength'] = False
             self.Writer.ElementPrepDebugPrintout("sextupole", numElements)
 
         if typeNum == 19.0:
-            linedict['name'] = _General.GetLabel(line)
-            data = _General.GetElementData(line)
+            linedict['name'] = line.label
+            data = list(line.params)
             linedict['data'] = data
             linedict['length'] = data[0]
             linedict['isZeroLength'] = False
@@ -600,7 +690,7 @@ class _Convert:
                 self.Transport.AddOptions()
             self.Transport.machine.AddSampler('all')
             self.Writer.BeamDebugPrintout(self.Transport.beamprops, self.Transport.units)
-            fname = _General.RemoveFileExt(self.Transport.convprops.file)
+            fname = _General.RemoveFileExt(_os.path.basename(self.Transport.convprops.file))
             if self.Transport.convprops.numberparts < 0:
                 filename = fname
             else:
@@ -644,24 +734,22 @@ class _Convert:
             return
         elif driftlen == 0:
             self.Writer.DebugPrintout('\tZero length element, writing as marker.')
-            elementid = self._GetTransportElementName(linedict['name'])
-            if not elementid:  # check on empty string
-                elementid = 'MA' + _np.str(self.Transport.machineprops.drifts)
+            elementid = self._GetTransportElementName(linedict['name'],
+                                                      'MA' + _np.str(self.Transport.machineprops.drifts))
             self.Transport.machine.AddMarker(name=elementid)
             return
         else:
             lenInM = driftlen * _General.ScaleToMeters(self.Transport, 'element_length')  # length in metres
 
             self.Transport.machineprops.drifts += 1
-            elementid = self._GetTransportElementName(linedict['name'])
-            if not elementid:  # check on empty string
-                elementid = 'DR'+_np.str(self.Transport.machineprops.drifts)
+            elementid = self._GetTransportElementName(linedict['name'],
+                                                      'DR' + _np.str(self.Transport.machineprops.drifts))
 
             # pybdsim and pymadx are the same.
             self.Transport.machine.AddDrift(name=elementid, length=lenInM)
 
             self.Writer.DebugPrintout('\tConverted to:')
-            self.Writer.DebugPrintout('\t' + 'Drift ' + elementid + ', length ' + _np.str(lenInM) + ' m')
+            self.Writer.DebugPrintout('\tDrift %s, length %s m', elementid, lenInM)
 
     def Dipole(self, linedict):
         linenum = linedict['linenum']
@@ -673,9 +761,9 @@ class _Convert:
         e2 = linedict['e2'] * ((_np.pi / 180.0)*self.Transport.machineprops.bending)  # Exit pole face rotation.
 
         if e1 != 0:
-            self.Writer.DebugPrintout('\tPreceding element on line (' + _np.str(linenum-1) + ') of the inout file provides an entrance poleface rotation of ' + _np.str(_np.round(e1, 4)) + ' rad.')
+            self.Writer.DebugPrintout('\tPreceding element on line (%s) of the inout file provides an entrance poleface rotation of %s rad.', linenum-1, _np.round(e1, 4))
         if e2 != 0:
-            self.Writer.DebugPrintout('\tFollowing element on line (' + _np.str(linenum+1) + ') of the input file provides an exit poleface rotation of ' + _np.str(_np.round(e2, 4)) + ' rad.')
+            self.Writer.DebugPrintout('\tFollowing element on line (%s) of the input file provides an exit poleface rotation of %s rad.', linenum+1, _np.round(e2, 4))
 
         # Fringe Field Integrals
         fintVal = 0
@@ -690,8 +778,8 @@ class _Convert:
             fintxSecVal = self.Transport.machineprops.secondfringeInt
 
         if (fintVal != 0) or (fintxVal != 0):
-            self.Writer.DebugPrintout('\tA previous entry set the fringe field integral K1=' + _np.str(self.Transport.machineprops.fringeIntegral) + '.')
-            self.Writer.DebugPrintout('\tA previous entry set the second fringe field integral K2=' + _np.str(self.Transport.machineprops.secondfringeInt) + '.')
+            self.Writer.DebugPrintout('\tA previous entry set the fringe field integral K1=%s.', self.Transport.machineprops.fringeIntegral)
+            self.Writer.DebugPrintout('\tA previous entry set the second fringe field integral K2=%s.', self.Transport.machineprops.secondfringeInt)
 
         hgap = self.Transport.machineprops.dipoleVertAper * self.Transport.scale[self.Transport.units['bend_vert_gap'][0]]
 
@@ -699,9 +787,9 @@ class _Convert:
         h1 = self.Transport.machineprops.bendInCurvature
         h2 = self.Transport.machineprops.bendOutCurvature
         if self.Transport.machineprops.bendInCurvature != 0:
-            self.Writer.DebugPrintout('\tA previous entry set the dipole poleface entrance curvature H1=' + _np.str(self.Transport.machineprops.bendInCurvature) + '.')
+            self.Writer.DebugPrintout('\tA previous entry set the dipole poleface entrance curvature H1=%s.', self.Transport.machineprops.bendInCurvature)
         if self.Transport.machineprops.bendOutCurvature != 0:
-            self.Writer.DebugPrintout('\tA previous entry set the dipole poleface entrance curvature H2=' + _np.str(self.Transport.machineprops.bendOutCurvature) + '.')
+            self.Writer.DebugPrintout('\tA previous entry set the dipole poleface entrance curvature H2=%s.', self.Transport.machineprops.bendOutCurvature)
 
         # Calculate bending angle
         if self.Transport.machineprops.benddef:
@@ -713,9 +801,9 @@ class _Convert:
             else:
                 rho = self.Transport.beamprops.brho / (_np.float(field_in_Tesla))         # Calculate bending radius.
                 angle = (_np.float(length) / rho) * self.Transport.machineprops.bending   # for direction of bend
-            self.Writer.DebugPrintout('\tbfield = ' + _np.str(field_in_Gauss) + ' kG')
-            self.Writer.DebugPrintout('\tbfield = ' + _np.str(field_in_Tesla) + ' T')
-            self.Writer.DebugPrintout('\tCorresponds to angle of ' + _np.str(_np.round(angle, 4)) + ' rad.')
+            self.Writer.DebugPrintout('\tbfield = %s kG', field_in_Gauss)
+            self.Writer.DebugPrintout('\tbfield = %s T', field_in_Tesla)
+            self.Writer.DebugPrintout('\tCorresponds to angle of %s rad.', _np.round(angle, 4))
         else:
             angle_in_deg = dipoledata[1]
             angle = angle_in_deg * (_np.pi/180.) * self.Transport.machineprops.bending
@@ -724,13 +812,13 @@ class _Convert:
         lenInM = length * _General.ScaleToMeters(self.Transport, 'element_length')
 
         self.Transport.machineprops.dipoles += 1
-        elementid = self._GetTransportElementName(linedict['name'])
-        if not elementid:  # check on empty string
-            elementid = 'BM' + _np.str(self.Transport.machineprops.dipoles)
+        elementid = self._GetTransportElementName(linedict['name'], 'BM' + _np.str(self.Transport.machineprops.dipoles))
 
         # pybdsim and pymadx set differently depending on second fringe field integral. Check for non zero pole face rotation.
+        # When converting to both, the madx machine leaves out the second fringe field integrals.
+        madxOnly = not self.Transport.convprops.gmadoutput
         if (e1 != 0) and (e2 != 0):
-            if self.Transport.convprops.madxoutput:
+            if madxOnly:
                 self.Transport.machine.AddDipole(name=elementid, category='sbend', length=lenInM,
                                                  angle=_np.round(angle, 4), e1=_np.round(e1, 4), e2=_np.round(e2, 4),
                                                  fint=fintVal, fintx=fintxVal, hgap=hgap)
@@ -740,7 +828,7 @@ class _Convert:
                                                  fint=fintVal, fintx=fintxVal, fintK2=fintSecVal, fintxK2=fintxSecVal,
                                                  hgap=hgap)
         elif (e1 != 0) and (e2 == 0):
-            if self.Transport.convprops.madxoutput:
+            if madxOnly:
                 self.Transport.machine.AddDipole(name=elementid, category='sbend', length=lenInM,
                                                  angle=_np.round(angle, 4), e1=_np.round(e1, 4), fint=fintVal, fintx=0,
                                                  hgap=hgap)
@@ -749,7 +837,7 @@ class _Convert:
                                                  angle=_np.round(angle, 4), e1=_np.round(e1, 4), fint=fintVal, fintx=0,
                                                  fintK2=fintSecVal, fintxK2=0, hgap=hgap)
         elif (e1 == 0) and (e2 != 0):
-            if self.Transport.convprops.madxoutput:
+            if madxOnly:
                 self.Transport.machine.AddDipole(name=elementid, category='sbend', length=lenInM,
                                                  angle=_np.round(angle, 4), e2=_np.round(e2, 4), fint=0, fintx=fintxVal,
                                                  hgap=hgap)
@@ -761,6 +849,8 @@ class _Convert:
             self.Transport.machine.AddDipole(name=elementid, category='sbend', length=lenInM, angle=_np.round(angle, 4))
 
         # Debug output
+        if not self.Writer.debug:
+            return
         if (e1 != 0) and (e2 != 0):
             polefacestr = ', e1= ' + _np.str(_np.round(e1, 4)) + ' rad, e2= ' + _np.str(_np.round(e2, 4)) + ' rad'
         elif (e1 != 0) and (e2 == 0):
@@ -816,9 +906,8 @@ class _Convert:
             # For conversion to correct direction. Eg in TRANSPORT -90 is upwards, in BDSIM, 90 is upwards.
             anginrad = self.Transport.machineprops.angle * (_np.pi / 180)
             self.Transport.machineprops.transforms += 1
-            elementid = self._GetTransportElementName(linedict['name'])
-            if not elementid:  # check on empty string
-                elementid = 't' + _np.str(self.Transport.machineprops.transforms)
+            elementid = self._GetTransportElementName(linedict['name'],
+                                                      't' + _np.str(self.Transport.machineprops.transforms))
 
             # only call for gmad, warning for madx
             if self.Transport.convprops.gmadoutput:
@@ -828,14 +917,15 @@ class _Convert:
 
             rotation = True
 
-        if rotation:
-            self.Writer.DebugPrintout('\tConverted to:')
-            debugstring = '\tTransform3D ' + elementid + ', angle ' + _np.str(_np.round(self.Transport.machineprops.angle, 4)) + ' rad'
-            self.Writer.DebugPrintout('\t'+debugstring)
-        elif self.Transport.machineprops.angle == 180:
-            self.Writer.DebugPrintout('\tBending direction set to Right')
-        elif self.Transport.machineprops.angle == -180:
-            self.Writer.DebugPrintout('\tBending direction set to Left')
+        if self.Writer.debug:
+            if rotation:
+                self.Writer.DebugPrintout('\tConverted to:')
+                debugstring = '\tTransform3D ' + elementid + ', angle ' + _np.str(_np.round(self.Transport.machineprops.angle, 4)) + ' rad'
+                self.Writer.DebugPrintout('\t'+debugstring)
+            elif self.Transport.machineprops.angle == 180:
+                self.Writer.DebugPrintout('\tBending direction set to Right')
+            elif self.Transport.machineprops.angle == -180:
+                self.Writer.DebugPrintout('\tBending direction set to Left')
 
     def Quadrupole(self, linedict):
         quaddata = linedict['data']
@@ -853,27 +943,27 @@ class _Convert:
 
         self.Transport.machineprops.quads += 1
 
-        elementid = self._GetTransportElementName(linedict['name'])
-        if not elementid:  # check on empty string
-            if field_gradient > 0:
-                elementid = 'QF' + _np.str(self.Transport.machineprops.quads)
-            elif field_gradient < 0:
-                elementid = 'QD' + _np.str(self.Transport.machineprops.quads)
-            else:
-                elementid = 'NULLQUAD' + _np.str(self.Transport.machineprops.quads)  # For K1 = 0.
+        if field_gradient > 0:
+            defaultName = 'QF' + _np.str(self.Transport.machineprops.quads)
+        elif field_gradient < 0:
+            defaultName = 'QD' + _np.str(self.Transport.machineprops.quads)
+        else:
+            defaultName = 'NULLQUAD' + _np.str(self.Transport.machineprops.quads)  # For K1 = 0.
+        elementid = self._GetTransportElementName(linedict['name'], defaultName)
 
         # pybdsim and pymadx are the same.
         self.Transport.machine.AddQuadrupole(name=elementid, length=lenInM, k1=_np.round(field_gradient, 4))
 
-        string1 = '\tQuadrupole, field in gauss = ' + _np.str(field_in_Gauss) + ' G, field in Tesla = ' + _np.str(field_in_Tesla) + ' T.'
-        string2 = '\tBeampipe radius = ' + _np.str(pipe_in_metres) + ' m. Field gradient = '+ _np.str(field_in_Tesla/pipe_in_metres) + ' T/m.'
-        string3 = '\tBrho = ' + _np.str(_np.round(self.Transport.beamprops.brho, 4)) + ' Tm. K1 = ' +_np.str(_np.round(field_gradient, 4)) + ' m^-2'
-        self.Writer.DebugPrintout(string1)
-        self.Writer.DebugPrintout(string2)
-        self.Writer.DebugPrintout(string3)
-        self.Writer.DebugPrintout('\tConverted to:')
-        debugstring = 'Quadrupole ' + elementid + ', length= ' + _np.str(lenInM) + ' m, k1= ' + _np.str(_np.round(field_gradient, 4)) + ' T/m'
-        self.Writer.DebugPrintout('\t' + debugstring)
+        if self.Writer.debug:
+            string1 = '\tQuadrupole, field in gauss = ' + _np.str(field_in_Gauss) + ' G, field in Tesla = ' + _np.str(field_in_Tesla) + ' T.'
+            string2 = '\tBeampipe radius = ' + _np.str(pipe_in_metres) + ' m. Field gradient = '+ _np.str(field_in_Tesla/pipe_in_metres) + ' T/m.'
+            string3 = '\tBrho = ' + _np.str(_np.round(self.Transport.beamprops.brho, 4)) + ' Tm. K1 = ' +_np.str(_np.round(field_gradient, 4)) + ' m^-2'
+            self.Writer.DebugPrintout(string1)
+            self.Writer.DebugPrintout(string2)
+            self.Writer.DebugPrintout(string3)
+            self.Writer.DebugPrintout('\tConverted to:')
+            debugstring = 'Quadrupole ' + elementid + ', length= ' + _np.str(lenInM) + ' m, k1= ' + _np.str(_np.round(field_gradient, 4)) + ' T/m'
+            self.Writer.DebugPrintout('\t' + debugstring)
 
     def Collimator(self, linedict):
         """
@@ -906,9 +996,8 @@ class _Convert:
         apery_in_metres = apery * _General.ScaleToMeters(self.Transport, 'y')
 
         self.Transport.machineprops.collimators += 1
-        elementid = self._GetTransportElementName(linedict['name'])
-        if not elementid:  # check on empty string
-            elementid = 'COL'+_np.str(self.Transport.machineprops.collimators)
+        elementid = self._GetTransportElementName(linedict['name'],
+                                                  'COL' + _np.str(self.Transport.machineprops.collimators))
 
         collimatorMaterial = 'copper'  # Default in BDSIM, added to prevent warnings
         # only call for gmad, warning for madx
@@ -918,14 +1007,15 @@ class _Convert:
         elif self.Transport.convprops.madxoutput:
             self.Writer.DebugPrintout('\tWarning, MadX Builder does not have RCOL')
 
-        debugstring = '\tCollimator, x aperture = ' + _np.str(aperx_in_metres) \
-                      + ' m, y aperture = ' + _np.str(apery_in_metres) + ' m.'
-        self.Writer.DebugPrintout(debugstring)
-        self.Writer.DebugPrintout('\tConverted to:')
-        debugstring = 'Collimator ' + elementid + ', length= ' + _np.str(lenInM)\
-                      + ' m, xsize= ' + _np.str(_np.round(aperx_in_metres, 4))
-        debugstring += ' m, ysize= ' + _np.str(_np.round(apery_in_metres, 4)) + ' m.'
-        self.Writer.DebugPrintout('\t' + debugstring)
+        if self.Writer.debug:
+            debugstring = '\tCollimator, x aperture = ' + _np.str(aperx_in_metres) \
+                          + ' m, y aperture = ' + _np.str(apery_in_metres) + ' m.'
+            self.Writer.DebugPrintout(debugstring)
+            self.Writer.DebugPrintout('\tConverted to:')
+            debugstring = 'Collimator ' + elementid + ', length= ' + _np.str(lenInM)\
+                          + ' m, xsize= ' + _np.str(_np.round(aperx_in_metres, 4))
+            debugstring += ' m, ysize= ' + _np.str(_np.round(apery_in_metres, 4)) + ' m.'
+            self.Writer.DebugPrintout('\t' + debugstring)
 
     def Acceleration(self, linedict):
         """
@@ -960,7 +1050,7 @@ class _Convert:
         gradient /= (acclen * self.Transport.scale[self.Transport.units['element_length'][0]])  # gradient in MV/m
 
         self.Transport.machineprops.rf += 1
-        elname = "ACC" + _np.str(self.Transport.machineprops.rf)
+        elname = self._GetTransportElementName('', "ACC" + _np.str(self.Transport.machineprops.rf))
 
         # only call for gmad, warning for madx
         if self.Transport.convprops.gmadoutput:
@@ -1000,17 +1090,17 @@ class _Convert:
         field_gradient = (2*field_in_Tesla / pipe_in_metres**2) / self.Transport.beamprops.brho  # K2 in correct units
 
         self.Transport.machineprops.sextus += 1
-        elementid = self._GetTransportElementName(linedict['name'])
-        if not elementid:  # check on empty string
-            elementid = 'SEXT'+_np.str(self.Transport.machineprops.sextus)
+        elementid = self._GetTransportElementName(linedict['name'],
+                                                  'SEXT' + _np.str(self.Transport.machineprops.sextus))
 
         # pybdsim and pymadx are the same.
         self.Transport.machine.AddSextupole(name=elementid, length=lenInM, k2=_np.round(field_gradient, 4))
 
-        self.Writer.DebugPrintout('\tConverted to:')
-        debugstring = 'Sextupole ' + elementid + ', length ' + _np.str(lenInM) + \
-                      ' m, k2 ' + _np.str(_np.round(field_gradient, 4)) + ' T/m^2'
-        self.Writer.DebugPrintout('\t' + debugstring)
+        if self.Writer.debug:
+            self.Writer.DebugPrintout('\tConverted to:')
+            debugstring = 'Sextupole ' + elementid + ', length ' + _np.str(lenInM) + \
+                          ' m, k2 ' + _np.str(_np.round(field_gradient, 4)) + ' T/m^2'
+            self.Writer.DebugPrintout('\t' + debugstring)
 
     def Solenoid(self, linedict):
         soledata = linedict['data']
@@ -1023,17 +1113,17 @@ class _Convert:
         lenInM = length * _General.ScaleToMeters(self.Transport, 'element_length')
 
         self.Transport.machineprops.solenoids += 1
-        elementid = self._GetTransportElementName(linedict['name'])
-        if not elementid:  # check on empty string
-            elementid = 'SOLE'+_np.str(self.Transport.machineprops.solenoids)
+        elementid = self._GetTransportElementName(linedict['name'],
+                                                  'SOLE' + _np.str(self.Transport.machineprops.solenoids))
 
         # pybdsim and pymadx are the same.
         self.Transport.machine.AddSolenoid(name=elementid, length=lenInM, ks=_np.round(field_in_Tesla, 4))
 
-        self.Writer.DebugPrintout('\tConverted to:')
-        debugstring = 'Solenoid ' + elementid + ', length ' + _np.str(lenInM) + \
-                      ' m, ks ' + _np.str(_np.round(field_in_Tesla, 4)) + ' T'
-        self.Writer.DebugPrintout('\t' + debugstring)
+        if self.Writer.debug:
+            self.Writer.DebugPrintout('\tConverted to:')
+            debugstring = 'Solenoid ' + elementid + ', length ' + _np.str(lenInM) + \
+                          ' m, ks ' + _np.str(_np.round(field_in_Tesla, 4)) + ' T'
+            self.Writer.DebugPrintout('\t' + debugstring)
 
     def Printline(self, linedict):
         number = linedict['data'][0]
@@ -1047,7 +1137,7 @@ class _Convert:
                 self.Transport.machineprops.benddef = True
                 self.Writer.DebugPrintout('\t47. Switched Dipoles to field definition.')
             elif number == 19:
-                if _General.CheckSingleLineOutputApplied(self.Transport.convprops.file):
+                if _General.CheckSingleLineOutputApplied(self.Transport.index):
                     self.Transport.convprops.singleLineOptics = True
                 self.Writer.DebugPrintout('\t19. Optics output switched to single line per element.')
             else:
@@ -1095,6 +1185,8 @@ class _Convert:
 
         self.Transport.beamprops.distrType = 'gausstwiss'
 
+        if not self.Writer.debug:
+            return
         self.Writer.DebugPrintout('\tConverted to:')
         self.Writer.DebugPrintout('\t Beam Correction. Sigma21 = ' + _np.str(sigma21) + ', Sigma43 = ' + _np.str(sigma43) + '.')
         self.Writer.DebugPrintout('\t Beam distribution type now switched to "gausstwiss":')
@@ -1245,142 +1337,106 @@ class _Convert:
             self.Writer.DebugPrintout(errorline)
             self.Writer.DebugPrintout(errorline2)
 
-    def _GetTransportElementName(self, elementName):
+    def _GetTransportElementName(self, elementName, defaultName):
         """
         Checks if name already used by an element in the machine.
         Appends a _N to the name where N is the lowest integer not already
         used in a elementName_N name in the machine.
+        If keepName is False or the element has no name, defaultName is used. It is registered
+        as used, so a later element named the same is given a suffix.
         """
-        if not self.Transport.convprops.keepName:
-            return ''
-
-        currElements = list(self.Transport.machine.elements.keys())
-        updatedName = elementName
-        if elementName in currElements:
-            nameNumber = 1
-            while True:
-                updatedName = elementName + "_" + _np.str(nameNumber)
-                if updatedName not in currElements:
-                    break
-                else:
-                    nameNumber += 1
-
-        return updatedName
+        if self.Transport.convprops.keepName and elementName:
+            return self.Transport.nameAllocator.Allocate(elementName)
+        self.Transport.nameAllocator.Register(defaultName)
+        return defaultName
 
     def _UpdateElementsFromFits(self):
-        # Functions that update the elements in the element registry.
-        # For debugging purposes, they return dictionaries of the element type,
-        # length change details, and which parameters were updated and the values in a list which
-        # follows the pattern of [parameter name (e.g. 'field'),oldvalue,newvalue]
-
-        # Length update common to nearly all elements, seperate function to prevent duplication
-        # fitIndex was used in the past. Pass in anyway in case of future need, just delete for now.
-        def _updateLength(eleIndex, fitIndex, element):
-            del fitIndex
-            oldlength = self.Transport.ElementRegistry.elements[eleIndex]['length']
-            lengthDiff = self.Transport.ElementRegistry.elements[eleIndex]['length'] - element['length']
-            self.Transport.ElementRegistry.elements[eleIndex]['length'] = element['length']  # Update length
-            # Update running length of subsequent elements.
-            for index, value in enumerate(self.Transport.ElementRegistry.length[eleIndex:]):
-                self.Transport.ElementRegistry.length[eleIndex:][index] = value + lengthDiff
-            self.Transport.ElementRegistry._totalLength += lengthDiff  # Update total length
-            lendict = {'old': _np.round(oldlength, 5),
-                       'new': _np.round(element['length'], 5)}
-            return lendict
-
-        def _updateDrift(eleIndex, fitIndex, element):
-            eleDict = {'updated': False,
-                       'element': 'Drift',
-                       'params': []}
-
-            # Only length can be varied
-            if self.Transport.ElementRegistry.elements[eleIndex]['length'] != element['length']:
-                lendict = _updateLength(eleIndex, fitIndex, element)
-                eleDict['updated'] = True
-                eleDict['length'] = lendict
-            return eleDict
-
-        def _updateQuad(eleIndex, fitIndex, element):
-            eleDict = {'updated': False,
-                       'element': 'Quadrupole',
-                       'params': []}
-
-            if self.Transport.ElementRegistry.elements[eleIndex]['data'][1] != element['data'][1]:  # Field
-                oldvalue = self.Transport.ElementRegistry.elements[eleIndex]['data'][1]
-                self.Transport.ElementRegistry.elements[eleIndex]['data'][1] = element['data'][1]
-                eleDict['updated'] = True
-                data = ['field', oldvalue, element['data'][1]]
-                eleDict['params'].append(data)
-
-
-            if self.Transport.ElementRegistry.elements[eleIndex]['length'] != element['length']:
-                self.Transport.ElementRegistry.elements[eleIndex]['data'][0] = element['data'][0]  # Length in data
-                lendict = _updateLength(eleIndex, fitIndex, element)
-                eleDict['length'] = lendict
-                eleDict['updated'] = True
-
-            return eleDict
-
-        def _updateDipole(eleIndex, fitIndex, element):
-            eleDict = {'updated': False,
-                       'element': 'Dipole',
-                       'params': []}
-
-            # TODO: Need code in here to handle variation in poleface rotation. Not urgent for now.
-            if self.Transport.ElementRegistry.elements[eleIndex]['data'][1] != element['data'][1]:  # Field
-                oldvalue = self.Transport.ElementRegistry.elements[eleIndex]['data'][1]
-                if not self.Transport.machineprops.benddef:  # Transport can switch dipole input definition
-                    par = 'field'
-                    self.Transport.ElementRegistry.elements[eleIndex]['data'][1] = element['data'][1]
-                    eleDict['updated'] = True
-                else:
-                    par = 'angle'
-                    self.Transport.ElementRegistry.elements[eleIndex]['data'][1] = element['data'][3]
-                    eleDict['updated'] = True
-                data = [par, oldvalue, element['data'][3]]
-                eleDict['params'].append(data)
-            if self.Transport.ElementRegistry.elements[eleIndex]['length'] != element['length']:
-                self.Transport.ElementRegistry.elements[eleIndex]['data'][0] = element['data'][0]  # Length in data
-                lendict = _updateLength(eleIndex, fitIndex, element)
-                eleDict['updated'] = True
-                eleDict['length'] = lendict
-            return eleDict
+        """
+        Update the elements in the element registry with the results from fitting. The n-th
+        fitted element of a name and type code updates the n-th element of the same name and
+        type code in the registry. Only the lengths of drifts, dipoles and quadrupoles, and
+        the fields (or angles) of dipoles and quadrupoles are updated.
 
+        Returns a structured array of the changes with the columns element (registry index),
+        fit (fit registry index), parameter, old and new.
+        """
+        registry = self.Transport.ElementRegistry
+        fits = self.Transport.FitRegistry
         self.Writer.DebugPrintout("")
         self.Writer.DebugPrintout("Updating elements with results from fitting")
-        for index, name in enumerate(self.Transport.FitRegistry._uniquenames):
-            fitindex = self.Transport.FitRegistry.GetElementIndex(name)
-            eleindex = self.Transport.ElementRegistry.GetElementIndex(name)
-
-            for fitnum, fit in enumerate(fitindex):
-                for elenum, ele in enumerate(eleindex):
-                    fitelement = self.Transport.FitRegistry.elements[fitindex[fitnum]]
-                    regElementnum = self.Transport.ElementRegistry.elements[eleindex[elenum]]['elementnum']
-                    if regElementnum != fitelement['elementnum']:
-                        pass
-                    else:
-                        if fitelement['elementnum'] == 3:
-                            eledict = _updateDrift(eleindex[elenum], fitindex[fitnum], fitelement)
-                        elif fitelement['elementnum'] == 4:
-                            eledict = _updateDipole(eleindex[elenum], fitindex[fitnum], fitelement)
-                        elif fitelement['elementnum'] == 5:
-                            eledict = _updateQuad(eleindex[elenum], fitindex[fitnum], fitelement)
-
-                        if eledict['updated']:
-                            self.Writer.DebugPrintout(
-                                "Element " + _np.str(eleindex[elenum]) + " was updated from fitting:")
-                            self.Writer.DebugPrintout("\tOptics Output line:")
-                            self.Writer.DebugPrintout(
-                                "\t\t'" + self.Transport.FitRegistry.lines[fitindex[fitnum]] + "'")
-                            if 'length' in eledict:
-                                lenline = "\t" + eledict['element'] + " length updated to "
-                                lenline += _np.str(eledict['length']['new'])
-                                lenline += " (from " + _np.str(eledict['length']['old']) + ")."
-                                self.Writer.DebugPrintout(lenline)
-                            for param in eledict['params']:
-                                parline = "\t" + eledict['element'] + " " + param[0]
-                                parline += " updated to " + _np.str(param[2]) + " (from " + _np.str(param[1]) + ")."
-                                self.Writer.DebugPrintout(parline)
-                                # self.Writer.DebugPrintout("\n")
 
-                            break
+        eleIndex, fitIndex = registry.MatchElements(fits, typecodes=(3.0, 4.0, 5.0))
+        table = registry.table
+        fitTable = fits.table
+        typecodes = table['typecode'][eleIndex]
+        changes = []
+
+        def _change(mask, parameter, old, new):
+            change = _np.zeros(_np.count_nonzero(mask), dtype=_fitChangeDtype)
+            change['element'] = eleIndex[mask]
+            change['fit'] = fitIndex[mask]
+            change['parameter'] = parameter
+            change['old'] = old[mask]
+            change['new'] = new[mask]
+            changes.append(change)
+
+        # Length, which is also the first parameter of dipoles and quadrupoles.
+        oldLength = table['length'][eleIndex]
+        newLength = fitTable['length'][fitIndex]
+        lengthChanged = oldLength != newLength
+        _change(lengthChanged, 'length', _np.round(oldLength, 5), _np.round(newLength, 5))
+        withParams = lengthChanged & (typecodes != 3.0)
+        table['params'][eleIndex[withParams], 0] = fitTable['params'][fitIndex[withParams], 0]
+        registry.SetLength(eleIndex[lengthChanged], newLength[lengthChanged])
+
+        # Quadrupole field.
+        oldValue = table['params'][eleIndex, 1]
+        newField = fitTable['params'][fitIndex, 1]
+        quads = (typecodes == 5.0) & (oldValue != newField)
+        _change(quads, 'field', oldValue, newField)
+
+        # Dipole field or angle. Transport can switch the dipole input definition.
+        # TODO: Need code in here to handle variation in poleface rotation. Not urgent for now.
+        fieldDefined = self._DipolesFieldDefined()[eleIndex]
+        newAngle = fitTable['params'][fitIndex, 3]
+        newValue = _np.where(fieldDefined, newField, newAngle)
+        dipoles = (typecodes == 4.0) & (oldValue != newValue)
+        _change(dipoles & fieldDefined, 'field', oldValue, newField)
+        _change(dipoles & ~fieldDefined, 'angle', oldValue, newAngle)
+
+        updated = quads | dipoles
+        table['params'][eleIndex[updated], 1] = _np.where(quads, newField, newValue)[updated]
+
+        changelog = _np.concatenate(changes)
+        changelog = changelog[_np.argsort(changelog['fit'], kind='stable')]
+        if self.Writer.debug:
+            self._PrintFitChanges(changelog)
+        return changelog
+
+    def _DipolesFieldDefined(self):
+        """
+        Whether dipoles are defined by their field (True) or angle (False) at each element of the
+        registry, as switched by the 13. 47. and 13. 48. entries before it.
+        """
+        table = self.Transport.ElementRegistry.table
+        control = table['params'][:, 0]
+        switches = (table['typecode'] == 13.0) & ((control == 47.0) | (control == 48.0))
+        lastSwitch = _np.maximum.accumulate(_np.where(switches, _np.arange(len(table)), -1))
+        return _np.where(lastSwitch >= 0, control[lastSwitch] == 47.0, self.Transport.machineprops.benddef)
+
+    def _PrintFitChanges(self, changelog):
+        """
+        Debug output of the changes made to the element registry from fitting.
+        """
+        elementTypes = {3.0: 'Drift', 4.0: 'Dipole', 5.0: 'Quadrupole'}
+        lastFit = None
+        for change in changelog:
+            if change['fit'] != lastFit:
+                lastFit = change['fit']
+                self.Writer.DebugPrintout("Element " + _np.str(change['element']) + " was updated from fitting:")
+                self.Writer.DebugPrintout("\tOptics Output line:")
+                self.Writer.DebugPrintout("\t\t'" + self.Transport.FitRegistry.lines[change['fit']] + "'")
+            elementType = elementTypes[self.Transport.ElementRegistry.table['typecode'][change['element']]]
+            parline = "\t" + elementType + " " + change['parameter']
+            parline += " updated to " + _np.str(change['new']) + " (from " + _np.str(change['old']) + ")."
+            self.Writer.DebugPrintout(parline)
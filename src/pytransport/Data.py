@@ -5,13 +5,16 @@ Data containers used in converting from Transport to gmad or madx.
 
 Classes:
 BDSData - a list of data read from Transport files.
+ColumnarData - data read from Transport files stored as one array per variable.
 ConversionData - a class for holding data during conversion.
+Lattice - a table of the elements of a TRANSPORT lattice.
 
 """
 
 import numpy as _np
 import os as _os
 from scipy import constants as _con
+import bisect as _bisect
 import copy
 from collections import defaultdict
 
@@ -95,6 +98,18 @@ class BDSData(list):
         Get a specific entry in the data as a tuple of values rather than a dictionary.
         """
         return list.__getitem__(self, index)
+
+    def __getstate__(self):
+        # the getter functions added by _AddMethod cannot be pickled, they are added again when loaded.
+        state = self.__dict__.copy()
+        for name in self.names:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for name in self.names:
+            self._AddMethod(name)
         
     def _AddMethod(self, variablename):
         """
@@ -258,12 +273,128 @@ class BDSData(list):
             self.MergeDuplicatesAtSameS()
 
 
+class ColumnarData:
+    """
+    Column oriented equivalent of BDSData. Each variable is stored as one numpy array
+    with the variable names and units in 'names' and 'units'. Getter functions are
+    added for each variable as in BDSData, e.g. data.Beta_x().
+
+    Indexing returns a dictionary of the values for that entry, as in BDSData.
+    """
+    def __init__(self):
+        self.units   = []
+        self.names   = []
+        self.columns = self.names
+        self._data   = {}
+
+    def __len__(self):
+        if not self.names:
+            return 0
+        return len(self._data[self.names[0]])
+
+    def __getitem__(self, index):
+        return dict(zip(self.names, self.GetItemTuple(index)))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.GetItemTuple(index)
+
+    def GetItemTuple(self, index):
+        """
+        Get a specific entry in the data as a tuple of values rather than a dictionary.
+        """
+        return tuple(self._data[name][index] for name in self.names)
+
+    def __getstate__(self):
+        # the getter functions added by _AddMethod cannot be pickled, they are added again when loaded.
+        state = self.__dict__.copy()
+        for name in self.names:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for name in self.names:
+            self._AddMethod(name)
+
+    def _AddProperty(self, variablename, values, variableunit='NA'):
+        """
+        This is used to add a new variable with its values and hence new getter function.
+        """
+        values = _np.asarray(values)
+        if (len(self.names) > 0) and (len(values) != len(self)):
+            raise ValueError("Length of " + variablename + " does not match the other variables in this data")
+        self.names.append(variablename)
+        self.units.append(variableunit)
+        self._data[variablename] = values
+        self._AddMethod(variablename)
+
+    def _AddMethod(self, variablename):
+        """
+        This is used to dynamically add a getter function for a variable name.
+        """
+        def GetAttribute():
+            return self._data[variablename]
+        setattr(self, variablename, GetAttribute)
+
+    def GetColumn(self, columnstring):
+        """
+        Return the numpy array of the values in columnstring in order as they appear
+        in the beamline. The stored array is returned, not a copy.
+        """
+        if columnstring not in self.columns:
+            raise ValueError("Invalid column name")
+        return self._data[columnstring]
+
+    def Filter(self, booleanarray):
+        """
+        Filter the data with a booleanarray.  Where true, will return
+        that event in the data.
+
+        Return type is ColumnarData
+        """
+        booleanarray = _np.asarray(booleanarray, dtype=bool)
+        a = ColumnarData()
+        for name, unit in zip(self.names, self.units):
+            a._AddProperty(name, self._data[name][booleanarray], unit)
+        return a
+
+    def MatchValue(self, parametername, matchvalue, tolerance):
+        """
+        This is used to filter the instance of the class based on matching
+        a parameter withing a certain tolerance, see BDSData.MatchValue.
+
+        Return type is ColumnarData
+        """
+        if parametername in self.names:
+            return self.Filter(_np.abs(self._data[parametername] - matchvalue) <= tolerance)
+        else:
+            print("The parameter: ", parametername, " does not exist in this instance")
+
+    def ToBDSData(self):
+        """
+        Return the data as a row based BDSData instance.
+        """
+        a = BDSData()
+        for name, unit in zip(self.names, self.units):
+            a._AddProperty(name, unit)
+        a.extend([list(event) for event in zip(*[self._data[name].tolist() for name in self.names])])
+        return a
+
+    def __repr__(self):
+        s = ''
+        s += 'pytransport.Data.ColumnarData instance\n'
+        s += str(len(self)) + ' entries'
+        return s
+
+
 class ConversionData:
     """
     Class used as data container object in Transport2Gmad / Transport2Madx conversion.
     Required input:
     - inputfile: string, inputfile name
-    - machine: either pybdsim.Builder.Machine or pymadx.Builder.Machine instance.
+    - machine: either pybdsim.Builder.Machine or pymadx.Builder.Machine instance, or a _BothMachines instance
+               when converting to gmad and madx at the same time.
 
     Note: if used as a holder for conversion to gmad, options must be supplied a pybdsim.Options.Options instance.
 
@@ -313,13 +444,23 @@ class ConversionData:
         self.machine = machine
         self.beam = self.machine.beam
         self.beam['offsetSampleMean'] = 0
+        # the madx beam when converting to both formats, each target has its own beam.
+        self.madxBeam = None
+        if isinstance(self.machine, _BothMachines):
+            self.madxBeam = self.machine.madx.beam
 
         # make a copy of the empty machine. Copy needed in case machine is split and a new machine is needed.
-        self._machineCopy = copy.deepcopy(self.machine)
+        # The pytransport emitter (pytransport._Emitter.Machine) makes a new empty machine instead.
+        self._machineCopy = None
+        if not hasattr(self.machine, 'Empty'):
+            self._machineCopy = copy.deepcopy(self.machine)
+        # unique names of the elements in the machine, reset with the machine.
+        self.nameAllocator = _NameAllocator()
 
         # initialise registries
-        self.ElementRegistry = _Registry()
-        self.FitRegistry = _Registry()
+        self.ElementRegistry = Lattice()
+        self.FitRegistry = Lattice()
+        self.fitChanges = None  # Changes made to the element registry from fitting, see _Convert._UpdateElementsFromFits
 
         self.units = {  # Default TRANSPORT units
             'x': 'cm',
@@ -350,8 +491,10 @@ class ConversionData:
         }
 
         self.accstart = []  # An index of the start of acceleration elements.
-        self.data = []  # A list that will contain arrays of the element data
+        self.data = []  # A list that will contain the tokenised lines (pytransport._General.Token)
         self.filedata = []  # A list that will contain the raw strings from the input file
+        self.polefaceAngles = None  # Entrance and exit poleface angles of the dipole on each line of data
+        self.index = None  # Section index of the input file (pytransport.Reader.IndexFile), set when loaded
 
     def AddOptions(self):
         """
@@ -375,68 +518,180 @@ class ConversionData:
         self.beam.SetParticleType(self.convprops.particle)
         self.beam.SetEnergy(energy=self.beamprops.tot_energy, unitsstring='GeV')
 
+        if isinstance(self.machine, _BothMachines):
+            self.madxBeam.SetParticleType(self.convprops.particle)
+            self.madxBeam.SetEnergy(energy=self.beamprops.tot_energy, unitsstring='GeV')
+            self._SetGmadBeam(self.beam)
+            self._SetMadxBeam(self.madxBeam)
+            self.machine.gmad.AddBeam(self.beam)
+            self.machine.madx.AddBeam(self.madxBeam)
+            return
         if self.convprops.gmadoutput:
-            # set gmad parameters depending on distribution
-            if self.beamprops.distrType == 'gausstwiss':
-                self.beam.SetDistributionType(self.beamprops.distrType)
-                self.beam.SetBetaX(self.beamprops.betx)
-                self.beam.SetBetaY(self.beamprops.bety)
-                self.beam.SetAlphaX(self.beamprops.alfx)
-                self.beam.SetAlphaY(self.beamprops.alfy)
-                self.beam.SetEmittanceX(self.beamprops.emitx, unitsstring='mm')
-                self.beam.SetEmittanceY(self.beamprops.emity, unitsstring='mm')
-                self.beam.SetSigmaE(self.beamprops.SigmaE)
-                self.beam.SetSigmaT(self.beamprops.SigmaT)
-
-            else:
-                self.beam.SetDistributionType(self.beamprops.distrType)
-                self.beam.SetSigmaX(self.beamprops.SigmaX, unitsstring=self.units['x'])
-                self.beam.SetSigmaY(self.beamprops.SigmaY, unitsstring=self.units['y'])
-                self.beam.SetSigmaXP(self.beamprops.SigmaXP, unitsstring=self.units['xp'])
-                self.beam.SetSigmaYP(self.beamprops.SigmaYP, unitsstring=self.units['yp'])
-                self.beam.SetSigmaE(self.beamprops.SigmaE)
-                self.beam.SetSigmaT(self.beamprops.SigmaT)
-
-            # set beam offsets in gmad if non zero
-            if self.beamprops.X0 != 0:
-                self.beam.SetX0(self.beamprops.X0, unitsstring=self.units['x'])
-            if self.beamprops.Y0 != 0:
-                self.beam.SetY0(self.beamprops.Y0, unitsstring=self.units['y'])
-            if self.beamprops.Z0 != 0:
-                self.beam.SetZ0(self.beamprops.Z0, unitsstring=self.units['z'])
-
+            self._SetGmadBeam(self.beam)
         elif self.convprops.madxoutput:
-            # calculate betas and emittances regardless for madx beam
-            try:
-                self.beamprops.betx = self.beamprops.SigmaX / self.beamprops.SigmaXP
-            except ZeroDivisionError:
-                self.beamprops.betx = 0
-            try:
-                self.beamprops.bety = self.beamprops.SigmaY / self.beamprops.SigmaYP
-            except ZeroDivisionError:
-                self.beamprops.bety = 0
-                self.beamprops.emitx = self.beamprops.SigmaX * self.beamprops.SigmaXP / 1000.0
-                self.beamprops.emity = self.beamprops.SigmaY * self.beamprops.SigmaYP / 1000.0
-
-            # set madx beam
-            self.beam.SetDistributionType('madx')
-            self.beam.SetBetaX(self.beamprops.betx)
-            self.beam.SetBetaY(self.beamprops.bety)
-            self.beam.SetAlphaX(self.beamprops.alfx)
-            self.beam.SetAlphaY(self.beamprops.alfy)
-            self.beam.SetEmittanceX(self.beamprops.emitx / 1000)
-            self.beam.SetEmittanceY(self.beamprops.emity / 1000)
-            self.beam.SetSigmaE(self.beamprops.SigmaE)
-            self.beam.SetSigmaT(self.beamprops.SigmaT)
-
+            self._SetMadxBeam(self.beam)
         self.machine.AddBeam(self.beam)
 
+    def _SetGmadBeam(self, beam):
+        """
+        Set the gmad beam parameters.
+        """
+        # set gmad parameters depending on distribution
+        if self.beamprops.distrType == 'gausstwiss':
+            beam.SetDistributionType(self.beamprops.distrType)
+            beam.SetBetaX(self.beamprops.betx)
+            beam.SetBetaY(self.beamprops.bety)
+            beam.SetAlphaX(self.beamprops.alfx)
+            beam.SetAlphaY(self.beamprops.alfy)
+            beam.SetEmittanceX(self.beamprops.emitx, unitsstring='mm')
+            beam.SetEmittanceY(self.beamprops.emity, unitsstring='mm')
+            beam.SetSigmaE(self.beamprops.SigmaE)
+            beam.SetSigmaT(self.beamprops.SigmaT)
+
+        else:
+            beam.SetDistributionType(self.beamprops.distrType)
+            beam.SetSigmaX(self.beamprops.SigmaX, unitsstring=self.units['x'])
+            beam.SetSigmaY(self.beamprops.SigmaY, unitsstring=self.units['y'])
+            beam.SetSigmaXP(self.beamprops.SigmaXP, unitsstring=self.units['xp'])
+            beam.SetSigmaYP(self.beamprops.SigmaYP, unitsstring=self.units['yp'])
+            beam.SetSigmaE(self.beamprops.SigmaE)
+            beam.SetSigmaT(self.beamprops.SigmaT)
+
+        # set beam offsets in gmad if non zero
+        if self.beamprops.X0 != 0:
+            beam.SetX0(self.beamprops.X0, unitsstring=self.units['x'])
+        if self.beamprops.Y0 != 0:
+            beam.SetY0(self.beamprops.Y0, unitsstring=self.units['y'])
+        if self.beamprops.Z0 != 0:
+            beam.SetZ0(self.beamprops.Z0, unitsstring=self.units['z'])
+
+    def _SetMadxBeam(self, beam):
+        """
+        Set the madx beam parameters.
+        """
+        # calculate betas and emittances regardless for madx beam
+        try:
+            self.beamprops.betx = self.beamprops.SigmaX / self.beamprops.SigmaXP
+        except ZeroDivisionError:
+            self.beamprops.betx = 0
+        try:
+            self.beamprops.bety = self.beamprops.SigmaY / self.beamprops.SigmaYP
+        except ZeroDivisionError:
+            self.beamprops.bety = 0
+            self.beamprops.emitx = self.beamprops.SigmaX * self.beamprops.SigmaXP / 1000.0
+            self.beamprops.emity = self.beamprops.SigmaY * self.beamprops.SigmaYP / 1000.0
+
+        # set madx beam
+        beam.SetDistributionType('madx')
+        beam.SetBetaX(self.beamprops.betx)
+        beam.SetBetaY(self.beamprops.bety)
+        beam.SetAlphaX(self.beamprops.alfx)
+        beam.SetAlphaY(self.beamprops.alfy)
+        beam.SetEmittanceX(self.beamprops.emitx / 1000)
+        beam.SetEmittanceY(self.beamprops.emity / 1000)
+        beam.SetSigmaE(self.beamprops.SigmaE)
+        beam.SetSigmaT(self.beamprops.SigmaT)
+
+    def TargetMachines(self):
+        """
+        List of (extension, output directory, machine) for each format being converted to.
+        """
+        if isinstance(self.machine, _BothMachines):
+            return [('.gmad', self.convprops.gmadDir, self.machine.gmad),
+                    ('.madx', self.convprops.madxDir, self.machine.madx)]
+        if self.convprops.gmadoutput:
+            return [('.gmad', self.convprops.gmadDir, self.machine)]
+        return [('.madx', self.convprops.madxDir, self.machine)]
+
     def ResetMachine(self):
         """
         Delete the machine and set to be the empty machine copied at class instantiation.
         """
-        del self.machine
-        self.machine = self._machineCopy
+        if self._machineCopy is None:
+            self.machine = self.machine.Empty()
+        else:
+            del self.machine
+            self.machine = self._machineCopy
+        self.nameAllocator.Reset()
+
+
+class _NameAllocator:
+    """
+    Allocates unique element names. A name that has already been allocated is given the
+    suffix _N, where N is the lowest integer for which the name is not already allocated.
+    The next suffix to try is kept for each name, so allocating a name takes constant time.
+    """
+    def __init__(self):
+        self._used = set()
+        self._nextSuffix = {}
+
+    def Allocate(self, name):
+        """
+        Return a unique version of name and mark it as used. Empty names are returned as they are.
+        """
+        if not name:
+            return name
+        uniqueName = name
+        if name in self._used:
+            suffix = self._nextSuffix.get(name, 1)
+            uniqueName = name + "_" + _np.str(suffix)
+            while uniqueName in self._used:
+                suffix += 1
+                uniqueName = name + "_" + _np.str(suffix)
+            self._nextSuffix[name] = suffix + 1
+        self._used.add(uniqueName)
+        return uniqueName
+
+    def Register(self, name):
+        """
+        Mark name as used without changing it, for names that may be repeated such as the default
+        names of elements without a name.
+        """
+        self._used.add(name)
+
+    def Reset(self):
+        self._used.clear()
+        self._nextSuffix.clear()
+
+
+# Add methods and keyword arguments of the pybdsim machine that the madx machine does not have.
+_gmadOnlyMethods = ['AddTransform3D', 'AddRCol', 'AddRFCavity', 'AddOptions']
+_gmadOnlyArguments = ['fintK2', 'fintxK2']
+
+
+class _BothMachines:
+    """
+    Machine for converting to gmad and madx at the same time, so each element is converted once.
+    Elements are added to both the gmad and the madx machine, leaving out the elements and
+    parameters that madx does not have. The beams are added to each machine separately.
+    """
+    def __init__(self, gmadMachine, madxMachine):
+        self.gmad = gmadMachine
+        self.madx = madxMachine
+        self.beam = gmadMachine.beam
+        # empty copies of machines that cannot make a new empty machine themselves.
+        self._emptyGmad = None if hasattr(gmadMachine, 'Empty') else copy.deepcopy(gmadMachine)
+        self._emptyMadx = None if hasattr(madxMachine, 'Empty') else copy.deepcopy(madxMachine)
+
+    def __getattr__(self, method):
+        if not method.startswith('Add'):
+            raise AttributeError(method)
+        gmadAdd = getattr(self.gmad, method)
+        madxAdd = None if method in _gmadOnlyMethods else getattr(self.madx, method)
+
+        def _Add(*args, **kwargs):
+            gmadAdd(*args, **kwargs)
+            if madxAdd is not None:
+                madxAdd(*args, **{key: value for key, value in kwargs.items() if key not in _gmadOnlyArguments})
+        return _Add
+
+    def Empty(self):
+        """
+        New empty machine for both formats.
+        """
+        gmad = self.gmad.Empty() if self._emptyGmad is None else copy.deepcopy(self._emptyGmad)
+        madx = self.madx.Empty() if self._emptyMadx is None else copy.deepcopy(self._emptyMadx)
+        return _BothMachines(gmad, madx)
 
 
 class _beamprops:
@@ -550,84 +805,275 @@ class _conversionProps:
         self.combineDrifts = combineDrifts
 
 
-class _Registry:
+# Type codes of elements whose first parameter is their length.
+_lengthTypeCodes = (3.0, 4.0, 5.0, 11.0, 18.0, 19.0)
+
+# Keys of the element dictionaries (views) of each type code, in addition to elementnum, name,
+# length and isZeroLength. Parameter keys are named entries of the parameter block.
+_typeKeys = {
+    1.0  : ['isAddition', 'momentum', 'Sigmax', 'Sigmay', 'Sigmaxp', 'Sigmayp', 'SigmaT', 'SigmaE'],
+    2.0  : ['data'],
+    4.0  : ['linenum', 'data', 'e1', 'e2'],
+    5.0  : ['data'],
+    6.0  : ['data'],
+    11.0 : ['data', 'voltage', 'phase_lag', 'wavel'],
+    12.0 : ['data', 'prevlinenum', 'isAddition'],
+    13.0 : ['data'],
+    15.0 : ['label', 'number'],
+    16.0 : ['data'],
+    18.0 : ['data'],
+    19.0 : ['data'],
+    20.0 : ['angle'],
+    }
+_paramKeys = {
+    1.0  : {'Sigmax': 0, 'Sigmaxp': 1, 'Sigmay': 2, 'Sigmayp': 3, 'SigmaT': 4, 'SigmaE': 5, 'momentum': 6},
+    11.0 : {'voltage': 1, 'phase_lag': 2, 'wavel': 3},
+    15.0 : {'number': 0},
+    20.0 : {'angle': 0},
+    }
+_columnKeys = {
+    'elementnum'   : 'typecode',
+    'length'       : 'length',
+    'isZeroLength' : 'isZeroLength',
+    'isAddition'   : 'isAddition',
+    'linenum'      : 'linenum',
+    'prevlinenum'  : 'prevtypecode',
+    'e1'           : 'e1',
+    'e2'           : 'e2',
+    }
+
+
+def _LatticeDtype(numParams):
+    return _np.dtype([('typecode',     _np.float64),
+                      ('nameid',       _np.int32),
+                      ('length',       _np.float64),
+                      ('sstart',       _np.float64),
+                      ('send',         _np.float64),
+                      ('gap',          _np.float64),  # length before the element that is not in the table
+                      ('linenum',      _np.int32),
+                      ('prevtypecode', _np.float64),
+                      ('isAddition',   _np.bool_),
+                      ('isZeroLength', _np.bool_),
+                      ('e1',           _np.float64),
+                      ('e2',           _np.float64),
+                      ('nparams',      _np.int16),
+                      ('params',       _np.float64, (numParams,))])
+
+
+def _OccurrenceKeys(nameids, typecodes):
     """
-    A class used as a registry during conversion.
+    Integer key of (name id, type code, occurrence) for each element, where occurrence counts
+    the previous elements with the same name id and type code. nameids must be an int64 array.
     """
-    def __init__(self):
-        self.elements = []
-        self.names = []
+    groups = (nameids << 8) | (_np.round(typecodes).astype(_np.int64) & 0xFF)
+    order = _np.argsort(groups, kind='stable')
+    sortedGroups = groups[order]
+    position = _np.arange(len(groups))
+    starts = _np.ones(len(groups), dtype=bool)
+    starts[1:] = sortedGroups[1:] != sortedGroups[:-1]
+    groupStart = _np.maximum.accumulate(_np.where(starts, position, 0))
+    occurrence = _np.empty(len(groups), dtype=_np.int64)
+    occurrence[order] = position - groupStart
+    return (groups << 24) | occurrence
+
+
+class Lattice:
+    """
+    Table of the elements of a TRANSPORT lattice, stored as one numpy structured array with
+    the type code, name id, length, start and end S position, and parameter block of each
+    element. Used as the element registry during conversion and returned by
+    pytransport.Reader.GetLatticeTable.
+
+    Indexing returns a dictionary-like view of an element with the keys of its type code,
+    e.g. 'elementnum', 'name', 'length' and 'data' (the parameters), and for a beam
+    'momentum', 'Sigmax' etc. Changes to a view are written to the table.
+
+    >>> lattice = pytransport.Reader.GetLatticeTable('FOR002.DAT')
+    >>> quads = lattice.table[lattice.table['typecode'] == 5.0]
+    >>> lattice[3]['name']
+    """
+    def __init__(self, numParams=16):
+        self._table = _np.zeros(64, dtype=_LatticeDtype(numParams))
+        self._size = 0
+        self._nameList = []   # unique names in the order they were added, index is the name id
+        self._nameIds = {}
+        self._nameIndices = []  # element indices of each name id, in increasing order
+        self._labels = {}     # unit labels of type 15 entries, keyed by element index
         self.lines = []
-        self.length = []
-        self._uniquenames = []
+        # S positions are the prefix sums of gap + length, only recomputed when needed after a length is changed.
         self._totalLength = 0
+        self._pendingGap = 0
+        self._sOutdated = False
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("Element index out of range")
+        return _ElementView(self, index)
+
+    def __iter__(self):
+        for index in range(self._size):
+            yield _ElementView(self, index)
+
+    @property
+    def table(self):
+        """
+        Structured array of the elements (a view, not a copy).
+        """
+        self._UpdateSPositions()
+        return self._table[:self._size]
+
+    @property
+    def elements(self):
+        return self
+
+    @property
+    def names(self):
+        """
+        List of the name of every element.
+        """
+        return [self._Name(nameid) for nameid in self.table['nameid']]
+
+    @property
+    def length(self):
+        """
+        Array of the S position of the end of every element.
+        """
+        return self.table['send']
+
+    @property
+    def _uniquenames(self):
+        return self._nameList
+
+    def AddElement(self, typecode, name=None, length=0.0, params=(), line='', **columns):
+        """
+        Add an element to the end of the table. columns can set any other column of the table.
+        """
+        if self._size == len(self._table):
+            self._Resize(2 * len(self._table), self._table.dtype['params'].shape[0])
+        if len(params) > self._table.dtype['params'].shape[0]:
+            self._Resize(len(self._table), len(params))
+
+        element = self._table[self._size]
+        element['typecode'] = typecode
+        element['nameid'] = self._NameId(name)
+        if element['nameid'] >= 0:
+            self._nameIndices[element['nameid']].append(self._size)
+        element['length'] = length
+        element['gap'] = self._pendingGap
+        # Cumulative length
+        roundedLength = round(length, 5)
+        self._totalLength += self._pendingGap
+        self._pendingGap = 0
+        if not self._sOutdated:
+            element['send'] = self._totalLength + roundedLength
+            element['sstart'] = element['send'] - length
+        element['prevtypecode'] = _np.nan
+        element['nparams'] = len(params)
+        element['params'][:len(params)] = params
+        for column, value in columns.items():
+            element[column] = value
+        self._totalLength += roundedLength
+        self.lines.append(line)
+        self._size += 1
+        return self._size - 1
 
     def AddToRegistry(self, linedict, line):
+        """
+        Add an element from a dictionary of its properties, as made during conversion.
+        """
         if not isinstance(linedict, dict):
             raise TypeError("Added element is not a Dictionary")
-        self.elements.append(linedict)
-        self.names.append(linedict['name'])
-        if not linedict['name'] in self._uniquenames:
-            self._uniquenames.append(linedict['name'])
-
-        self.lines.append(line)
-        # Cumulative length
-        length = round(linedict['length'], 5)
-        if len(self.length) > 0:
-            self.length.append(length + self._totalLength)
-        else:
-            self.length.append(length)
-        self._totalLength += length
+        columns = {}
+        for key in ['isAddition', 'linenum', 'e1', 'e2', 'prevlinenum']:
+            value = linedict.get(key)
+            if value is not None:
+                columns[_columnKeys[key]] = value
+        index = self.AddElement(linedict['elementnum'], linedict['name'], linedict['length'],
+                                linedict.get('data', ()), line,
+                                isZeroLength=linedict.get('isZeroLength', True), **columns)
+        if 'label' in linedict:
+            self._labels[index] = linedict['label']
+        return index
 
     def GetElementIndex(self, name):
-        elenums = []
-        if name not in self.names:
-            return elenums
-        else:
-            # Add all elements of the same name as a single element may be
-            # used multiple times.
-            for index, elename in enumerate(self.names):
-                if elename == name:
-                    elenums.append(index)
-            return elenums
+        """
+        List of the indices of all elements called name, as a single element may be used multiple times.
+        """
+        if name not in self._nameIds:
+            return []
+        return list(self._nameIndices[self._nameIds[name]])
 
     def GetElement(self, name):
-        elenum = self.GetElementIndex(name)
-        if isinstance(elenum, list):
-            elementList = []
-            for num in elenum:
-                elementList.append(self.elements[num])
-            return elementList
-        else:
-            return self.elements[elenum]
+        return [_ElementView(self, index) for index in self.GetElementIndex(name)]
 
     def GetElementEndSPosition(self, name):
-        elenum = self.GetElementIndex(name)
-        if isinstance(elenum, list):
-            elementList = []
-            for num in elenum:
-                elementList.append(self.length[num])
-            return elementList
-        else:
-            return self.length[elenum]
+        self._UpdateSPositions()
+        return [self._table['send'][index] for index in self.GetElementIndex(name)]
 
     def GetElementStartSPosition(self, name):
-        elenum = self.GetElementIndex(name)
-        endS = self.GetElementEndSPosition(name)
-
-        if isinstance(elenum, list):
-            elementList = []
-            for index, num in enumerate(elenum):
-                element = self.elements[num]
-                length = element['length']
-                startS = endS[index] - length
-                elementList.append(round(startS, 5))
-            return elementList
-        else:
-            element = self.elements[elenum]
-            length = element['length']
-            startS = endS - length
-            return round(startS, 5)
+        self._UpdateSPositions()
+        return [round(self._table['sstart'][index], 5) for index in self.GetElementIndex(name)]
+
+    def MatchElements(self, other, typecodes=None):
+        """
+        Match the elements of another Lattice to the elements of this one by name, type code and
+        order of occurrence, i.e. the n-th element of a name and type code in other is matched to
+        the n-th element of the same name and type code here. Unnamed elements are not matched.
+        typecodes optionally restricts the matching to a sequence of type codes.
+
+        Returns two arrays of the indices of the matched elements in this lattice and in other,
+        in the order of the elements of other.
+        """
+        table = self.table
+        otherTable = other.table
+        # name ids of the names of other in this lattice, -1 for names not used here or no name.
+        nameMap = _np.array([self._nameIds.get(name, -1) for name in other._nameList] + [-1], dtype=_np.int64)
+        keys = _OccurrenceKeys(table['nameid'].astype(_np.int64), table['typecode'])
+        otherNameIds = nameMap[otherTable['nameid']]
+        otherKeys = _OccurrenceKeys(otherNameIds, otherTable['typecode'])
+
+        valid = table['nameid'] >= 0
+        otherValid = otherNameIds >= 0
+        if typecodes is not None:
+            valid &= _np.isin(table['typecode'], typecodes)
+            otherValid &= _np.isin(otherTable['typecode'], typecodes)
+        indices = _np.flatnonzero(valid)
+        otherIndices = _np.flatnonzero(otherValid)
+        if len(indices) == 0 or len(otherIndices) == 0:
+            return _np.zeros(0, dtype=_np.intp), _np.zeros(0, dtype=_np.intp)
+
+        order = _np.argsort(keys[indices], kind='stable')
+        sortedKeys = keys[indices][order]
+        position = _np.searchsorted(sortedKeys, otherKeys[otherIndices])
+        position = _np.minimum(position, len(sortedKeys) - 1)
+        found = sortedKeys[position] == otherKeys[otherIndices]
+        return indices[order[position[found]]], otherIndices[found]
+
+    def SetLength(self, index, length):
+        """
+        Change the length of an element. The S positions of it and the following elements
+        are updated when they are next used, so many lengths can be changed in linear time.
+        index and length can also be arrays to change several elements at once.
+        """
+        self._table['length'][index] = length
+        self._sOutdated = True
+
+    def _UpdateSPositions(self):
+        """
+        Recompute the S positions from the element lengths if any have been changed.
+        """
+        if not self._sOutdated:
+            return
+        table = self._table[:self._size]
+        table['send'] = _np.cumsum(table['gap'] + _np.round(table['length'], 5))
+        table['sstart'] = table['send'] - table['length']
+        self._totalLength = table['send'][-1] if self._size > 0 else 0
+        self._sOutdated = False
 
     def UpdateLength(self, linedict):
         """
@@ -637,4 +1083,113 @@ class _Registry:
         """
         if not isinstance(linedict, dict):
             raise TypeError("Added element is not a Dictionary")
-        self._totalLength += linedict['length']
+        self._pendingGap += linedict['length']
+
+    def _Name(self, nameid):
+        if nameid < 0:
+            return None
+        return self._nameList[nameid]
+
+    def _NameId(self, name):
+        if name is None:
+            return -1
+        if name not in self._nameIds:
+            self._nameIds[name] = len(self._nameList)
+            self._nameList.append(name)
+            self._nameIndices.append([])
+        return self._nameIds[name]
+
+    def _SetName(self, index, name):
+        """
+        Rename an element, keeping the name index up to date.
+        """
+        oldid = self._table['nameid'][index]
+        if oldid >= 0:
+            self._nameIndices[oldid].remove(index)
+        newid = self._NameId(name)
+        self._table['nameid'][index] = newid
+        if newid >= 0:
+            _bisect.insort(self._nameIndices[newid], index)
+
+    def _Resize(self, size, numParams):
+        table = _np.zeros(size, dtype=_LatticeDtype(numParams))
+        for field in self._table.dtype.names:
+            if field == 'params':
+                table['params'][:self._size, :self._table.dtype['params'].shape[0]] = self._table['params'][:self._size]
+            else:
+                table[field][:self._size] = self._table[field][:self._size]
+        self._table = table
+
+
+class _ElementView:
+    """
+    Dictionary-like view of one element of a Lattice. Reading and writing keys reads and
+    writes the table. The available keys depend on the element type code.
+    """
+    __slots__ = ('_lattice', '_index')
+
+    def __init__(self, lattice, index):
+        self._lattice = lattice
+        self._index = index
+
+    def _Element(self):
+        return self._lattice._table[self._index]
+
+    def keys(self):
+        typecode = float(self._Element()['typecode'])
+        keys = ['elementnum', 'name', 'length', 'isZeroLength']
+        for key in _typeKeys.get(typecode, []):
+            if (key in _paramKeys.get(typecode, {})) and (_paramKeys[typecode][key] >= self._Element()['nparams']):
+                continue
+            keys.append(key)
+        return keys
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def __getitem__(self, key):
+        element = self._Element()
+        if key == 'name':
+            return self._lattice._Name(element['nameid'])
+        elif key == 'label':
+            return self._lattice._labels.get(self._index)
+        elif key == 'data':
+            return element['params'][:element['nparams']]
+        elif key in _columnKeys:
+            return element[_columnKeys[key]].item()
+        typecode = float(element['typecode'])
+        if key in _paramKeys.get(typecode, {}):
+            return element['params'][_paramKeys[typecode][key]].item()
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        element = self._Element()
+        if key == 'name':
+            self._lattice._SetName(self._index, value)
+        elif key == 'label':
+            self._lattice._labels[self._index] = value
+        elif key == 'data':
+            if len(value) > len(element['params']):
+                self._lattice._Resize(len(self._lattice._table), len(value))
+                element = self._Element()
+            element['params'][:] = 0
+            element['params'][:len(value)] = value
+            element['nparams'] = len(value)
+        elif key in _columnKeys:
+            element[_columnKeys[key]] = value
+        else:
+            typecode = float(element['typecode'])
+            if key not in _paramKeys.get(typecode, {}):
+                raise KeyError(key)
+            element['params'][_paramKeys[typecode][key]] = value
+
+    def __repr__(self):
+        return repr({key: self[key] for key in self.keys()})
@@ -10,133 +10,849 @@ ConversionData - a class for holding data during conversion.
 
 """
 
+import glob as _glob
+import itertools as _itertools
+import mmap as _mmap
+import os as _os
+import re as _re
+from collections import deque as _deque
+
 import numpy as _np
+from . import _General
 from .Data import BDSData as _BDA
+from .Data import ColumnarData as _ColumnarData
+from .Data import Lattice as _Lattice
+from .Data import _lengthTypeCodes
+
 
+# Version of the parsed results, increase when a change to the readers changes their output.
+# Used to invalidate cached results (see pytransport.Cache).
+_parserVersion = 2
 
 _allowedIndicatorLines = ['0  100', '0   10', '0    0',]
+_sentinelLines = ['0SENTINEL', 'SENTINEL']
+_wrongIndicatorLine = '0INDICATOR VALUE WRONG OR MISSING - ZERO ASSUMED'
+_singleLineAppliedLine = 'IO: UNDEFINED TYPE CODE 13. 19. ;'
+_noIndicatorError = "Could not find an indicator in the file for either a beam output file\n" \
+                    "(indicator = '*BEAM*), or a standard output file (indicator = '0    0').\n" \
+                    "Please check the input file or specify the input type with the type argument \n" \
+                    "in the get_output function. Note that the only accepted values for type are \n" \
+                    "'standard' or 'beam'."
+
+# Second order matrix elements are printed as "i jk value" with j <= k. T_ijk = T_ikj so only
+# the 21 (j, k) pairs with j <= k are stored, in the order of numpy.triu_indices(6).
+_secondOrderTerm = _re.compile(r'(?<!\S)([1-6]) ?([1-6])([1-6])\s+([-+]?(?:\d+\.?\d*|\.\d+)(?:[EeDd][-+]?\d+)?)')
+_secondOrderPairs = _np.zeros((6, 6), dtype=int)
+_secondOrderPairs[_np.triu_indices(6)] = _np.arange(21)
+_secondOrderPairs[_np.tril_indices(6, -1)] = _secondOrderPairs.T[_np.tril_indices(6, -1)]
+
+# Column positions (start, end) of the fields in the column aligned Transport output, one spec per layout.
+# Element heading of standard output written to multiple lines, e.g.
+#  *DRIFT*         3.0            "SJ1 "      0.00000 M
+_headingColumns = {
+    'length'       : (42, 55),  # value followed by the unit, "M  " for a length
+    }
+# The six sigma matrix lines following the heading, e.g.
+#                                            0.000   1.070 MR     -0.003
+_sigmaLineColumns = {
+    'size'         : (80, 88),
+    'unit'         : (88, 91),
+    'correlations' : [(95 + 7 * j, 102 + 7 * j) for j in range(5)],
+    }
+# The six lines following *TRANSFORM 1*
+_transformLineColumns = [(11 + 10 * j, 21 + 10 * j) for j in range(6)]
+# Word positions of the fields of the sigma line of standard output written to single lines.
+_singleLineWords = {
+    's'     : 0,
+    'sigx'  : 2,
+    'sigxp' : 4,
+    'sigy'  : 6,
+    'sigyp' : 8,
+    'sigt'  : 10,
+    'sigp'  : 12,
+    'r21'   : 14,
+    'r43'   : 15,
+    }
+
+
+def IndexFile(inputFile, mmap=False):
+    """
+    Scan a Transport output file once and return an index of the line and byte offsets
+    of its sections (indicator card, lattice, fitting output, optics, length and R matrix table).
+
+    The returned index can be passed to GetOptics, GetLattice, GetFitsSection and
+    GetResultsFromFitting in place of the file name so the file is only read once.
+
+    If mmap is True the file is memory-mapped instead of read into a list of lines.
+    Lines are then only decoded when a parser accesses them, which keeps the memory
+    use of very large output files proportional to the parsed result. Only '\\n' and
+    '\\r\\n' line endings are recognised in this mode.
+
+    >>> index = pytransport.Reader.IndexFile('FOR002.DAT')
+    >>> optics = pytransport.Reader.GetOptics(index)
+    >>> lattice = pytransport.Reader.GetLattice(index)
+    """
+    return _SectionIndex(inputFile, mmap)
+
 
-def GetOptics(inputFile, inputType=None):
+def GetOptics(inputFile, inputType=None, mmap=False, columnar=False, matrices=False):
     """
     Extract the optics from a Transport output file.
+
+    inputFile can be a file name or an index returned by IndexFile.
+    mmap: bool, default = False. Memory-map the file rather than reading it (see IndexFile).
+    columnar: bool, default = False. Return a pytransport.Data.ColumnarData instance with one
+              numpy array per variable rather than a BDSData instance with one list per element.
+    matrices: bool, default = False. Also read the full beam (sigma) matrix and first order transfer
+              (R) matrix of every element. These are set as the attributes sigmaMatrices and rMatrices
+              of the returned data, each an (N,6,6) numpy array in the units printed by Transport.
+              Only available for standard output written to multiple lines.
     """
+    index = _GetIndex(inputFile, mmap)
     optics = _Optics()  # Instantiate empty data optics container
 
     if isinstance(inputType, _np.str):
         if inputType == 'beam':
-            transdata = optics._getBeamOptics(inputFile)
+            transdata = optics._getBeamOptics(index, columnar)
             return transdata
         elif inputType == 'standard':
-            transdata = optics._getStandardOptics(inputFile)
+            transdata = optics._getStandardOptics(index, columnar, matrices)
             return transdata
 
-    f = open(inputFile)
     transdata = None
-    for line in f:
-        # remove any carriage returns (both Mac and Unix)
-        line = line.rstrip('\r\n')
-        splitline = _remove_blanks(line.split(' '))
-        if splitline and splitline[0] == '*BEAM*':  # Is beam output
-            # print "'*BEAM*' found in line " + _np.str(i+1)
-            f.close()
-            transdata = optics._getBeamOptics(inputFile)
-            break
-        elif line in _allowedIndicatorLines:
-            # print "'0    0' found in line " + _np.str(i+1)
-            f.close()
-            transdata = optics._getStandardOptics(inputFile)
-            break
-        else:
-            pass
+    if index.isBeamOutput:
+        transdata = optics._getBeamOptics(index, columnar)
+    elif index.indicator is not None:
+        transdata = optics._getStandardOptics(index, columnar, matrices)
     if transdata is None:
-        errorstring = "Could not find an indicator in the file for either a beam output file\n"
-        errorstring += "(indicator = '*BEAM*), or a standard output file (indicator = '0    0').\n"
-        errorstring += "Please check the input file or specify the input type with the type argument \n"
-        errorstring += "in the get_output function. Note that the only accepted values for type are \n"
-        errorstring += "'standard' or 'beam'."
-        raise IOError(errorstring)
+        raise IOError(_noIndicatorError)
 
     #transdata.MergeDuplicatesAtSameS()
 
     return transdata
 
+def IterOptics(inputFile, inputType=None):
+    """
+    Generator of the optics of each element in a Transport output file, parsed as the file is
+    read. Yields one dict per element with the same keys and values as an entry of the data
+    returned by GetOptics, without holding the rest of the file or the other elements in memory.
+    Stopping the iteration early stops reading the file.
+
+    inputFile can be a file name or an index returned by IndexFile.
+    inputType: 'standard' or 'beam', default = None. Found from the file if not given.
+
+    >>> maxSize = max(element['Sigma_x'] for element in pytransport.Reader.IterOptics('FOR002.DAT'))
+    """
+    # the sections are found by the index, memory-mapped so the file is not read into memory.
+    index = _GetIndex(inputFile, mmap=True)
+    inputFile = index.filename
+    if inputType not in ['standard', 'beam']:
+        if (index.indicator is None) and (index.opticsStart is None):
+            raise IOError(_noIndicatorError)
+        inputType = 'beam' if index.isBeamOutput else 'standard'
+    optics = _Optics()
+
+    if inputType == 'beam':
+        for record in optics._readBeamSections(_StreamLines(inputFile)):
+            yield record
+        return
+
+    _CheckOpticsSection(inputFile, index.opticsStart, index.opticsEnd)
+    opticsStart = index.ByteOffset(index.opticsStart)
+    opticsEnd = index.ByteOffset(index.opticsEnd)
+    singleLine = index.singleLineApplied
+    rMatrixStart = None if index.rMatrixStart is None else index.ByteOffset(index.rMatrixStart)
+    del index
+
+    elements = _GroupElements(_StreamLines(inputFile, opticsStart, opticsEnd))
+    if not singleLine:
+        for element, values in optics._readStandardElementsMultiLines(elements):
+            yield _OpticsRecord(values)
+        return
+
+    # the R matrix table at the end of the file is needed for the dispersion
+    dispersion = {}
+    if rMatrixStart is not None:
+        rMatrixElements = list(_GroupElements(_StreamLines(inputFile, rMatrixStart)))
+        dispersion = _GetRMatrixDispersion(rMatrixElements[-1][1:])
+    # the last element before the R matrix table is its column headers.
+    elements = _DropLast(elements)
+    for values in optics._readStandardElementsSingleLine(elements, dispersion):
+        yield _OpticsRecord(values)
+
+
+def GetOpticsBatch(inputFiles, workers=None, ordered=True, maxInFlight=None, **kwargs):
+    """
+    Generator that extracts the optics from many Transport output files in parallel.
+    Yields (filename, optics, error) for each file. If the optics could not be read, optics
+    is None and error is the exception raised, otherwise error is None.
+
+    inputFiles: list of file names, or a glob pattern string such as 'settings/*/FOR002.DAT'.
+    workers: int, default = number of CPUs. Number of processes used. 1 reads the files in this process.
+    ordered: bool, default = True. Yield the files in the order given, otherwise as they are read.
+    maxInFlight: int, default = 2 * workers. Maximum number of files being read or waiting to be
+                 yielded, which bounds the memory used for large batches.
+    kwargs: passed to GetOptics, e.g. columnar=True.
+
+    >>> for filename, optics, error in pytransport.Reader.GetOpticsBatch('runs/*.DAT', workers=8):
+    ...     if error is None:
+    ...         print(filename, optics.Beta_x().max())
+    """
+    if isinstance(inputFiles, str):
+        inputFiles = sorted(_glob.glob(inputFiles))
+    inputFiles = list(inputFiles)
+    arguments = [(inputFile, kwargs) for inputFile in inputFiles]
+    for num, optics, error in _General._ParallelMap(_GetOpticsKwargs, arguments, workers, ordered, maxInFlight):
+        yield inputFiles[num], optics, error
+
+
+def _GetOpticsKwargs(inputFile, kwargs):
+    return GetOptics(inputFile, **kwargs)
+
+
 def GetLattice(inputFile):
     """
     Function to extract the lattice from a standard output file.
+
+    inputFile can be a file name or an index returned by IndexFile.
     """
-    flist = _LoadFile(inputFile)
-    latticestart = 0
-    latticeend = 0
-    foundlatticestart = False
-    foundlatticeend = False
+    index = _GetIndex(inputFile)
     lattice = ['OUTPUT LATTICE']
-    for linenum, line in enumerate(flist):
-        if line in _allowedIndicatorLines:
-            if not foundlatticestart:
-                latticestart = linenum+1
-                if flist[linenum+1] == '0INDICATOR VALUE WRONG OR MISSING - ZERO ASSUMED':
-                    latticestart += 1
-                foundlatticestart = True
-        if line in ['0SENTINEL','SENTINEL']:
-            if not foundlatticeend:
-                latticeend = linenum
-                foundlatticeend = True
-    if not foundlatticestart:
-        if not foundlatticeend:
-            raise IOError('No lattice found in ' + inputFile + '.')
+    if index.latticeStart is None:
+        if index.latticeEnd is None:
+            raise IOError('No lattice found in ' + index.filename + '.')
         else:
-            errorstring = 'The end of a lattice (line = "0SENTINEL") was found at line ' + _np.str(latticeend + 1) + ',\n'
+            errorstring = 'The end of a lattice (line = "0SENTINEL") was found at line ' + _np.str(index.latticeEnd + 1) + ',\n'
             errorstring += 'but the start of a lattice (line = "0    0") was not found. Please check the input file.'
             raise IOError(errorstring)
-    elif not foundlatticeend:
-            errorstring = 'The start of a lattice (line = "0    0") was found at line ' + _np.str(latticestart - 1) + ',\n'
+    elif index.latticeEnd is None:
+            errorstring = 'The start of a lattice (line = "0    0") was found at line ' + _np.str(index.latticeStart - 1) + ',\n'
             errorstring += 'but the end of a lattice (line = "0SENTINEL") was not found. Please check the input file.'
             raise IOError(errorstring)
     else:
-        lattice.extend(flist[latticestart:latticeend])
+        lattice.extend(index.lines[index.latticeStart:index.latticeEnd])
     return lattice
 
+def GetLatticeTable(inputFile):
+    """
+    Function to get the lattice from a standard output file as a pytransport.Data.Lattice
+    table of the type code, name, length, S position and parameters of each element.
+    Entries with a type code of zero or less are not included.
+
+    inputFile can be a file name or an index returned by IndexFile.
+    """
+    tokens, lines = _General.TokeniseLattice(GetLattice(inputFile))
+    lattice = _Lattice()
+    for linenum, token in enumerate(tokens):
+        if (token.typecode is None) or (token.typecode <= 0):
+            continue
+        length = 0.0
+        if (token.typecode in _lengthTypeCodes) and (len(token.params) > 0):
+            length = token.params[0]
+        lattice.AddElement(token.typecode, token.label, length, token.params, lines[linenum],
+                           linenum=linenum, isZeroLength=(length == 0))
+    return lattice
+
+
 def GetFitsSection(inputFile):
     """
     Function to get the fit routine data from the standard transport output.
     Returns two lists, the first with the direct output from the fitting data,
     the second with the first line of each element in the output data, which contains the
     element parameters with their fitted values.
-    """
 
-    flist = _LoadFile(inputFile)
-    fitstart = 0
-    fitend = 0
-    foundfitstart = False
-    foundfitend = False
+    inputFile can be a file name or an index returned by IndexFile.
+    """
+    index = _GetIndex(inputFile)
     fits = []
-    for linenum, line in enumerate(flist):
-        if not foundfitstart:
-            if line == '0SENTINEL' or line == 'SENTINEL':
-                fitstart = linenum
-                foundfitstart = True
-        if not foundfitend:
-            splitline = _remove_blanks(line.split(' '))
-            if splitline and splitline[0] == '*BEAM*' and not foundfitend:
-                fitend = linenum
-                foundfitend = True
-    if not foundfitstart:
+    if index.fitStart is None:
         print('No fitting output found.')
         return None
-    elif foundfitstart and not foundfitend:
-            errorstring = 'The start of the fitting output (first line containing "0SENTINEL") was found at line ' + _np.str(fitstart-1) + ',\n'
+    elif index.fitEnd is None:
+            errorstring = 'The start of the fitting output (first line containing "0SENTINEL") was found at line ' + _np.str(index.fitStart-1) + ',\n'
             errorstring += 'but the end of the fitting output (first line containing "*BEAM*") was not found. Please check the input file.'
             raise IOError(errorstring)
-    fits.extend(flist[fitstart:fitend])
+    fits.extend(index.lines[index.fitStart:index.fitEnd])
     return fits
 
 def GetResultsFromFitting(inputFile):
     optics = _Optics() # Instantiate empty data optics container
-    output = optics._getOptics(inputFile)
+    output = optics._getOptics(_GetIndex(inputFile))
     fitres = [element[0] for element in output]
     return fitres
 
 
+def IterSecondOrderMatrices(inputFile, mmap=False):
+    """
+    Generator of the second order (*TRANSFORM 2*) matrices of each element in a Transport
+    standard output file written to multiple lines. One (6,21) numpy array is yielded per
+    element, in the same order as the elements returned by GetOptics. Column n of the array is
+    the term T_ijk with (j, k) the n-th pair of numpy.triu_indices(6), i.e. j <= k. Elements
+    without second order output give an array of NaNs.
+
+    inputFile can be a file name or an index returned by IndexFile.
+    """
+    optics = _Optics()
+    elementlist = optics._getOptics(_GetIndex(inputFile, mmap))
+    if optics._IsSingleLine(elementlist):
+        raise IOError('Second order matrices are not available from single line output.')
+    for element, elementType, elementProperties in _OpticsElements(elementlist):
+        matrix = _np.full((6, 21), _np.nan)
+        _ReadSecondOrderMatrix(element, matrix)
+        yield matrix
+
+
+def GetSecondOrderMatrices(inputFile, outputFile=None, mmap=False):
+    """
+    Get the second order matrices of all elements as an (N,6,21) numpy array, see
+    IterSecondOrderMatrices for the layout. Use UnpackSecondOrderMatrices for the full
+    T_ijk array of selected elements.
+
+    outputFile: string, default = None. Write the array to this .npy file and return it as
+                a memory-mapped array, so that long lattices do not have to fit in memory.
+
+    >>> T = pytransport.Reader.GetSecondOrderMatrices('FOR002.DAT', outputFile='T.npy')
+    >>> T166 = pytransport.Reader.UnpackSecondOrderMatrices(T[10])[0, 5, 5]
+    """
+    index = _GetIndex(inputFile, mmap)
+    num_elements = sum(1 for element in _OpticsElements(_Optics()._getOptics(index)))
+    if outputFile is None:
+        matrices = _np.empty((num_elements, 6, 21))
+    else:
+        matrices = _np.lib.format.open_memmap(outputFile, mode='w+', dtype=float, shape=(num_elements, 6, 21))
+    for num, matrix in enumerate(IterSecondOrderMatrices(index)):
+        matrices[num] = matrix
+    if outputFile is not None:
+        matrices.flush()
+    return matrices
+
+
+def UnpackSecondOrderMatrices(matrices):
+    """
+    Expand second order matrices of shape (...,6,21) as returned by GetSecondOrderMatrices
+    into the full symmetric T_ijk arrays of shape (...,6,6,6).
+    """
+    return _np.asarray(matrices)[..., _secondOrderPairs]
+
+
+class _SectionIndex:
+    """
+    Index of the sections of a Transport output file. The file is read once and
+    the start line of every section is found in the same pass. The byte offset
+    of each section boundary in the file is kept in self.offsets, keyed by line number.
+
+    Section attributes are line numbers, or None if the section was not found:
+    indicator    - the indicator card ("0    0").
+    latticeStart - first lattice line, latticeEnd - the sentinel closing the lattice.
+    fitStart     - first sentinel line, fitEnd - first line beginning "*BEAM*".
+    opticsStart  - first line beginning "*BEAM*", opticsEnd - last line beginning "0*LENGTH*".
+    rMatrixStart - last line beginning "0POSITION".
+
+    If mmap is True, the file is memory-mapped and self.lines is a _MappedLines
+    sequence that decodes lines on access, otherwise it is a list of strings.
+    """
+    def __init__(self, inputfile, mmap=False):
+        if inputfile == '':
+            raise IOError('No file name supplied.')
+        self.filename = inputfile
+        self.offsets = {}
+        self.indicator = None
+        self.latticeStart = None
+        self.latticeEnd = None
+        self.opticsStart = None
+        self.opticsEnd = None
+        self.rMatrixStart = None
+        self.mmap = mmap
+        self._singleLineLines = []  # line numbers of the message that single line output was applied
+        self._singleLineApplied = None
+        self._lastLineTerminated = True
+
+        if mmap:
+            self._MapFile(inputfile)
+        else:
+            self._ReadFile(inputfile)
+
+    def _ReadFile(self, inputfile):
+        """
+        Read the file into a list of lines, indexing each line as it is read.
+        """
+        self.lines = []
+        position = 0
+        # newline='' keeps the line endings so the byte offsets can be counted,
+        # latin-1 maps every byte to exactly one character.
+        infile = open(inputfile, newline='', encoding='latin-1')
+        for linenum, rawline in enumerate(infile):
+            # remove any carriage returns (both Mac and Unix)
+            line = rawline.rstrip('\r\n')
+            self.lines.append(line)
+            self._IndexLine(line, linenum, position)
+            position += len(rawline)
+        infile.close()
+        if self.lines:
+            self._lastLineTerminated = len(line) != len(rawline)
+        self.size = position
+
+    def _MapFile(self, inputfile):
+        """
+        Memory-map the file and find the sections by searching the raw bytes,
+        so only the lines around a match are decoded.
+        """
+        infile = open(inputfile, 'rb')
+        self.size = _os.fstat(infile.fileno()).st_size
+        if self.size > 0:
+            buffer = _mmap.mmap(infile.fileno(), 0, access=_mmap.ACCESS_READ)
+        else:
+            buffer = b''  # empty files cannot be mapped
+        infile.close()
+
+        starts, ends = _FindLines(buffer, self.size)
+        self.lines = _MappedLines(buffer, starts, ends)
+        self._lastLineTerminated = (self.size == 0) or (buffer[self.size - 1:self.size] == b'\n')
+
+        indicators = [self._FindLine(line.encode(), lambda l, i=line: l == i) for line in _allowedIndicatorLines]
+        indicators = [linenum for linenum in indicators if linenum is not None]
+        if indicators:
+            self.indicator = min(indicators)
+            self.latticeStart = self.indicator + 1
+            if (self.latticeStart < len(self.lines)) and (self.lines[self.latticeStart] == _wrongIndicatorLine):
+                self.latticeStart += 1
+        self.latticeEnd = self._FindLine(b'SENTINEL', lambda l: l in _sentinelLines)
+        self.opticsStart = self._FindLine(b'*BEAM*', lambda l: _FirstWord(l) == '*BEAM*')
+        self.opticsEnd = self._FindLine(b'0*LENGTH*', lambda l: _FirstWord(l) == '0*LENGTH*', last=True)
+        self.rMatrixStart = self._FindLine(b'0POSITION', lambda l: _FirstWord(l) == '0POSITION', last=True)
+        singleLine = self._FindLine(_singleLineAppliedLine.encode(), lambda l: l == _singleLineAppliedLine)
+        if singleLine is not None:
+            self._singleLineLines.append(singleLine)
+        for linenum in [self.indicator, self.latticeStart, self.latticeEnd, self.opticsStart,
+                        self.opticsEnd, self.rMatrixStart]:
+            if (linenum is not None) and (linenum < len(self.lines)):
+                self.offsets[linenum] = int(starts[linenum])
+
+    def _FindLine(self, pattern, test, last=False):
+        """
+        Line number of the first (or last) line containing pattern for which test(line) is True.
+        """
+        buffer = self.lines._buffer
+        starts = self.lines._starts
+        position = buffer.rfind(pattern) if last else buffer.find(pattern)
+        while position != -1:
+            linenum = int(_np.searchsorted(starts, position, side='right')) - 1
+            if test(self.lines[linenum]):
+                return linenum
+            if last:
+                position = buffer.rfind(pattern, 0, int(starts[linenum]))
+            else:
+                position = buffer.find(pattern, int(self.lines._ends[linenum]))
+        return None
+
+    def _IndexLine(self, line, linenum, position):
+        """
+        Check if a line is a section boundary and record it.
+        """
+        if self.indicator is None and line in _allowedIndicatorLines:
+            self._Mark('indicator', linenum, position)
+            self.latticeStart = linenum + 1
+        elif linenum == self.latticeStart:
+            if (line == _wrongIndicatorLine) and (linenum == self.indicator + 1):
+                self.latticeStart += 1
+            else:
+                self.offsets[linenum] = position
+        if self.latticeEnd is None and line in _sentinelLines:
+            self._Mark('latticeEnd', linenum, position)
+
+        if line == _singleLineAppliedLine:
+            self._singleLineLines.append(linenum)
+
+        firstword = _FirstWord(line)
+        if firstword == '*BEAM*' and self.opticsStart is None:
+            self._Mark('opticsStart', linenum, position)
+        elif firstword == '0*LENGTH*':
+            self._Mark('opticsEnd', linenum, position)
+        elif firstword == '0POSITION':
+            self._Mark('rMatrixStart', linenum, position)
+
+    def _Mark(self, section, linenum, position):
+        setattr(self, section, linenum)
+        self.offsets[linenum] = position
+
+    @property
+    def fitStart(self):
+        return self.latticeEnd
+
+    @property
+    def fitEnd(self):
+        return self.opticsStart
+
+    @property
+    def isBeamOutput(self):
+        """
+        True if a "*BEAM*" line comes before any indicator card, i.e. the file is beam output.
+        """
+        if self.opticsStart is None:
+            return False
+        return (self.indicator is None) or (self.opticsStart < self.indicator)
+
+    @property
+    def singleLineApplied(self):
+        """
+        True if the optics section says that the control element printing the output of each
+        element on a single line (13. 19.) was applied. Found once and kept. False if the file
+        has no optics section, e.g. a Transport input deck.
+        """
+        if self._singleLineApplied is None:
+            self._singleLineApplied = False
+            if (self.opticsStart is not None) and (self.opticsEnd is not None):
+                self._singleLineApplied = any(self.opticsStart <= linenum < self.opticsEnd
+                                              for linenum in self._singleLineLines)
+        return self._singleLineApplied
+
+    def ByteOffset(self, linenum):
+        """
+        Byte offset in the file of the start of a line. Without mmap, only section
+        boundary lines are available.
+        """
+        if self.mmap:
+            return int(self.lines._starts[linenum])
+        return self.offsets[linenum]
+
+    def RawLine(self, linenum):
+        """
+        Line as read from the file in text mode, i.e. with a trailing new line
+        unless it is the unterminated last line of the file.
+        """
+        line = self.lines[linenum]
+        if (linenum < len(self.lines) - 1) or self._lastLineTerminated:
+            line += '\n'
+        return line
+
+    def ElementRanges(self):
+        """
+        Line ranges (start, end) of each element's output in the optics section and R matrix table.
+        An element starts at a line with a '*' as its second character (other than a
+        TRANSFORM matrix heading) or at the '0POSITION' line of the R matrix table.
+        """
+        if (self.opticsStart is None) or (self.opticsEnd is None):
+            return []
+        sections = [(self.opticsStart, self.opticsEnd)]
+        if self.rMatrixStart is not None:
+            sections.append((self.rMatrixStart, len(self.lines)))
+        sections = [(start, end) for start, end in sections if end > start]
+        if not sections:
+            return []
+
+        if self.mmap:
+            blockstarts = _np.concatenate([self.lines._BlockStarts(start, end) for start, end in sections])
+            blockstarts = [int(linenum) for linenum in blockstarts]
+        else:
+            blockstarts = [linenum for start, end in sections for linenum in range(start, end)
+                           if _IsBlockStart(self.lines[linenum])]
+
+        # the first line that can be read always starts an element
+        for firstline in range(*sections[0]):
+            if len(self.lines[firstline]) > 1:
+                if not blockstarts or blockstarts[0] != firstline:
+                    blockstarts.insert(0, firstline)
+                break
+
+        lastline = sections[-1][1] - 1
+        ranges = []
+        for num, start in enumerate(blockstarts[:-1]):
+            end = blockstarts[num + 1]
+            # an element cannot span the gap between the optics and the R matrix table
+            for sectionstart, sectionend in sections:
+                if sectionstart <= start < sectionend:
+                    end = min(end, sectionend)
+            ranges.append((start, end))
+        # the final element is only complete if the last line can be read
+        if blockstarts and len(self.lines[lastline]) > 1:
+            ranges.append((blockstarts[-1], lastline + 1))
+        return ranges
+
+
+class _MappedLines:
+    """
+    Read-only sequence of the lines of a memory-mapped file. Lines are decoded when
+    accessed, and slicing returns another _MappedLines over the same buffer so element
+    blocks can be passed around as offset ranges without copying.
+    """
+    def __init__(self, buffer, starts, ends):
+        self._buffer = buffer
+        self._starts = starts
+        self._ends = ends
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return _MappedLines(self._buffer, self._starts[item], self._ends[item])
+        return self._buffer[self._starts[item]:self._ends[item]].decode('latin-1')
+
+    def __iter__(self):
+        for start, end in zip(self._starts, self._ends):
+            yield self._buffer[start:end].decode('latin-1')
+
+    def _BlockStarts(self, start, end):
+        """
+        Line numbers in [start, end) that start an element block, see _IsBlockStart.
+        """
+        starts = self._starts[start:end]
+        ends = self._ends[start:end]
+        buffer = _np.frombuffer(self._buffer, dtype=_np.uint8)
+        isStart = _MatchBytes(buffer, starts, ends, 1, b'*') | _MatchBytes(buffer, starts, ends, 0, b'0POSITION')
+        isStart &= ~_MatchBytes(buffer, starts, ends, 2, b'TRANSFORM')
+        return _np.flatnonzero(isStart) + start
+
+
+def _FindLines(buffer, size, chunk=1 << 24):
+    """
+    Start and end byte offsets of every line in a buffer. The ends exclude the line ending.
+    The buffer is searched in chunks to avoid a temporary array the size of the file.
+    """
+    if size == 0:
+        return _np.zeros(0, dtype=_np.int64), _np.zeros(0, dtype=_np.int64)
+    newlines = [_np.zeros(0, dtype=_np.int64)]
+    for offset in range(0, size, chunk):
+        count = min(chunk, size - offset)
+        block = _np.frombuffer(buffer, dtype=_np.uint8, count=count, offset=offset)
+        newlines.append(_np.flatnonzero(block == ord('\n')).astype(_np.int64) + offset)
+        del block
+    newlines = _np.concatenate(newlines)
+    starts = _np.concatenate([[0], newlines + 1]).astype(_np.int64)
+    ends = _np.concatenate([newlines, [size]]).astype(_np.int64)
+    if (len(newlines) > 0) and (newlines[-1] == size - 1):
+        # file ends with a new line, so there is no line after it
+        starts = starts[:-1]
+        ends = ends[:-1]
+    # remove carriage returns
+    block = _np.frombuffer(buffer, dtype=_np.uint8)
+    hasReturn = (ends > starts) & (block[_np.maximum(ends - 1, 0)] == ord('\r'))
+    ends[hasReturn] -= 1
+    del block
+    return starts, ends
+
+
+def _MatchBytes(buffer, starts, ends, offset, pattern):
+    """
+    Boolean array of whether each line (given by start and end offsets into the uint8
+    array buffer) contains the bytes pattern at position offset.
+    """
+    match = (ends - starts) >= (offset + len(pattern))
+    for num, char in enumerate(pattern):
+        positions = _np.where(match, starts + offset + num, 0)
+        match &= buffer[positions] == char
+    return match
+
+
+def _StreamLines(inputfile, start=0, end=None):
+    """
+    Generator of the lines of a file without line endings, from byte offset start up to
+    the line starting at byte offset end.
+    """
+    with open(inputfile, 'rb') as infile:
+        infile.seek(start)
+        position = start
+        for rawline in infile:
+            if (end is not None) and (position >= end):
+                break
+            position += len(rawline)
+            yield rawline.rstrip(b'\r\n').decode('latin-1')
+
+
+def _GroupElements(lines):
+    """
+    Generator of the elements in lines of optics output, split as in _SectionIndex.ElementRanges.
+    A trailing 'IO' line is a message from Transport and yielded as a separate string.
+    """
+    element = None
+    line = ''
+    for line in lines:
+        if element is None:
+            # the first line that can be read always starts an element
+            if len(line) > 1:
+                element = [line]
+        elif _IsBlockStart(line):
+            for entry in _SplitIOLine(element):
+                yield entry
+            element = [line]
+        else:
+            element.append(line)
+    # the final element is only complete if the last line can be read
+    if (element is not None) and (len(line) > 1):
+        for entry in _SplitIOLine(element):
+            yield entry
+
+
+def _SplitIOLine(element):
+    """
+    Split a trailing Transport IO message line from an element.
+    """
+    if element[-1][:2] == 'IO':
+        return [element[:-1], element[-1]]
+    return [element]
+
+
+def _DropLast(iterable):
+    """
+    Generator of all but the last item of iterable.
+    """
+    iterable = iter(iterable)
+    previous = next(iterable, None)
+    for item in iterable:
+        yield previous
+        previous = item
+
+
+def _ReadBeamBlocks(flist):
+    """
+    Read all element blocks of a Beam output file at once. Each block is a blank line followed by
+    12 lines: the element type, position and name, the sigma matrix, the twiss parameters and the
+    first order transform, whose first and second lines contain R16, R36 and R26, R46. The block
+    starts are found first, then the words of each field are gathered and every field is
+    converted to a numpy array in one step. Returns a dict of the arrays of each variable, or
+    None if a field could not be read.
+    """
+    # every blank line before the end of file marker starts a block.
+    blockstarts = []
+    for linenum, line in enumerate(flist):
+        if line == '':
+            blockstarts.append(linenum)
+        elif line == "EOF -- rewind file":
+            break
+
+    def Column(lines, word):
+        return _np.array([line[word] for line in lines], dtype=float)
+
+    try:
+        # words of the lines used
+        positions = [flist[start + 1].split('*')[2].split() for start in blockstarts]
+        horizontal = [flist[start + 4].split() for start in blockstarts]
+        vertical = [flist[start + 5].split() for start in blockstarts]
+        twiss = [flist[start + 8].split() for start in blockstarts]
+        transform = [flist[start + 11].split() for start in blockstarts]
+        transformGradients = [flist[start + 12].split() for start in blockstarts]
+
+        s = Column(positions, 2)
+        sigx = Column(horizontal, 3)
+        sigxp = Column(horizontal, 5)
+        sigy = Column(vertical, 3)
+        sigyp = Column(vertical, 5)
+        sigp = _np.array([flist[start + 6].split(' ')[5] for start in blockstarts], dtype=float)
+        alfx = Column(twiss, 0)
+        betx = Column(twiss, 1)
+        alfy = Column(twiss, 3)
+        bety = Column(twiss, 4)
+        dx = Column(transform, 2)
+        dy = Column(transform, 5)
+        dxp = Column(transformGradients, 2)
+        dyp = Column(transformGradients, 5)
+    except (ValueError, IndexError):
+        return None
+
+    with _np.errstate(divide='ignore', invalid='ignore'):
+        emittx = (sigx**2 - (dx*(sigp/100))**2) / betx
+        emitty = (sigy**2 - (dy*(sigp/100))**2) / bety
+
+    return {
+        'Sigma_x'   : sigx/1000,
+        'Sigma_xp'  : sigxp/1000,
+        'Sigma_y'   : sigy/1000,
+        'Sigma_yp'  : sigyp/1000,
+        'S'         : s,
+        'Alpha_x'   : alfx,
+        'Alpha_y'   : alfy,
+        'Beta_x'    : betx,
+        'Beta_y'    : bety,
+        'Emitt_x'   : emittx,
+        'Emitt_y'   : emitty,
+        'Disp_x'    : dx/10,
+        'Disp_y'    : dy/10,
+        'Disp_xp'   : dxp/10,
+        'Disp_yp'   : dyp/10,
+        'Sigma_p'   : sigp/100,
+        'Name'      : [position[4] if len(position) > 4 else '' for position in positions],
+        }
+
+
+def _OpticsRecord(values):
+    """
+    Dict of the optics of one element from the values passed to _Optics._SetTransportData.
+    """
+    sigx, sigxp, sigy, sigyp, s, dx, dy, dxp, dyp, sigp, momentum, energy, elename, elementType, r21, r43 = values
+    emittx, betx, alfx = _TwissFromSigma(_np.array([sigx], dtype=float), _np.array([sigxp], dtype=float),
+                                         _np.array([r21], dtype=float))
+    emitty, bety, alfy = _TwissFromSigma(_np.array([sigy], dtype=float), _np.array([sigyp], dtype=float),
+                                         _np.array([r43], dtype=float))
+    return {
+        'Sigma_x'   : sigx / 1000,
+        'Sigma_xp'  : sigxp / 1000,
+        'Sigma_y'   : sigy / 1000,
+        'Sigma_yp'  : sigyp / 1000,
+        'S'         : s,
+        'Alpha_x'   : alfx[0],
+        'Alpha_y'   : alfy[0],
+        'Beta_x'    : betx[0],
+        'Beta_y'    : bety[0],
+        'Emitt_x'   : emittx[0],
+        'Emitt_y'   : emitty[0],
+        'Disp_x'    : dx,
+        'Disp_y'    : dy,
+        'Disp_xp'   : dxp,
+        'Disp_yp'   : dyp,
+        'Sigma_p'   : sigp,
+        'Momentum'  : momentum,
+        'E'         : energy,
+        'Name'      : elename,
+        'Type'      : elementType
+        }
+
+
+def _CheckOpticsSection(filename, opticsStart, opticsEnd):
+    """
+    Raise an IOError if the start or end line of the optics section was not found (is None).
+    """
+    if opticsStart is None:
+        if opticsEnd is None:
+            raise IOError('No output found in ' + filename + '.')
+        else:
+            errorstring = 'The end of a lattice (line containing "0*LENGTH*") was found at ' \
+                          'line ' + _np.str(opticsEnd + 1)+',\n'
+            errorstring += 'but the start of a lattice (first line containing "*BEAM*") was not found. ' \
+                           'Please check the input file.'
+            raise IOError(errorstring)
+    elif opticsEnd is None:
+            errorstring = 'The start of a lattice (first line containing "*BEAM*") was found at ' \
+                          'line ' + _np.str(opticsStart - 1)+',\n'
+            errorstring += 'but the end of a lattice (line containing "0*LENGTH*") was not found. ' \
+                           'Please check the input file.'
+            raise IOError(errorstring)
+
+
+def _IsBlockStart(line):
+    """
+    Whether a line of the optics output starts an element, see _SectionIndex.ElementRanges.
+    """
+    if len(line) < 2:
+        return False
+    return ((line[1] == '*') or (line[:9] == '0POSITION')) and (line[2:11] != 'TRANSFORM')
+
+
+def _FirstWord(line):
+    """
+    First space separated word of a line.
+    """
+    return line.lstrip(' ').split(' ', 1)[0]
+
+
+def _GetIndex(inputFile, mmap=False):
+    """
+    Return the section index for inputFile, which can be a file name or an existing index.
+    """
+    if isinstance(inputFile, _SectionIndex):
+        return inputFile
+    return _SectionIndex(inputFile, mmap)
+
+
 class _Optics:
     """
     Class for reading optics from Transport output files.
@@ -188,20 +904,33 @@ class _Optics:
             'Name'      : '',
             'Type'      : ''
             }
+        # sigma matrix quantities used to calculate the twiss parameters.
+        self.sigmadata = {
+            'sigx'  : [],
+            'sigxp' : [],
+            'sigy'  : [],
+            'sigyp' : [],
+            'r21'   : [],
+            'r43'   : []
+            }
 
     def CheckSingleLineOutputApplied(self, inputfile):
         """
         Function to check if the control element that print element output in
         a single line was successfully applied. Check needed as not all versions
-        of TRANSPORT can run this type code.
+        of TRANSPORT can run this type code. inputfile can be a file name or an index
+        returned by IndexFile, whose result is kept so repeated checks do not read the file again.
         """
-        optics = self._getOptics(inputfile)
-        for element in optics:
-            if element == 'IO: UNDEFINED TYPE CODE 13. 19. ;':
+        return _GetIndex(inputfile).singleLineApplied
+
+    @staticmethod
+    def _IsSingleLine(elementlist):
+        for element in elementlist:
+            if element == _singleLineAppliedLine:
                 return True
         return False
 
-    def _processBeamOptics(self, flist):
+    def _processBeamOptics(self, flist, columnar=False):
         """
         Process the optics from a Beam output file.
         """
@@ -224,233 +953,173 @@ class _Optics:
             'Sigma_p'   : [],
             'Name'      : [],
             }
+        columns = _ReadBeamBlocks(flist)
+        if columns is not None:
+            transdata.update(columns)
+            return _MakeData(transdata, len(columns['S']), columnar=columnar)
+
+        # a block could not be read, read each section separately to report and skip it.
         num_elements = 0
-        for elenum, element in enumerate(flist):
+        for record in self._readBeamSections(flist):
+            for keyName, value in record.items():
+                transdata[keyName].append(value)
+            num_elements += 1
+
+        return _MakeData(transdata, num_elements, columnar=columnar)
+
+    def _readBeamSections(self, flist):
+        """
+        Generator of the elements read from a Beam output file. Yields a dict of the
+        values of each element. flist can be any iterable of the lines of the file.
+        """
+        # window of the current line and the section of 12 lines that follows it.
+        flist = iter(flist)
+        window = _deque(_itertools.islice(flist, 13))
+        elenum = 0
+        while window:
+            element = window[0]
             if element == '':  # The first line of the section should be a blank line.
-                try:
-                    section = flist[elenum+1:elenum+13]
-
-                    # Get the element name, type and start position (in s)
-                    line0 = section[0]
-                    line0split = line0.split('*')
-                    # typestr = line0split[1]
-                    reststr = line0split[2]
-                    restsplit = reststr.split(' ')
-                    restsplit = _remove_blanks(restsplit)
-                    transdata['S'].append(_np.float(restsplit[2]))
-                    try :
-                        namestr = restsplit[4]
-                    except IndexError:
-                        namestr = ''
-                    transdata['Name'].append(namestr)
-                    # transdata['type'].append(typestr)
-
-                    # Get sigma_x and sigma_xp
-                    line3 = section[3].split(' ')
-                    line3 = _remove_blanks(line3)
-                    transdata['Sigma_x'].append(_np.float(line3[3])/1000)
-                    transdata['Sigma_xp'].append(_np.float(line3[5])/1000)
-
-                    # Get sigma_y and sigma_yp
-                    line4 = section[4].split(' ')
-                    line4 = _remove_blanks(line4)
-                    transdata['Sigma_y'].append(_np.float(line4[3])/1000)
-                    transdata['Sigma_yp'].append(_np.float(line4[5])/1000)
-                    
-                    # Get momentum spread
-                    line5 = section[5].split(' ')
-                    transdata['Sigma_p'].append(_np.float(line5[5])/100)
-                    
-                    # Get alfa and beta twiss transdata for x and y.
-                    line7 = section[7].split(' ')
-                    line7 = _remove_blanks(line7)
-                    transdata['Alpha_x'].append(_np.float(line7[0]))
-                    transdata['Beta_x'].append(_np.float(line7[1]))
-                    transdata['Alpha_y'].append(_np.float(line7[3]))
-                    transdata['Beta_y'].append(_np.float(line7[4]))
-
-                    # Get horizontal and vertical dispersion
-                    line10 = section[10].split(' ')
-                    line10 = _remove_blanks(line10)
-                    transdata['Disp_x'].append(_np.float(line10[2])/10)
-                    transdata['Disp_y'].append(_np.float(line10[5])/10)
-                    
-                    # Terms for calculating the emittance.
-                    term1x = _np.float(line3[3])**2
-                    term2x = (_np.float(line10[2])*(_np.float(line5[5])/100))**2
-                    term1y = _np.float(line4[3])**2
-                    term2y = (_np.float(line10[5])*(_np.float(line5[5])/100))**2
-
-                    # Get horizontal and vertical emittance
-                    emittx = (term1x - term2x) / _np.float(line7[1])
-                    emitty = (term1y - term2y) / _np.float(line7[4])
-                    transdata['Emitt_x'].append(emittx)
-                    transdata['Emitt_y'].append(emitty)
-                
-                    num_elements += 1
-                except ValueError:
+                columns = _ReadBeamBlocks(list(window))
+                if columns is None:
                     errstr = "Could not process section beginning at line " + _np.str(elenum) + " : "
                     print(errstr)
                     print(" ")
                     print(element)
+                else:
+                    yield {keyName: value[0] for keyName, value in columns.items()}
             elif element == "EOF -- rewind file":
                 break
+            window.popleft()
+            window.extend(_itertools.islice(flist, 1))
+            elenum += 1
 
-        data = _BDA()  # Now convert the dict into BDSData instance for final output.
-        for keyName in list(transdata.keys()):
-            data._AddProperty(keyName)
-        for i in range(num_elements):
-            data.append(_GetElementData(i, transdata))
-
-        return data
-
-    def _getStandardOptics(self, inputFile):
+    def _getStandardOptics(self, inputFile, columnar=False, matrices=False):
         """
-        Get the optics from a standard output file. Returns a pytransport.Data.BDSData object.
+        Get the optics from a standard output file. Returns a pytransport.Data.BDSData object,
+        or a pytransport.Data.ColumnarData object if columnar is True.
         """
-        if self.CheckSingleLineOutputApplied(inputFile):
-            optics = self._processStandardOpticsSingleLine(inputFile)
+        elementlist = self._getOptics(_GetIndex(inputFile))
+        if self._IsSingleLine(elementlist):
+            if matrices:
+                print("Sigma and R matrices are not available from single line output and will not be read.")
+            optics = self._processStandardOpticsSingleLine(elementlist, columnar)
         else:
-            optics = self._processStandardOpticsMultiLines(inputFile)
+            optics = self._processStandardOpticsMultiLines(elementlist, columnar, matrices)
         return optics
 
-    def _processStandardOpticsMultiLines(self, inputFile):
+    def _processStandardOpticsMultiLines(self, elementlist, columnar=False, matrices=False):
         """
         Process the optics from a standard output file when written to multiple lines.
+        elementlist is the element output as returned by _getOptics. If matrices is True,
+        the sigma and R matrices of each element are read into (N,6,6) arrays.
         """
-        elementlist = self._getOptics(inputFile)
-        notokElements = ['AXIS SHIFT', 'ELEMENT MATRIX', 'FIT']
+        if matrices:
+            # allocate for every entry, trimmed to the number of elements read at the end.
+            sigmaMatrices = _np.full((len(elementlist), 6, 6), _np.nan)
+            rMatrices = _np.full((len(elementlist), 6, 6), _np.nan)
+
+        entries = list(_OpticsElements(elementlist))
+        elements = [element for element, elementType, elementProperties in entries]
+        num_elements = len(elements)
 
-        num_elements = 0
         # initialise momentum/energy since not given for every element
         momentum = 0.0
         energy = 0.0
-        proton_mass = 938.272
-
+        for element, elementType, elementProperties in entries:
+            if elementType == "BEAM" or elementType == "ACC":
+                momentum, energy = _MomentumAndEnergy(elementProperties[-2])
+            self.transdata['Name'].append(elementProperties[1].strip('"'))
+            self.transdata['Type'].append(elementType)
+            self.transdata['Momentum'].append(momentum)
+            self.transdata['E'].append(energy)
+
+        # get s position after updating machine length with element length
+        # transport output is column aligned, check the parameter has unit of M.
+        # has to be "M  ", could be "MEV" in beam element.
+        start, end = _headingColumns['length']
+        lengthStrs = [element[0][start:end] for element in elements]
+        isLength = _np.array([lengthStr[-3:] == "M  " for lengthStr in lengthStrs], dtype=bool)
+        lengths = _np.zeros(num_elements)
+        lengths[isLength] = _np.array([lengthStr[:-3] for lengthStr in lengthStrs if lengthStr[-3:] == "M  "],
+                                      dtype=float)
         # cumulative machine length for s position. S position in optics output is rounded, too inaccurate.
-        length = 0
+        self.transdata['S'] = _np.cumsum(lengths)
+
+        values = _ReadSigmaColumns(elements)
+        for key in self.sigmadata.keys():
+            self.sigmadata[key] = values[key]
+        self.transdata['Disp_x'] = values['dx']
+        self.transdata['Disp_y'] = values['dy']
+        self.transdata['Disp_xp'] = values['dxp']
+        self.transdata['Disp_yp'] = values['dyp']
+        self.transdata['Sigma_p'] = values['sigp']
+
+        if matrices:
+            for num, element in enumerate(elements):
+                _ReadSigmaMatrix(element[1:7], sigmaMatrices[num])
+                if (len(element) > 13) and (element[7][2:11] == 'TRANSFORM'):
+                    _ReadTransformMatrix(element[8:14], rMatrices[num])
+
+        self._DeriveTwiss()
+        data = _MakeData(self.transdata, num_elements, self.transunits, columnar)
+        if matrices:
+            data.sigmaMatrices = sigmaMatrices[:num_elements]
+            data.rMatrices = rMatrices[:num_elements]
+        return data
 
-        for element in elementlist:
-            if (not isinstance(element, _np.str)) and (len(element) > 1):  # I.e not a fit or matrix-modifying element
-                # type is in between * can have a space (for space charge *SP CH*)
-                elementType = element[0].split('*')[1]
-                elementProperties = _remove_blanks(element[0].split('*')[2].split(' '))
-                elementSigmaMatrix = element[1:7]
-                elementTransMatrix = element[8:]
+    def _readStandardElementsMultiLines(self, elementlist, chunk=1024):
+        """
+        Generator of the elements read from standard output written to multiple lines. Yields
+        the element output lines and a tuple of the values passed to _SetTransportData.
+        elementlist can be any iterable of elements in the format returned by _getOptics.
+        The sigma lines are read with _ReadSigmaColumns, as in _processStandardOpticsMultiLines,
+        for chunk elements at a time.
+        """
+        # initialise momentum/energy since not given for every element
+        momentum = 0.0
+        energy = 0.0
 
-                if elementType not in notokElements:
-                    if len(elementProperties) < 1 :
-                        print("The following element has no properties and is ignored:", element)
-                        continue
-                    elename = elementProperties[1].strip('"')
-                    if elementType == "BEAM" or elementType == "ACC":
-                        momentum = _np.float(elementProperties[-2])
-                        energy = _np.sqrt(proton_mass*proton_mass + momentum*momentum) - proton_mass
-
-                    # sigmax line may or may not have element coordinates too, so cannot assume index counting from 0
-                    firstLine = _remove_blanks(elementSigmaMatrix[0].split(' '))
-                    try:
-                        sigx = _np.float(firstLine[-2])
-                    except ValueError:
-                        sigx = _np.float(_remove_blanks(elementSigmaMatrix[0].split(' '))[3])
-
-                    if '*COORDINATES*' in firstLine:
-                        x = _np.float(firstLine[3])
-                        y = _np.float(firstLine[4])
-                        z = _np.float(firstLine[5])
-
-                    sigxp   = _np.float(_remove_blanks(elementSigmaMatrix[1].split(' '))[1])
-                    sigy    = _np.float(_remove_blanks(elementSigmaMatrix[2].split(' '))[1])
-                    sigyp   = _np.float(_remove_blanks(elementSigmaMatrix[3].split(' '))[1])
-                    sigt    = _np.float(_remove_blanks(elementSigmaMatrix[4].split(' '))[1])
-                    sigp    = _np.float(_remove_blanks(elementSigmaMatrix[5].split(' '))[1])
-                    r21     = _np.float(_remove_blanks(elementSigmaMatrix[1].split(' '))[3])
-                    r43     = _np.float(_remove_blanks(elementSigmaMatrix[3].split(' '))[5])
-
-                    dx      = _np.float(_remove_blanks(elementSigmaMatrix[5].split(' '))[3])
-                    dxp     = _np.float(_remove_blanks(elementSigmaMatrix[5].split(' '))[4])
-                    dy      = _np.float(_remove_blanks(elementSigmaMatrix[5].split(' '))[5])
-                    dyp     = _np.float(_remove_blanks(elementSigmaMatrix[5].split(' '))[6])
-
-                    #dx = _GetTransformLineElements(element[8])[5]
-                    #dxp = _GetTransformLineElements(element[9])[5]
-                    #dy = _GetTransformLineElements(element[10])[5]
-                    #dyp = _GetTransformLineElements(element[11])[5]
-
-                    # get s position after updating machine length with element length
-                    # transport output is column aligned, check the parameter has unit of M.
-                    # has to be "M  ", could be "MEV" in beam element.
-                    lengthStr = element[0][42:55]
-                    if lengthStr[-3:] == "M  ":
-                        length += _np.float(lengthStr[:-3])
-                    s = length
-
-                    self._SetTransportData(sigx, sigxp, sigy, sigyp, s, dx, dy, dxp, dyp, sigp, momentum, energy,
-                                           elename, elementType, r21, r43)
-                    num_elements += 1
-
-        data = _BDA()      # Now convert the dict into BDSData instance for final output.
-        for keyName, unit in self.transunits.items():
-            data._AddProperty(keyName, unit)
-        for i in range(num_elements):
-            data.append(_GetElementData(i, self.transdata))
+        # cumulative machine length for s position. S position in optics output is rounded, too inaccurate.
+        length = 0
 
-        return data
+        entries = _OpticsElements(elementlist)
+        while True:
+            block = list(_itertools.islice(entries, chunk))
+            if not block:
+                return
+            values = _ReadSigmaColumns([element for element, elementType, elementProperties in block])
+            for num, (element, elementType, elementProperties) in enumerate(block):
+                elename = elementProperties[1].strip('"')
+                if elementType == "BEAM" or elementType == "ACC":
+                    momentum, energy = _MomentumAndEnergy(elementProperties[-2])
+
+                # get s position after updating machine length with element length
+                # transport output is column aligned, check the parameter has unit of M.
+                # has to be "M  ", could be "MEV" in beam element.
+                lengthStr = element[0][slice(*_headingColumns['length'])]
+                if lengthStr[-3:] == "M  ":
+                    length += _np.float(lengthStr[:-3])
+                s = length
+
+                yield element, (values['sigx'][num], values['sigxp'][num], values['sigy'][num],
+                                values['sigyp'][num], s, values['dx'][num], values['dy'][num], values['dxp'][num],
+                                values['dyp'][num], values['sigp'][num], momentum, energy, elename, elementType,
+                                values['r21'][num], values['r43'][num])
 
     def _SetTransportData(self, sigx, sigxp, sigy, sigyp, s, dx, dy, dxp, dyp, sigp, momentum, energy, elename, elementType,
                           r21, r43):
         """
-        Set the beam data.
+        Set the beam data. The sigma matrix quantities are stored as read, the beam sizes
+        and twiss parameters are calculated for all elements by _DeriveTwiss.
         """
-        # Add/Subtract small amount if sin of phase space ellipse rotation is +/-one.
-        # This comes from the output annoyingly rounding the code to one ,
-        # which produces a div by zero later in the beta and gamma calculations.
-        if r21 == 1.0:
-            r21 -= 1e-4
-        if r21 == -1.0:
-            r21 += 1e-4
-
-        if r43 == 1.0:
-            r43 -= 1e-4
-        if r43 == -1.0:
-            r43 += 1e-4
-
-        # Calculate twiss parameters
-        xpint = _np.sqrt(sigxp ** 2 * (1 - r21 ** 2))
-        ypint = _np.sqrt(sigyp ** 2 * (1 - r43 ** 2))
+        self.sigmadata['sigx'].append(sigx)
+        self.sigmadata['sigxp'].append(sigxp)
+        self.sigmadata['sigy'].append(sigy)
+        self.sigmadata['sigyp'].append(sigyp)
+        self.sigmadata['r21'].append(r21)
+        self.sigmadata['r43'].append(r43)
 
-        ex = sigx * xpint
-        ey = sigy * ypint
-
-        if ex == 0:
-            betx = 0
-        else:
-            betx = (sigx ** 2.0) / ex
-
-        if ey == 0:
-            bety = 0
-        else:
-            bety = (sigy ** 2.0) / ey
-
-        if _np.isnan(betx):
-            betx = 0
-        if _np.isnan(bety):
-            bety = 0
-
-        alfx = -betx * r21 * sigxp/sigx
-        alfy = -bety * r43 * sigyp/sigy
-
-        self.transdata['Sigma_x'].append(sigx / 1000)  # convert to m
-        self.transdata['Sigma_xp'].append(sigxp / 1000)  # convert to rad
-        self.transdata['Sigma_y'].append(sigy / 1000)  # convert to m
-        self.transdata['Sigma_yp'].append(sigyp / 1000)  # convert to rad
         self.transdata['S'].append(s)
-        self.transdata['Alpha_x'].append(alfx)
-        self.transdata['Alpha_y'].append(alfy)
-        self.transdata['Beta_x'].append(betx)
-        self.transdata['Beta_y'].append(bety)
-        self.transdata['Emitt_x'].append(ex)
-        self.transdata['Emitt_y'].append(ey)
         self.transdata['Disp_x'].append(dx)
         self.transdata['Disp_y'].append(dy)
         self.transdata['Disp_xp'].append(dxp)
@@ -461,32 +1130,65 @@ class _Optics:
         self.transdata['Name'].append(elename)
         self.transdata['Type'].append(elementType)
 
-    def _processStandardOpticsSingleLine(self, inputFile):
+    def _DeriveTwiss(self):
+        """
+        Calculate the beam sizes, emittances and twiss parameters of every element from
+        the stored sigma matrix quantities.
+        """
+        sigx  = _np.array(self.sigmadata['sigx'], dtype=float)
+        sigxp = _np.array(self.sigmadata['sigxp'], dtype=float)
+        sigy  = _np.array(self.sigmadata['sigy'], dtype=float)
+        sigyp = _np.array(self.sigmadata['sigyp'], dtype=float)
+
+        emittx, betx, alfx = _TwissFromSigma(sigx, sigxp, _np.array(self.sigmadata['r21'], dtype=float))
+        emitty, bety, alfy = _TwissFromSigma(sigy, sigyp, _np.array(self.sigmadata['r43'], dtype=float))
+
+        self.transdata['Sigma_x']  = sigx / 1000  # convert to m
+        self.transdata['Sigma_xp'] = sigxp / 1000  # convert to rad
+        self.transdata['Sigma_y']  = sigy / 1000  # convert to m
+        self.transdata['Sigma_yp'] = sigyp / 1000  # convert to rad
+        self.transdata['Alpha_x']  = alfx
+        self.transdata['Alpha_y']  = alfy
+        self.transdata['Beta_x']   = betx
+        self.transdata['Beta_y']   = bety
+        self.transdata['Emitt_x']  = emittx
+        self.transdata['Emitt_y']  = emitty
+
+    def _processStandardOpticsSingleLine(self, elementlist, columnar=False):
         """
         Process the optics from a standard output file when written to single lines as specified
-        by a 13. 19. element in Transport.
+        by a 13. 19. element in Transport. elementlist is the element output as returned by _getOptics.
         """
-        elementlist = self._getOptics(inputFile)
         # seperate R matrix table from sigma matrix elements
         rMatrixElements = elementlist[-1]
-        rMatrix = []
 
         # Second to last is column headers for R matrix table
         sMatrix = elementlist[:-2]
 
-        for element in rMatrixElements[1:]:
-            rMatrix.append(_remove_blanks(element.split(' ')))
+        dispersion = _GetRMatrixDispersion(rMatrixElements[1:])
 
         num_elements = 0
+        for values in self._readStandardElementsSingleLine(sMatrix, dispersion):
+            self._SetTransportData(*values)
+            num_elements += 1
+
+        self._DeriveTwiss()
+        return _MakeData(self.transdata, num_elements, self.transunits, columnar)
+
+    def _readStandardElementsSingleLine(self, elementlist, dispersion):
+        """
+        Generator of the elements read from standard output written to single lines. Yields a
+        tuple of the values passed to _SetTransportData for each element. elementlist is an
+        iterable of the sigma matrix elements and dispersion the R matrix table dispersion
+        as returned by _GetRMatrixDispersion.
+        """
         momentum = 0.0
         energy = 0.0
-        proton_mass = 938.272
         notokElements = ['AXIS SHIFT']
-        okRElements = [3, 4, 5]  # ok element types for R matrix matching
 
-        for element in sMatrix:
-            if len(element) > 1:  # I.e not a fit or matrix-modifying element
-                elementLine = _remove_blanks(element[0].split(' '))
+        for element in elementlist:
+            if (not isinstance(element, _np.str)) and (len(element) > 1):  # I.e not a fit or matrix-modifying element
+                elementLine = element[0].split()
                 elementLine = _updateElementLine(elementLine)
                 elementType = elementLine[0].strip('*')  # element type
                 # typenum = _np.float(elementLine[1])
@@ -502,36 +1204,35 @@ class _Optics:
                     elename = _removeIllegals(elementLine[2])  # remove illegal characters
 
                     if elementType == "BEAM" or elementType == "ACC":
-                        momentum = _np.float(elementLine[-2])
-                        energy = _np.sqrt(proton_mass*proton_mass + momentum*momentum) - proton_mass
+                        momentum, energy = _MomentumAndEnergy(elementLine[-2])
 
                     if len(element) > 6:  # In case beam is defined before output format change.
-                        s     = _np.float(_remove_blanks(element[1].split(' '))[0])
-                        sigx  = _np.float(_remove_blanks(element[1].split(' '))[3])
-                        sigxp = _np.float(_remove_blanks(element[2].split(' '))[1])
-                        sigy  = _np.float(_remove_blanks(element[3].split(' '))[1])
-                        sigyp = _np.float(_remove_blanks(element[4].split(' '))[1])
-                        sigt  = _np.float(_remove_blanks(element[5].split(' '))[1])
-                        sigp  = _np.float(_remove_blanks(element[6].split(' '))[1])
+                        words = [line.split() for line in element[1:7]]
+                        s     = _np.float(words[0][0])
+                        sigx  = _np.float(words[0][3])
+                        sigxp = _np.float(words[1][1])
+                        sigy  = _np.float(words[2][1])
+                        sigyp = _np.float(words[3][1])
+                        sigp  = _np.float(words[5][1])
 
                         try:
-                            r21 = _np.float(_remove_blanks(element[2].split(' '))[3])
+                            r21 = _np.float(words[1][3])
                         except IndexError:
                             r21 = 0
                         try:
-                            r43 = _np.float(_remove_blanks(element[4].split(' '))[5])
+                            r43 = _np.float(words[3][5])
                         except IndexError:
                             r43 = 0
                     else:
-                        s     = _np.float(_remove_blanks(sigmaLine.split(' '))[0])
-                        sigx  = _np.float(_remove_blanks(sigmaLine.split(' '))[2])
-                        sigxp = _np.float(_remove_blanks(sigmaLine.split(' '))[4])
-                        sigy  = _np.float(_remove_blanks(sigmaLine.split(' '))[6])
-                        sigyp = _np.float(_remove_blanks(sigmaLine.split(' '))[8])
-                        sigt  = _np.float(_remove_blanks(sigmaLine.split(' '))[10])
-                        sigp  = _np.float(_remove_blanks(sigmaLine.split(' '))[12])
-                        r21   = _np.float(_remove_blanks(sigmaLine.split(' '))[14])
-                        r43   = _np.float(_remove_blanks(sigmaLine.split(' '))[15])
+                        words = sigmaLine.split()
+                        s     = _np.float(words[_singleLineWords['s']])
+                        sigx  = _np.float(words[_singleLineWords['sigx']])
+                        sigxp = _np.float(words[_singleLineWords['sigxp']])
+                        sigy  = _np.float(words[_singleLineWords['sigy']])
+                        sigyp = _np.float(words[_singleLineWords['sigyp']])
+                        sigp  = _np.float(words[_singleLineWords['sigp']])
+                        r21   = _np.float(words[_singleLineWords['r21']])
+                        r43   = _np.float(words[_singleLineWords['r43']])
 
                     dx = 0
                     dy = 0
@@ -539,117 +1240,35 @@ class _Optics:
                     dyp = 0
                     # TODO: Look up where dxp and dyp are in the output. Leave as zero for now.
                     # Find matching R matrix element and get dispersion
-                    for rElement in rMatrix:
-                        if _np.float(rElement[1]) in okRElements and (_np.float(rElement[0]) == s) \
-                                and (rElement[2] == elename):
-                            # Dispersion position dependent on existence of field strength in output
-                            # Field strength written before first *, which should be the 4th element
-                            if rElement.index('*') == 4:
-                                dx = _np.float(rElement[15])
-                                dy = _np.float(rElement[17])
-                            else:
-                                dx = _np.float(rElement[14])
-                                dy = _np.float(rElement[16])
-
-                    self._SetTransportData(sigx, sigxp, sigy, sigyp, s, dx, dy, dxp, dyp, sigp, momentum, energy,
-                                           elename, elementType, r21, r43)
-                    num_elements += 1
-
-        data = _BDA()      # Now convert the dict into BDSData instance for final output.
-        for keyName, unit in self.transunits.items():
-            data._AddProperty(keyName, unit)
-        for i in range(num_elements):
-            data.append(_GetElementData(i, self.transdata))
-        
-        return data
+                    if (s, elename) in dispersion:
+                        dx, dy = dispersion[(s, elename)]
+
+                    yield (sigx, sigxp, sigy, sigyp, s, dx, dy, dxp, dyp, sigp, momentum, energy,
+                           elename, elementType, r21, r43)
 
     def _getOptics(self, filename):
         """
         Function to extract the output from a standard output file. The output will be a list of the lines
         for each element which contains the beam data. Each element should contain the R and TRANSPORT matrices
-        which are necessary so the beam info can be calculated.
-        """
-        flist = _LoadFile(filename)
-        foundOpticsStart = False
-        foundOpticsEnd = False
-        foundRMatrixElementStart = False
-
-        for linenum, line in enumerate(flist):
-            splitline = _remove_blanks(line.split(' '))
-            if splitline and splitline[0] == '*BEAM*' and not foundOpticsStart:
-                opticsStart = linenum
-                foundOpticsStart = True
-            if splitline and splitline[0] == '0*LENGTH*':
-                opticsEnd = linenum
-                foundOpticsEnd = True
-            if splitline and splitline[0] == '0POSITION':
-                rMatrixElementStart = linenum
-                foundRMatrixElementStart = True
-    
-        if not foundOpticsStart:
-            if not foundOpticsEnd:
-                raise IOError('No output found in ' + filename + '.')
-            else:
-                errorstring = 'The end of a lattice (line containing "0*LENGTH*") was found at ' \
-                              'line ' + _np.str(opticsStart + 1)+',\n'
-                errorstring += 'but the start of a lattice (first line containing "*BEAM*") was not found. ' \
-                               'Please check the input file.'
-                raise IOError(errorstring)
-        elif not foundOpticsEnd:
-                errorstring = 'The start of a lattice (first line containing "*BEAM*") was found at ' \
-                              'line ' + _np.str(opticsStart - 1)+',\n'
-                errorstring += 'but the end of a lattice (line containing "0*LENGTH*") was not found. ' \
-                               'Please check the input file.'
-                raise IOError(errorstring)
-        else:
-            output = flist[opticsStart:opticsEnd]
-
-        # Append rest of the file which should only contain a table of R Matrix elements.
-        if foundRMatrixElementStart:
-            output.extend(flist[rMatrixElementStart:])
+        which are necessary so the beam info can be calculated. filename can be a file name or a section index.
+        """
+        index = _GetIndex(filename)
+        flist = index.lines
+        _CheckOpticsSection(index.filename, index.opticsStart, index.opticsEnd)
 
-        # Split the list of all element data into their individual elements.
+        # Split the element data into individual elements. A trailing 'IO' line
+        # is a message from Transport and kept as a separate string entry.
         elementlist = []
-        elementstart = False
-        elementend = False
-        finalelement = False
-        for linenum, line in enumerate(output):
-            if linenum == (len(output)-1):
-                finalelement = True
-            try:
-                if (line[1] == '*') or (line[:9] == '0POSITION'):
-                    if line[2:11] == 'TRANSFORM':  # Is midway through element output
-                        pass
-                    elif elementstart is False:  # Current line must be start of the element
-                        elementstart = True
-                        elementstartline = linenum
-                    elif elementstart is True:
-                        elementend = True       # Otherwise the line must be the start of the next element
-                        elementendline = linenum
-                if elementstart and finalelement:
-                    element = output[elementstartline:]
-                    if element[-1][:2] == 'IO':
-                        elementlist.append(element[:-1])
-                        elementlist.append(element[-1])
-                    else:
-                        elementlist.append(element)
-                if elementstart and elementend:  # If the start and end of the element are found, append and reset
-                    element = output[elementstartline:elementendline]
-                    if element[-1][:2] == 'IO':
-                        elementlist.append(element[:-1])
-                        elementlist.append(element[-1])
-                    else:
-                        elementlist.append(element)
-                    elementend = False
-                    elementstart = False
-                if elementstart is False and elementend is False:  # Though if it's been reset, it must be because the
-                    elementstart = True                            # current line is the start of next element, so set
-                    elementstartline = linenum                     # the start line for the next element
-            except IndexError:
-                pass
+        for start, end in index.ElementRanges():
+            element = flist[start:end]
+            if element[-1][:2] == 'IO':
+                elementlist.append(element[:-1])
+                elementlist.append(element[-1])
+            else:
+                elementlist.append(element)
         return elementlist
 
-    def _getBeamOptics(self, inputFile):
+    def _getBeamOptics(self, inputFile, columnar=False):
         """
         Returns a BDSData instance of parameters from the input file.
         The input file is assumed to contain the beam data as output
@@ -682,25 +1301,11 @@ class _Optics:
             incorrect sign. This doesn't affect the resulting beam size, but beware
             that a direct dispersion comparison to another lattice may appear incorrect.
         """
-        flist = _LoadFile(inputFile)
-        transdata = self._processBeamOptics(flist)
+        flist = _GetIndex(inputFile).lines
+        transdata = self._processBeamOptics(flist, columnar)
         return transdata
 
 
-def _remove_blanks(line):
-    """
-    Removes any blanks from a string (blanks being '' and not white spaces).
-    """
-    newline = ''
-    for element in line:
-        if element != '':
-            newline += element
-            newline += ' '
-    stripline = newline.split(' ')
-    # remove last element as it will be blank (due to added space)
-    return stripline[:-1]
-
-
 def _removeIllegals(line):
     """
     Function to remove '' and stray characters from lines.
@@ -727,27 +1332,6 @@ def _split_negatives(line):
     return newline
 
 
-def _LoadFile(inputfile):
-    """
-    Converts the input file into a list. The data has to be in a format other than
-    handling line by line (using next()).
-
-    The function for processing the file reads section by section rather than line
-    by line. This may be an inefficient method but the input file should not be very
-    large so it should not require a large amount of memory.
-    """
-    if inputfile == '':
-        raise IOError('No file name supplied.')
-    flist = []
-    infile = open(inputfile)
-    # Loop over lines and remove any carriage returns (both Mac and Unix)
-    for line in infile:
-        cleanline = line.rstrip('\r\n')
-        flist.append(cleanline)
-    infile.close()
-    return flist
-
-
 def _updateElementLine(line):
     if (line[0] == '*Z') and (line[1] == 'ROT*'):
         newline = []
@@ -761,17 +1345,236 @@ def _updateElementLine(line):
     return newline
 
 
+def _TwissFromSigma(sig, sigp, r):
+    """
+    Emittance, beta and alpha for arrays of the beam size sig, divergence sigp and
+    correlation r from the Transport sigma matrix.
+    """
+    # Add/Subtract small amount if sin of phase space ellipse rotation is +/-one.
+    # This comes from the output annoyingly rounding the code to one ,
+    # which produces a div by zero later in the beta and gamma calculations.
+    r = _np.where(r == 1.0, r - 1e-4, r)
+    r = _np.where(r == -1.0, r + 1e-4, r)
+
+    with _np.errstate(divide='ignore', invalid='ignore'):
+        emitt = sig * _np.sqrt(sigp ** 2 * (1 - r ** 2))
+        beta = _np.where(emitt == 0, 0.0, (sig ** 2.0) / emitt)
+        beta[_np.isnan(beta)] = 0
+        alpha = _np.where(sig == 0, 0.0, -beta * r * sigp / sig)
+    return emitt, beta, alpha
+
+
+def _GetRMatrixDispersion(rMatrixLines):
+    """
+    Parse the R matrix table of single line output once. Returns a dict of (dx, dy) keyed by
+    the (S, name) of each row with a dispersion carrying type code (3, 4 or 5). If rows share a
+    key, the last one is kept. Rows that cannot be read are ignored.
+    """
+    okRElements = [3, 4, 5]  # ok element types for R matrix matching
+    dispersion = {}
+    for line in rMatrixLines:
+        rElement = line.split()
+        try:
+            if _np.float(rElement[1]) not in okRElements:
+                continue
+            key = (_np.float(rElement[0]), rElement[2])
+            # Dispersion position dependent on existence of field strength in output
+            # Field strength written before first *, which should be the 4th element
+            if rElement.index('*') == 4:
+                dispersion[key] = (_np.float(rElement[15]), _np.float(rElement[17]))
+            else:
+                dispersion[key] = (_np.float(rElement[14]), _np.float(rElement[16]))
+        except (ValueError, IndexError):
+            continue
+    return dispersion
+
+
+def _MakeData(transdata, num_elements, units=None, columnar=False):
+    """
+    Convert a dict of lists of values for each variable into a BDSData instance for final output,
+    or a ColumnarData instance if columnar is True. Only the first num_elements values are used.
+    """
+    if units is None:
+        units = {keyName: 'NA' for keyName in transdata.keys()}
+    if columnar:
+        data = _ColumnarData()
+        for keyName, unit in units.items():
+            data._AddProperty(keyName, transdata[keyName][:num_elements], unit)
+        return data
+
+    data = _BDA()
+    for keyName, unit in units.items():
+        data._AddProperty(keyName, unit)
+    for i in range(num_elements):
+        data.append(_GetElementData(i, transdata))
+    return data
+
+
 def _GetElementData(index, dataDict):
     # Function to get the data for each element, rather than each key.
     elementlist = [dataDict[keyName][index] for keyName in list(dataDict.keys())]
     return elementlist
 
+def _OpticsElements(elementlist):
+    """
+    Generator of the elements in multi-line optics output that are written to the optics data.
+    Yields the element output lines, element type and element properties.
+    """
+    notokElements = ['AXIS SHIFT', 'ELEMENT MATRIX', 'FIT']
+    for element in elementlist:
+        if (not isinstance(element, _np.str)) and (len(element) > 1):  # I.e not a fit or matrix-modifying element
+            # type is in between * can have a space (for space charge *SP CH*)
+            elementType = element[0].split('*')[1]
+            elementProperties = element[0].split('*')[2].split()
+            if elementType not in notokElements:
+                if len(elementProperties) < 1 :
+                    print("The following element has no properties and is ignored:", element)
+                    continue
+                yield element, elementType, elementProperties
+
+
+def _MomentumAndEnergy(momentumStr, proton_mass=938.272):
+    """
+    Momentum and kinetic energy (MeV) from the momentum field of a beam or acceleration element.
+    """
+    momentum = _np.float(momentumStr)
+    energy = _np.sqrt(proton_mass*proton_mass + momentum*momentum) - proton_mass
+    return momentum, energy
+
+
+def _ReadColumn(lines, columns):
+    """
+    Convert the field at columns (start, end) of every line to a float array in one step.
+    Fields that cannot be converted are NaN.
+    """
+    start, end = columns
+    fields = [line[start:end] for line in lines]
+    try:
+        return _np.array(fields, dtype=float)
+    except ValueError:
+        return _np.array([_ToFloat(field) for field in fields], dtype=float)
+
+
+def _ToFloat(field):
+    try:
+        return _np.float(field)
+    except ValueError:
+        return _np.nan
+
+
+def _ReadSigmaColumns(elements):
+    """
+    Read the sigma matrix fields of all elements of standard output written to multiple lines
+    at once, using the positions in _sigmaLineColumns. Returns a dict of arrays of sigx, sigxp,
+    sigy, sigyp, r21, r43, sigp, dx, dxp, dy and dyp. Elements whose sigma lines do not match
+    the column layout are read by words with _ReadSigmaWords.
+    """
+    lines = [[element[i + 1] for element in elements] for i in range(6)]
+    sizes = [_ReadColumn(lines[i], _sigmaLineColumns['size']) for i in range(6)]
+    correlations = _sigmaLineColumns['correlations']
+    values = {
+        'sigx'  : sizes[0],
+        'sigxp' : sizes[1],
+        'sigy'  : sizes[2],
+        'sigyp' : sizes[3],
+        'r21'   : _ReadColumn(lines[1], correlations[0]),
+        'r43'   : _ReadColumn(lines[3], correlations[2]),
+        'sigp'  : sizes[5],
+        'dx'    : _ReadColumn(lines[5], correlations[0]),
+        'dxp'   : _ReadColumn(lines[5], correlations[1]),
+        'dy'    : _ReadColumn(lines[5], correlations[2]),
+        'dyp'   : _ReadColumn(lines[5], correlations[3]),
+        }
+
+    # the fields are only where expected if the unit of each beam size is too.
+    start, end = _sigmaLineColumns['unit']
+    unmatched = _np.zeros(len(elements), dtype=bool)
+    for sigmaLines in lines:
+        unmatched |= _np.array([not line[start:end].strip().isalpha() for line in sigmaLines], dtype=bool)
+    for column in values.values():
+        unmatched |= _np.isnan(column)
+
+    order = ['sigx', 'sigxp', 'sigy', 'sigyp', 'sigp', 'r21', 'r43', 'dx', 'dxp', 'dy', 'dyp']
+    for num in _np.flatnonzero(unmatched):
+        for key, value in zip(order, _ReadSigmaWords(elements[num][1:7])):
+            values[key][num] = value
+    return values
+
+
+def _ReadSigmaWords(sigmaLines):
+    """
+    Read the sigma matrix fields of an element from its six sigma lines by splitting them into words.
+    Returns sigx, sigxp, sigy, sigyp, sigp, r21, r43, dx, dxp, dy, dyp.
+    """
+    words = [line.split() for line in sigmaLines]
+    # sigmax line may or may not have element coordinates too, so cannot assume index counting from 0
+    try:
+        sigx = _np.float(words[0][-2])
+    except ValueError:
+        sigx = _np.float(words[0][3])
+    return (sigx,
+            _np.float(words[1][1]),  # sigxp
+            _np.float(words[2][1]),  # sigy
+            _np.float(words[3][1]),  # sigyp
+            _np.float(words[5][1]),  # sigp
+            _np.float(words[1][3]),  # r21
+            _np.float(words[3][5]),  # r43
+            _np.float(words[5][3]),  # dx
+            _np.float(words[5][4]),  # dxp
+            _np.float(words[5][5]),  # dy
+            _np.float(words[5][6]))  # dyp
+
+
+def _ReadSigmaMatrix(lines, matrix):
+    """
+    Fill the 6x6 array matrix with the beam (sigma) matrix from the six sigma lines of an element.
+    Each line ends with the beam size, its unit and the correlations to the previous coordinates,
+    so the values are counted from the end of the line. The matrix is left unchanged if a line
+    cannot be read.
+    """
+    sizes = _np.empty(6)
+    correlations = _np.eye(6)
+    try:
+        for i, line in enumerate(lines):
+            words = line.split()
+            sizes[i] = _np.float(words[-(i + 2)])
+            for j in range(i):
+                correlations[i, j] = _np.float(words[j - i])
+                correlations[j, i] = correlations[i, j]
+    except (ValueError, IndexError):
+        return
+    matrix[:] = correlations * _np.outer(sizes, sizes)
+
+
+def _ReadSecondOrderMatrix(element, matrix):
+    """
+    Fill the (6,21) array matrix with the second order terms printed after the *TRANSFORM 2*
+    heading of an element. Terms that are not printed are left unchanged.
+    """
+    for linenum in range(len(element)):
+        if element[linenum][1:14] == '*TRANSFORM 2*':
+            break
+    else:
+        return
+    for line in element[linenum + 1:]:
+        for i, j, k, value in _secondOrderTerm.findall(line):
+            value = value.replace('D', 'E').replace('d', 'e')
+            matrix[int(i) - 1, _secondOrderPairs[int(j) - 1, int(k) - 1]] = _np.float(value)
+
+
+def _ReadTransformMatrix(lines, matrix):
+    """
+    Fill the 6x6 array matrix with the first order transfer matrix from the six fixed width
+    lines following *TRANSFORM 1*.
+    """
+    for i, line in enumerate(lines):
+        matrix[i] = _GetTransformLineElements(line)
+
+
 def _GetTransformLineElements(line):
     elements = []
-    for element in range(6):
-        start = ((element + 1) * 10 + 1)
-        end = start + 10
-        eleVal = _remove_blanks(line[start:end].split(' '))[0]
+    for start, end in _transformLineColumns:
+        eleVal = line[start:end].split()[0]
         try:
             elements.append(_np.float(eleVal))
         except ValueError:
@@ -0,0 +1,231 @@
+"""
+_Emitter
+
+Lightweight writers of gmad and MAD-X text used in conversion when no pybdsim or pymadx
+machine is supplied. They have the methods of a pybdsim/pymadx Builder.Machine used by
+the converter, but write each element to a temporary file as it is added rather than
+keeping the model in memory, so pybdsim and pymadx are not needed to write the text.
+
+Classes:
+Machine - streams the elements of a machine to gmad or MAD-X text.
+Beam - beam definition, used as Machine.beam.
+Options - bdsim options.
+
+"""
+
+import os as _os
+import tempfile as _tempfile
+
+# gmad beam parameter names for each setter of the pybdsim Beam.
+_beamKeys = {
+    'SetParticleType'     : 'particle',
+    'SetEnergy'           : 'energy',
+    'SetDistributionType' : 'distrType',
+    'SetBetaX'            : 'betx',
+    'SetBetaY'            : 'bety',
+    'SetAlphaX'           : 'alfx',
+    'SetAlphaY'           : 'alfy',
+    'SetEmittanceX'       : 'emitx',
+    'SetEmittanceY'       : 'emity',
+    'SetSigmaE'           : 'sigmaE',
+    'SetSigmaT'           : 'sigmaT',
+    'SetSigmaX'           : 'sigmaX',
+    'SetSigmaY'           : 'sigmaY',
+    'SetSigmaXP'          : 'sigmaXp',
+    'SetSigmaYP'          : 'sigmaYp',
+    'SetX0'               : 'X0',
+    'SetY0'               : 'Y0',
+    'SetZ0'               : 'Z0',
+    }
+_stringBeamKeys = ['particle', 'distrType']
+
+# element type and parameters (name, gmad units) of each Add method of the pybdsim/pymadx Machine.
+_gmadElements = {
+    'AddDrift'       : ('drift',       [('l', 'm')]),
+    'AddMarker'      : ('marker',      []),
+    'AddDipole'      : ('sbend',       [('l', 'm'), ('angle', ''), ('e1', ''), ('e2', ''), ('fint', ''),
+                                        ('fintx', ''), ('fintK2', ''), ('fintxK2', ''), ('hgap', 'm')]),
+    'AddQuadrupole'  : ('quadrupole',  [('l', 'm'), ('k1', '')]),
+    'AddSextupole'   : ('sextupole',   [('l', 'm'), ('k2', '')]),
+    'AddSolenoid'    : ('solenoid',    [('l', 'm'), ('ks', '')]),
+    'AddRCol'        : ('rcol',        [('l', 'm'), ('xsize', 'm'), ('ysize', 'm'), ('material', '')]),
+    'AddRFCavity'    : ('rf',          [('l', 'm'), ('gradient', 'MV/m')]),
+    'AddTransform3D' : ('transform3d', [('psi', '')]),
+    }
+_madxElements = {
+    'AddDrift'       : ('DRIFT',      [('L', '')]),
+    'AddMarker'      : ('MARKER',     []),
+    'AddDipole'      : ('SBEND',      [('L', ''), ('ANGLE', ''), ('E1', ''), ('E2', ''), ('FINT', ''),
+                                       ('FINTX', ''), ('HGAP', '')]),
+    'AddQuadrupole'  : ('QUADRUPOLE', [('L', ''), ('K1', '')]),
+    'AddSextupole'   : ('SEXTUPOLE',  [('L', ''), ('K2', '')]),
+    'AddSolenoid'    : ('SOLENOID',   [('L', ''), ('KS', '')]),
+    }
+# keyword arguments of the Add methods that are named differently in the output.
+_argumentNames = {'length': 'l'}
+# factors to convert gmad beam units to the MAD-X units (m, GeV).
+_madxUnits = {'': 1.0, 'm': 1.0, 'mm': 1e-3, 'um': 1e-6, 'nm': 1e-9, 'GeV': 1.0, 'MeV': 1e-3, 'keV': 1e-6}
+
+
+def _Value(value, units=''):
+    """
+    Text of a parameter value, with units if given.
+    """
+    if isinstance(value, str):
+        text = value
+    else:
+        text = repr(float(value))
+    if units:
+        text += '*' + units
+    return text
+
+
+class Beam(dict):
+    """
+    Beam definition with the setter methods of the pybdsim Beam. The values are kept as text,
+    keyed by their gmad parameter name.
+    """
+    def __getattr__(self, name):
+        if name not in _beamKeys:
+            raise AttributeError(name)
+        key = _beamKeys[name]
+
+        def _Set(*args, **kwargs):
+            units = kwargs.pop('unitsstring', args[1] if len(args) > 1 else '')
+            value = args[0] if args else list(kwargs.values())[0]
+            if key in _stringBeamKeys:
+                self[key] = '"' + value + '"'
+            else:
+                self[key] = _Value(value, units)
+        return _Set
+
+
+class Options(dict):
+    """
+    bdsim options with the setter methods of pybdsim Options used in conversion.
+    """
+    def SetPhysicsList(self, physicslist=''):
+        self['physicsList'] = '"' + physicslist + '"'
+
+    def SetBeamPipeRadius(self, beampiperadius=0, unitsstring='m'):
+        self['beampipeRadius'] = _Value(beampiperadius, unitsstring)
+
+
+class Machine:
+    """
+    Writes the elements of a machine as gmad (target = 'gmad') or MAD-X (target = 'madx') text.
+    Elements are written to a temporary file as they are added, then copied to the output file
+    with the line, beam and options by Write. Elements that the target does not have are skipped.
+    As in the pybdsim/pymadx builders, an element added again with the same name is only added
+    to the line, keeping its first definition.
+    """
+    def __init__(self, target='gmad'):
+        if target not in ['gmad', 'madx']:
+            raise ValueError("Unknown emitter target '" + target + "'")
+        self.target = target
+        self.beam = Beam()
+        self.options = None
+        self.samplers = []
+        self._elements = _gmadElements if target == 'gmad' else _madxElements
+        self._components = _tempfile.TemporaryFile('w+')
+        self._sequence = _tempfile.TemporaryFile('w+')
+        self._defined = set()
+        self._beam = None
+
+    def __getattr__(self, method):
+        if method not in _gmadElements:
+            raise AttributeError(method)
+        element = self._elements.get(method)
+
+        def _Add(name, category=None, **kwargs):
+            self._AddElement(name, element, kwargs)
+        return _Add
+
+    def Empty(self):
+        """
+        New empty machine with the same target, used instead of copying the machine.
+        """
+        return Machine(self.target)
+
+    def AddBeam(self, beam):
+        self._beam = beam
+
+    def AddOptions(self, options):
+        self.options = options
+
+    def AddSampler(self, name):
+        self.samplers.append(name)
+
+    def Write(self, filename):
+        """
+        Write the machine to filename. The machine can be written again, or have
+        more elements added, after it is written.
+        """
+        with open(filename, 'w') as f:
+            f.write('! Converted from TRANSPORT by pytransport\n\n')
+            self._components.seek(0)
+            for line in self._components:
+                f.write(line)
+            f.write('\n')
+            self._WriteSequence(f)
+            if self.target == 'gmad':
+                self._WriteGmadSettings(f)
+            else:
+                self._WriteMadxSettings(f)
+        # back to the end, so elements added after writing are appended.
+        self._components.seek(0, _os.SEEK_END)
+        self._sequence.seek(0, _os.SEEK_END)
+        print("Lattice written to: " + filename)
+
+    def _AddElement(self, name, element, kwargs):
+        if element is None:
+            return  # not available for this target
+        self._sequence.write(name + '\n')
+        if name in self._defined:
+            return
+        self._defined.add(name)
+        elementType, parameters = element
+        values = {_argumentNames.get(key, key).lower(): value for key, value in kwargs.items()}
+        text = name + ': ' + elementType
+        for parameter, units in parameters:
+            if parameter.lower() in values:
+                value = values[parameter.lower()]
+                if isinstance(value, str):
+                    value = '"' + value + '"'
+                text += ', ' + parameter + '=' + _Value(value, units)
+        self._components.write(text + ';\n')
+
+    def _WriteSequence(self, f):
+        line = 'l0: line = (' if self.target == 'gmad' else 'l0: LINE = ('
+        f.write(line)
+        self._sequence.seek(0)
+        for num, name in enumerate(self._sequence):
+            if num > 0:
+                f.write(',\n' if num % 8 == 0 else ', ')
+            f.write(name.rstrip('\n'))
+        f.write(');\n\n')
+
+    def _WriteGmadSettings(self, f):
+        f.write('use, period=l0;\n\n')
+        for sampler in self.samplers:
+            f.write('sample, ' + sampler + ';\n')
+        if self._beam:
+            f.write('\nbeam, ' + ',\n      '.join(key + '=' + _Value(value) for key, value in self._beam.items()) + ';\n')
+        if self.options:
+            f.write('\noption, ' + ',\n        '.join(key + '=' + _Value(value)
+                                                  for key, value in self.options.items()) + ';\n')
+
+    def _WriteMadxSettings(self, f):
+        if self._beam:
+            beam = ['PARTICLE=' + self._beam['particle'].strip('"').upper()] if 'particle' in self._beam else []
+            for key, madxKey in [('energy', 'ENERGY'), ('emitx', 'EX'), ('emity', 'EY'),
+                                 ('sigmaE', 'SIGE'), ('sigmaT', 'SIGT')]:
+                if key in self._beam:
+                    value, units = (self._beam[key].split('*') + [''])[:2]
+                    beam.append(madxKey + '=' + _Value(float(value) * _madxUnits[units]))
+            f.write('BEAM, ' + ', '.join(beam) + ';\n')
+            twiss = ['BETX', 'BETY', 'ALFX', 'ALFY']
+            initial = [key + '=' + self._beam[key.lower()] for key in twiss if key.lower() in self._beam]
+            if initial:
+                f.write('INITIAL: BETA0, ' + ', '.join(initial) + ';\n')
+        f.write('USE, PERIOD=l0;\n')
@@ -3,6 +3,7 @@ General utilities for day to day housekeeping
 
 Classes:
 _Writer - a class used for writing any output during conversion.
+Token - a tokenised line of a TRANSPORT deck, see TokeniseLine.
 
 """
 import numpy as _np
@@ -10,11 +11,24 @@ from scipy import constants as _con
 import sys as _sys
 import os as _os
 import glob as _glob
+import re as _re
+from collections import deque as _deque
+from collections import namedtuple as _namedtuple
+from concurrent import futures as _futures
 
 from . import Reader as _Reader
 from .Data import _beamprops
 from .Data import ConversionData
 
+# A line of a TRANSPORT deck or output lattice split into its parts by TokeniseLine.
+# typecode is None for lines that are not an element (comments, SENTINEL, headings).
+Token = _namedtuple('Token', ['typecode', 'fit', 'label', 'params', 'comment', 'terminated'])
+
+_commentPattern  = _re.compile(r'\(([^)]*)\)?')
+_labelPattern    = _re.compile(r'/([^/]*)/?|\'([^\']*)\'?|"([^"]*)"?|=([^=]*)=?')
+_typeCodePattern = _re.compile(r'\s*([+-]?\d+\.?)(\S*)')
+_numberPattern   = _re.compile(r'(?<!\S)[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?')
+
 
 class _Writer:
     """
@@ -33,28 +47,59 @@ class _Writer:
         self.debug = debugOutput
         self.logfile = logfile
         self.outlog = writeToLog
+        self._log = None  # log file handle, opened on the first write and kept open until Close
+        self.written = []  # paths of the machine files written
 
-    def Printout(self, line, outToTerminal=True):
+    def Printout(self, line, *args, **kwargs):
         """
         Print line output string. Prints to output log if specified at class instantiation.
-        Argument outToTerminal (bool, default = True) will print line to the terminal if True.
+        If args are given, the line is formatted with them (line % args) when it is printed.
+        Keyword argument outToTerminal (bool, default = True) will print line to the terminal if True.
         """
+        outToTerminal = kwargs.get('outToTerminal', True)
+        if not (outToTerminal or self.outlog):
+            return
+        line = self._Format(line, args)
         if outToTerminal:
             _sys.stdout.write(line+'\n')
         if self.outlog:
-            if self.logfile == '':
-                raise IOError("Invalid log file name: ''")
-            logfile = open(self.logfile, 'a')
-            logfile.write(line)
-            logfile.write('\n')
-            logfile.close()
-
-    def DebugPrintout(self, line):
+            if self._log is None:
+                if self.logfile == '':
+                    raise IOError("Invalid log file name: ''")
+                self._log = open(self.logfile, 'a', buffering=1 << 16)
+            self._log.write(line)
+            self._log.write('\n')
+
+    def DebugPrintout(self, line, *args):
         """
-        Print line debug output string to logfile only.
+        Print line debug output string to logfile only. The line can be a format string and
+        args, or a function returning the line, so it is only made if debug output is on.
         """
         if self.debug:
-            self.Printout(line, outToTerminal=False)
+            self.Printout(line, *args, outToTerminal=False)
+
+    def Flush(self):
+        """
+        Write any buffered log output to the log file.
+        """
+        if self._log is not None:
+            self._log.flush()
+
+    def Close(self):
+        """
+        Write any buffered log output and close the log file. It is opened again if more is printed.
+        """
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    @staticmethod
+    def _Format(line, args):
+        if callable(line):
+            return line()
+        if args:
+            return line % args
+        return line
 
     def BeamDebugPrintout(self, beam, units):
         """
@@ -64,6 +109,8 @@ class _Writer:
         """
         if not isinstance(beam, _beamprops):
             raise TypeError("Beam must be pytransport.Data._beamprops instance.")
+        if not self.debug:
+            return
         self.DebugPrintout('\tBeam definition :')
         self.DebugPrintout('\tdistrType = ' + beam.distrType)
         self.DebugPrintout('\tenergy = '  + _np.str(beam.tot_energy) + ' GeV')
@@ -86,9 +133,7 @@ class _Writer:
         """
         Print the debug output string as required in the element preparation stage.
         """
-        debugString = "\tEntry is a " + elementType + ", adding to the element registry as element "
-        debugString += numElements + "."
-        self.DebugPrintout(debugString)
+        self.DebugPrintout("\tEntry is a %s, adding to the element registry as element %s.", elementType, numElements)
 
     def Write(self, convData, filename):
         """
@@ -101,24 +146,75 @@ class _Writer:
         if not isinstance(convData, ConversionData):
             raise TypeError("convData must be a pytransport.Data.ConversionData instance.")
 
-        fname = ""
-        directory = ""
-        if convData.convprops.gmadoutput:
-            fname = filename + '.gmad'
-            directory = convData.convprops.gmadDir
-        elif convData.convprops.madxoutput:
-            fname = filename + '.madx'
-            directory = convData.convprops.madxDir
-
-        self.Printout('Writing to file: ' + directory + "/" + fname)
-        if directory == "":
-            convData.machine.Write(fname)
-        else:
-            if not CheckDirExists(directory):
-                _os.mkdir(directory)
-            _os.chdir(directory)
-            convData.machine.Write(fname)
-            _os.chdir('../')
+        # one file per format, each in its own directory.
+        for extension, directory, machine in convData.TargetMachines():
+            fname = filename + extension
+            self.Printout('Writing to file: ' + directory + "/" + fname)
+            # write to the path rather than changing the working directory, so conversions can run side by side.
+            if directory != "":
+                _os.makedirs(directory, exist_ok=True)
+                fname = _os.path.join(directory, fname)
+            machine.Write(fname)
+            self.written.append(fname)
+
+
+def _ParallelMap(function, arguments, workers=None, ordered=True, maxInFlight=None):
+    """
+    Generator that calls function(*args) for each args in arguments in a pool of worker
+    processes. Yields (index, result, error) for each call, where index is the position
+    in arguments and error is None or the exception raised by the call.
+
+    workers: int, default = number of CPUs. With one worker the calls are made in this process.
+    ordered: bool, default = True. Yield in the order of arguments rather than as the calls complete.
+    maxInFlight: int, default = 2 * workers. Maximum number of calls submitted whose results
+    have not yet been yielded, which bounds the memory held by results.
+    """
+    if workers is None:
+        workers = _os.cpu_count() or 1
+    if maxInFlight is None:
+        maxInFlight = 2 * workers
+    maxInFlight = max(maxInFlight, 1)
+
+    if workers == 1:
+        for index, args in enumerate(arguments):
+            try:
+                yield index, function(*args), None
+            except Exception as error:
+                yield index, None, error
+        return
+
+    def _Result(future):
+        try:
+            return future.index, future.result(), None
+        except Exception as error:
+            return future.index, None, error
+
+    arguments = iter(enumerate(arguments))
+    with _futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        def _Submit():
+            for index, args in arguments:
+                future = pool.submit(function, *args)
+                future.index = index
+                return future
+            return None
+
+        inFlight = _deque()
+        for i in range(maxInFlight):
+            future = _Submit()
+            if future is None:
+                break
+            inFlight.append(future)
+
+        while inFlight:
+            if ordered:
+                done = inFlight.popleft()
+            else:
+                done = next(iter(_futures.wait(inFlight, return_when=_futures.FIRST_COMPLETED)[0]))
+                inFlight.remove(done)
+            future = _Submit()
+            if future is not None:
+                inFlight.append(future)
+            yield _Result(done)
 
 
 def CheckDirExists(directory):
@@ -130,21 +226,16 @@ def CheckDirExists(directory):
     return False
 
 
-def CheckIsAddition(line, filetype='input'):
+def CheckIsAddition(token, filetype='input'):
     """
     Function to check if a BEAM line of TRANSPORT code is a beam definition or r.m.s addition.
+    token is the Token of the line returned by TokeniseLine.
     """
-    # Output file is a standard format, any RMS addition line should always be 10 long.
+    # Output file is a standard format, any RMS addition line always has 8 parameters.
     if filetype == 'output':
-        if len(line) == 10:
-            return True
-
+        return len(token.params) == 8
     elif filetype == 'input':
-        if len(line) > 8:
-            if (line[8] == '0.') or (line[8] == '0'):
-                return True
-            else:
-                return False
+        return (len(token.params) > 7) and (token.params[7] == 0)
     else:
         raise ValueError("File type can only be input or output")
 
@@ -158,24 +249,21 @@ def CheckIsOutput(inputfile):
 
     being present, which represents the TRANSPORT indicator card line.
     X can be 0, 1, 2. Default is 0.
+
+    inputfile can be a file name or an index returned by pytransport.Reader.IndexFile.
     """
-    isOutput = False
     try:
-        f = open(inputfile)
-        for inputline in f:
-            inputline = inputline.replace("\r", '')
-            inputline = inputline.replace("\n", '')
-            if inputline in _Reader._allowedIndicatorLines:
-                isOutput = True
-                break
-        f.close()
+        index = _Reader._GetIndex(inputfile)
     except IOError:
         raise IOError('Cannot open file.')
-    return isOutput
+    return index.indicator is not None
 
 
 def CheckIsSentinel(line):
-    for element in line:
+    """
+    Function to check if a line (string) is the SENTINEL line that ends the lattice.
+    """
+    for element in line.split(';')[0].split():
         if element[:8] == 'SENTINEL':
             return True
     return False
@@ -186,14 +274,11 @@ def CheckSingleLineOutputApplied(inputfile):
     Function to check if the control element that print element output in
     a single line was successfully applied. Check needed as not all versions
     of TRANSPORT can run this type code.
-    """
-    _optics = _Reader._Optics()
-    optics = _optics._getOptics(inputfile)
 
-    for element in optics:
-        if element == 'IO: UNDEFINED TYPE CODE 13. 19. ;':
-            return True
-    return False
+    inputfile can be a file name or an index returned by pytransport.Reader.IndexFile.
+    The result is kept on the index. Returns False for files without optics output.
+    """
+    return _Reader._GetIndex(inputfile).singleLineApplied
 
 
 def ConvertBunchLength(transport, bunch_length):
@@ -206,26 +291,6 @@ def ConvertBunchLength(transport, bunch_length):
     return blseconds
 
 
-def FindEndOfLine(line):  # Find the end of the line of code
-    endpos = -1
-    breakloop = False
-    if isinstance(line, _np.str):
-        for charnum, char in enumerate(line):
-            if char == ';':
-                endpos = charnum
-                break
-    elif isinstance(line, _np.ndarray):
-        for index, ele in enumerate(line):
-            for char in ele:
-                if char == ';':
-                    endpos = index
-                    breakloop = True
-                    break
-            if breakloop:
-                break
-    return endpos
-
-
 def GetComment(line):
     """
     Function to extract a comment from a line.
@@ -259,54 +324,32 @@ def GetElementData(line):
     return data
 
 
-def GetFaceRotationAngles(data, linenum):
-
-    def searchForAngle(linelist):
-        angle = 0
-        for line in linelist:
-            try:
-                elecode = _np.float(line[0])
-                del elecode
-            except ValueError:
-                angle = 0
-                break
-
-            if _np.float(line[0]) == 4.0:
-                break
-            elif _np.float(line[0]) == 2.0:
-                endof = FindEndOfLine(line[1])
-                if endof != -1:
-                    try:
-                        angle = _np.round(_np.float(line[1][:endof]), 4)
-                    except ValueError:
-                        try:
-                            angle = _np.round(_np.float(line[2][:endof]), 4)
-                        except ValueError:
-                            pass
-                    else:
-                        pass
-                else:
-                    try:
-                        angle = _np.round(_np.float(line[1]), 4)
-                    except ValueError:
-                        try:
-                            angle = _np.round(_np.float(line[2]), 4)
-                        except ValueError:
-                            pass
-                    else:
-                        pass
-                break
-            else:
-                pass
-        return angle
-
-    lineList = [i for i in data[(linenum - 5):linenum]]
-    lineList.reverse()  # Search for input poleface in reverse line order
-
-    anglein = searchForAngle(lineList)
-    angleout = searchForAngle(data[linenum + 1:(linenum + 6)])
+def GetFaceRotationAngles(data, window=5):
+    """
+    Function to get the entrance and exit poleface rotation angles of every dipole in a single
+    pass over data, the list of tokens returned by TokeniseLine. A poleface rotation (type code 2)
+    line applies to a dipole if it is within window lines before (entrance) or after (exit) it,
+    with no comment, blank line or other dipole in between.
 
-    return anglein, angleout
+    Returns an array of shape (len(data), 2) of the entrance and exit angles, which are zero
+    for lines that are not dipoles.
+    """
+    angles = _np.zeros((len(data), 2))
+    poleface = None  # (linenum, angle) of the last poleface rotation that could be an entrance
+    dipole = None    # linenum of the last dipole still looking for an exit poleface rotation
+    for linenum, token in enumerate(data):
+        if token.typecode == 2.0:
+            angle = _np.round(token.params[0], 4) if len(token.params) > 0 else 0
+            if (dipole is not None) and (linenum - dipole <= window):
+                angles[dipole, 1] = angle
+            poleface = (linenum, angle)
+            dipole = None
+        elif (token.typecode is None) or (token.typecode == 4.0):
+            if (token.typecode == 4.0) and (poleface is not None) and (linenum - poleface[0] <= window):
+                angles[linenum, 0] = poleface[1]
+            poleface = None
+            dipole = linenum if token.typecode == 4.0 else None
+    return angles
 
 
 def GetIndicator(data):
@@ -393,77 +436,28 @@ def GetPreamble(data):  # Redundant until pybdsim can handle comments.
     return gmadpreamble
 
 
-def GetTypeNum(line):
+def IsTypeCode(token, typecode):
     """
-    Function to extract the element type number (type code).
-    Written because element types can contain alphabetical
-    characters when fits are used, e.g: 5.0A. Only the number
-    is required, the use of fitting does not need to be known.
+    Function to check if the absolute type code of a Token is typecode.
     """
-    eleNum = line[0]
-    characNum = 0
-    if len(eleNum) > 2:
-        for characNum in range(len(eleNum[2:])):
-            try:
-                converted = _np.float(eleNum[:characNum+2])
-                del converted
-            except ValueError:
-                break
-        typeNum = _np.float(eleNum[:characNum+2])
-    else:
-        typeNum = _np.float(eleNum)
-    return typeNum
-
-
-def JoinSplitLines(linenum, lattice):
-    firstline = lattice[linenum].replace(';', '')
-    latticeline = firstline  # Copy for later
-    firstline = _np.array(firstline.split(' '), dtype=_np.str)
-    firstline = RemoveIllegals(firstline)
-    numericals = []
-    nonnumericals = []
-    # Keep entries that are strings of numbers
-    for i in firstline:
-        try:
-            number = _np.float(i)
-            numericals.append(_np.str(number))
-        except ValueError:
-            nonnumericals.append(i)
+    return (token.typecode is not None) and (_np.abs(token.typecode) == typecode)
 
-    # Number of numerical elements minus the first which should be the entry type number.
-    # This is bascially a way of extracting any label or comments.
-    numelements = len(numericals) - 1
 
-    secline = lattice[linenum + 1].replace(';', '')
-    secline = _np.array(secline.split(' '), dtype=_np.str)
-    secline = RemoveIllegals(secline)
-    secnumericals = []
-
-    for i in secline:
-        try:
-            number = _np.float(i)
-            secnumericals.append("%.4f" % number)
-        except ValueError:
-            pass
+def JoinSplitLines(firstline, secondline):
+    """
+    Join a line of the output lattice that has been split over two lines. Should only be
+    applicable to a type 12 entry (up to 15 variables). Returns the joined line.
+    """
+    latticeline = firstline.replace(';', '')
+    numelements = len(TokeniseLine(latticeline).params)
 
     # Second line should be 15 minus number of numerical elements from prev line.
     # This is done to skip erroneous numbers in the line such as '000' which have
     # appeared when lines have been split.
-    secline = secnumericals[-15 + numelements:]
-    numericals.extend(secline)
-
-    # Add to latticeline so as to appear like one single line in the file
-    seclinetxt = ""
-    for i in secline:
-        newline = "     " + i
-        seclinetxt += newline
-    latticeline += seclinetxt
-
-    # Add name to output
-    if len(nonnumericals) == 1:
-        numericals.append(nonnumericals[0])
-    line = _np.array(numericals)
-    return latticeline, line
+    secnumericals = _numberPattern.findall(secondline.replace(';', ''))
+    for number in secnumericals[-15 + numelements:]:
+        latticeline += "     " + "%.4f" % float(number)
+    return latticeline
 
 
 def OutputFitsToRegistry(transport, outputdata):
@@ -572,6 +566,70 @@ def RemoveSpaces(line):
     return line
 
 
+def TokeniseLattice(lattice):
+    """
+    Function to tokenise the lines of the lattice of an output file (pytransport.Reader.GetLattice).
+    Returns the list of tokens and the list of lines they were made from.
+    """
+    tokens = [TokeniseLine(latticeline) for latticeline in lattice]
+    joinedTokens = []
+    lines = []
+    for linenum, latticeline in enumerate(lattice):
+        # skip lines that are empty apart from stray characters
+        if not latticeline.replace(';', '').strip(' "()'):
+            continue
+        # Method of dealing with split lines in the output
+        # Should only be applicable to type 12 entry (up to 15 variables)
+        # It is assumed that the line is always split, so be careful.
+        # Ignore line after type 12 entry (second part of split line)
+        if (linenum > 1) and IsTypeCode(tokens[linenum - 1], 12.0):
+            continue
+        latticeline = latticeline.replace(';', '')
+        token = tokens[linenum]
+        if (linenum > 0) and IsTypeCode(token, 12.0) and (linenum + 1 < len(lattice)):
+            latticeline = JoinSplitLines(latticeline, lattice[linenum + 1])
+            token = TokeniseLine(latticeline)
+        joinedTokens.append(token)
+        lines.append(latticeline)
+    return joinedTokens, lines
+
+
+def TokeniseLine(line):
+    """
+    Function to split a line of a TRANSPORT deck or output lattice into a Token of its
+    type code, fit suffix of the type code (e.g. 'A' in 5.0A), label, numeric parameters,
+    comment and whether the line is terminated by a ';'. The type code is None if the line
+    does not start with one.
+    """
+    comment = None
+    comments = _commentPattern.findall(line)
+    if comments:
+        comment = comments[0].strip()
+        line = _commentPattern.sub(' ', line)
+
+    end = line.find(';')
+    terminated = end != -1
+    if terminated:
+        line = line[:end]
+
+    label = None
+    for match in _labelPattern.finditer(line):
+        label = match.group(match.lastindex).strip()
+        if label:
+            break
+    if label is not None:
+        line = _labelPattern.sub(' ', line)
+    label = label or None
+
+    match = _typeCodePattern.match(line)
+    if match is None:
+        return Token(None, '', label, (), comment, terminated)
+    typecode = float(match.group(1))
+    fit = match.group(2).strip('0')
+    params = tuple(float(number) for number in _numberPattern.findall(line, match.end()))
+    return Token(typecode, fit, label, params, comment, terminated)
+
+
 def ScaleToMeters(transport, quantity):
     """
     Function to scale quantity (string) to meters, returns conversion factor.
@@ -18,12 +18,14 @@ except ImportError:
 
 
 from . import _General
+from . import Cache
 from . import Compare
 from . import Convert
 from . import Data
 from . import Reader
 
-__all__ = ['Compare',
+__all__ = ['Cache',
+           'Compare',
            'Convert',
            'Data',
            'Reader']
@@ -0,0 +1,111 @@
+import os
+
+import numpy
+
+import pytransport
+
+from .test_convert import _Machine
+
+_exampleFile = os.path.join(os.path.dirname(__file__), '..', 'FOR002-example.DAT')
+
+
+def test_cache_optics(tmp_path):
+    cache = pytransport.Cache.OpticsCache(str(tmp_path))
+    optics = pytransport.Reader.GetOptics(_exampleFile)
+    assert cache.GetOptics(_exampleFile) == optics
+    assert len(os.listdir(str(tmp_path))) == 1
+    # second load is read from the cache
+    cached = pytransport.Cache.OpticsCache(str(tmp_path)).GetOptics(_exampleFile, columnar=True)
+    assert cached.names == optics.names
+    assert cached.units == optics.units
+    assert cached.ToBDSData() == optics
+    assert len(os.listdir(str(tmp_path))) == 1
+
+
+def test_cache_sections(tmp_path):
+    cache = pytransport.Cache.OpticsCache(str(tmp_path))
+    for i in range(2):
+        assert cache.GetLattice(_exampleFile) == pytransport.Reader.GetLattice(_exampleFile)
+        assert cache.GetFitsSection(_exampleFile) == pytransport.Reader.GetFitsSection(_exampleFile)
+    matrices = cache.GetOptics(_exampleFile, matrices=True)
+    assert numpy.array_equal(cache.GetOptics(_exampleFile, matrices=True).rMatrices, matrices.rMatrices)
+    assert len(os.listdir(str(tmp_path))) == 3
+
+
+
+def test_cache_missing_section(tmp_path):
+    inputFile = str(tmp_path / 'nofits.DAT')
+    with open(_exampleFile) as f, open(inputFile, 'w') as g:
+        g.write(f.read().replace('0SENTINEL', '0NOFITS'))
+    cache = pytransport.Cache.OpticsCache(str(tmp_path / 'cache'))
+    assert pytransport.Reader.GetFitsSection(inputFile) is None
+    for i in range(2):
+        assert cache.GetFitsSection(inputFile) is None
+
+def test_cache_eviction(tmp_path):
+    cache = pytransport.Cache.OpticsCache(str(tmp_path), maxBytes=1)
+    cache.GetLattice(_exampleFile)
+    cache.GetOptics(_exampleFile)
+    assert len(os.listdir(str(tmp_path))) == 0
+
+
+def test_cache_conversion(tmp_path, monkeypatch):
+    inputFile = str(tmp_path / 'FOR002.DAT')
+    with open(_exampleFile) as f, open(inputFile, 'w') as g:
+        g.write(f.read())
+    outputDir = str(tmp_path / 'out')
+    cache = pytransport.Cache.ConversionCache(str(tmp_path / 'cache'))
+    assert not cache.Convert(inputFile, output='madx', outputDir=outputDir, machine=_Machine())
+    written = {name: open(os.path.join(outputDir, name)).read() for name in os.listdir(outputDir)}
+    assert written
+    for name in written:
+        os.remove(os.path.join(outputDir, name))
+    assert cache.Convert(inputFile, output='madx', outputDir=outputDir, machine=_Machine())
+    assert {name: open(os.path.join(outputDir, name)).read() for name in os.listdir(outputDir)} == written
+    # different options are a different entry
+    assert not cache.Convert(inputFile, output='madx', outputDir=outputDir, keepName=True, machine=_Machine())
+    assert len(os.listdir(str(tmp_path / 'cache'))) == 2
+    # a change to the converter output is a different entry
+    monkeypatch.setattr(pytransport.Convert, '_converterVersion', pytransport.Convert._converterVersion + 1)
+    assert not cache.Convert(inputFile, output='madx', outputDir=outputDir, machine=_Machine())
+
+
+def test_cache_conversion_file_name(tmp_path):
+    # files with the same contents but different names write differently named files.
+    cache = pytransport.Cache.ConversionCache(str(tmp_path / 'cache'))
+    for name in ['FOR002', 'RUN2']:
+        inputFile = str(tmp_path / (name + '.DAT'))
+        with open(_exampleFile) as f, open(inputFile, 'w') as g:
+            g.write(f.read())
+        outputDir = str(tmp_path / ('out' + name))
+        assert not cache.Convert(inputFile, output='madx', outputDir=outputDir, machine=_Machine())
+        assert sorted(os.listdir(outputDir)) == [name + '_part1.madx', name + '_part2.madx']
+
+
+class _SplitMachine(_Machine):
+    """
+    Machine that writes its components to a separate file, as the pybdsim builder does.
+    """
+    def Write(self, filename):
+        _Machine.Write(self, filename)
+        with open(filename.replace('.madx', '_components.madx'), 'w') as f:
+            f.write('components')
+
+
+def test_cache_conversion_written_files(tmp_path):
+    inputFile = str(tmp_path / 'FOR002.DAT')
+    with open(_exampleFile) as f, open(inputFile, 'w') as g:
+        g.write(f.read())
+    outputDir = str(tmp_path / 'out')
+    os.makedirs(outputDir)
+    with open(os.path.join(outputDir, 'FOR002_old.madx'), 'w') as f:
+        f.write('not written by the conversion')
+    written = pytransport.Convert.Convert(inputFile, output='madx', outputDir=outputDir, machine=_Machine())
+    assert sorted(os.path.basename(path) for path in written) == ['FOR002_part1.madx', 'FOR002_part2.madx']
+
+    # only the files written are stored, with the files the builder writes alongside them.
+    cache = pytransport.Cache.ConversionCache(str(tmp_path / 'cache'))
+    assert not cache.Convert(inputFile, output='madx', outputDir=outputDir, dontSplit=True, machine=_SplitMachine())
+    stored = os.listdir(str(tmp_path / 'cache'))
+    assert sorted(os.listdir(str(tmp_path / 'cache' / stored[0] / 'madx'))) == \
+        ['FOR002.madx', 'FOR002_components.madx']
@@ -0,0 +1,271 @@
+import glob
+import os
+import shutil
+
+import numpy
+import pytest
+
+import pytransport
+from pytransport import _General
+
+_exampleFile = os.path.join(os.path.dirname(__file__), '..', 'FOR002-example.DAT')
+
+
+class _Beam(dict):
+    def __getattr__(self, name):
+        if name.startswith('Set'):
+            return lambda *args, **kwargs: None
+        raise AttributeError(name)
+
+
+class _Machine:
+    """
+    Stand in for a pymadx Builder.Machine that writes the names of the elements added.
+    """
+    def __init__(self):
+        self.elements = {}
+        self.names = []
+        self.beam = _Beam()
+
+    def __getattr__(self, name):
+        if name.startswith('Add'):
+            def _Add(*args, **kwargs):
+                if 'name' in kwargs:
+                    self.elements[kwargs['name']] = kwargs
+                    self.names.append(kwargs['name'])
+            return _Add
+        raise AttributeError(name)
+
+    def Write(self, filename):
+        with open(filename, 'w') as f:
+            f.write('\n'.join(self.elements))
+
+
+def test_tokenise_input_line():
+    token = _General.TokeniseLine('5.0A 0.35 -7.99 50.0 /QMA1/ ; (first quad)\n')
+    assert token.typecode == 5.0
+    assert token.fit == 'A'
+    assert token.label == 'QMA1'
+    assert token.params == (0.35, -7.99, 50.0)
+    assert token.comment == 'first quad'
+    assert token.terminated
+
+
+def test_tokenise_output_line():
+    token = _General.TokeniseLine('   15.             "    "     11.00000      "MEV "     0.00100 =')
+    assert token.typecode == 15.0
+    assert token.label == 'MEV'
+    assert token.params == (11.0, 0.001)
+    assert not token.terminated
+    comment = _General.TokeniseLine(' (3. 0.21 /BMA1/ ;        )')
+    assert comment.typecode is None
+    assert comment.params == ()
+    assert comment.comment == '3. 0.21 /BMA1/ ;'
+    assert _General.TokeniseLine('SENTINEL').typecode is None
+
+
+def test_join_split_lines():
+    first = '   12.000000000000 "CORR"     -0.00300     0.00000     0.00000     0.00000     0.00000    -0.00500     0.00000     0.00000 '
+    second = '      000                      0.00000     0.00000     0.00000     0.00000     0.00000     0.00000     0.10000;'
+    token = _General.TokeniseLine(_General.JoinSplitLines(first, second))
+    assert token.label == 'CORR'
+    assert len(token.params) == 15
+    assert token.params[-1] == 0.1
+
+
+def test_face_rotation_angles():
+    lines = ['2. 10. ;', '4. 1.0 5.0 0.0 ;', '2. 20. ;', '4. 1.0 5.0 0.0 ;', '(comment)', '2. 30. ;',
+             '2. 40. ;', '3. 1.0 ;', '4. 1.0 5.0 0.0 ;', '3. 1.0 ;', '3. 1.0 ;', '3. 1.0 ;', '3. 1.0 ;',
+             '3. 1.0 ;', '2. 50. ;']
+    data = [_General.TokeniseLine(line) for line in lines]
+    angles = _General.GetFaceRotationAngles(data)
+    assert list(angles[1]) == [10.0, 20.0]
+    assert list(angles[3]) == [20.0, 0.0]  # comment ends the search for an exit poleface
+    assert list(angles[8]) == [40.0, 0.0]  # exit poleface is too far away
+    assert not angles[[0, 2, 4, 5, 6, 7]].any()
+
+
+def test_name_allocator():
+    names = pytransport.Data._NameAllocator()
+    assert [names.Allocate(name) for name in ['Q1', 'Q1_2', 'Q1', 'Q1', 'Q1', None, '']] == \
+        ['Q1', 'Q1_2', 'Q1_1', 'Q1_3', 'Q1_4', None, '']
+    names.Register('MA3')
+    names.Register('MA3')
+    assert names.Allocate('MA3') == 'MA3_1'
+    names.Reset()
+    assert names.Allocate('Q1') == 'Q1'
+
+
+def test_label_matching_default_name(tmp_path):
+    # the third element is named DR3 by default, a later element labelled DR3 is given a suffix.
+    inputFile = str(tmp_path / 'FOR002.DAT')
+    with open(_exampleFile) as f, open(inputFile, 'w') as g:
+        g.write(f.read().replace('"MAP1"', '"DR3"'))
+    machine = _Machine()
+    pytransport.Convert.Convert(inputFile, output='madx', outputDir=str(tmp_path / 'madx'), machine=machine,
+                                keepName=True, dontSplit=True)
+    assert machine.names[machine.names.index('DR3') + 1] == 'DR3_1'
+    assert len(set(machine.names)) == len(machine.names)
+
+
+def _ConvertExample(tmp_path):
+    inputFile = str(tmp_path / 'FOR002.DAT')
+    shutil.copy(_exampleFile, inputFile)
+    machine = _Machine()
+    pytransport.Convert.Convert(inputFile, output='bdsim', outputDir=str(tmp_path / 'bdsim'), machine=machine,
+                                options=pytransport._Emitter.Options(), keepName=True, dontSplit=True)
+    return machine
+
+
+def test_element_after_empty_comment(tmp_path):
+    # SJ1 follows an empty comment line "(   )" and is converted as a marker as it has no length.
+    machine = _ConvertExample(tmp_path)
+    assert machine.names[0] == 'SJ1'
+    assert machine.elements['SJ1'] == {'name': 'SJ1'}
+
+
+def test_type_six_before_comment(tmp_path):
+    # KFR2 is a collimator with the length of the drift SME2, after the constraints and comment line following it.
+    machine = _ConvertExample(tmp_path)
+    assert machine.names[machine.names.index('FME1'):][:3] == ['FME1', 'KFR2', 'MEH3']
+    assert machine.elements['KFR2']['length'] == 0.234
+    assert machine.elements['MEH3']['length'] == 0.17
+    assert 'SME2' not in machine.elements
+
+
+def _ConvertWithFits(tmp_path, angleDefinition):
+    """
+    Convert the example with the fitted length and field (angle) of the second of the three AME1
+    dipoles changed. Returns the converted AME1 dipoles.
+    """
+    fitted = ' *BEND*          4.000          "AME1"      0.50000 M        10.11262 KG        0.00000      ' \
+             '(   11.91165 DEG  )'
+    changed = ' *BEND*          4.000          "AME1"      0.60000 M         9.00000 KG        0.00000      ' \
+              '(   13.00000 DEG  )'
+    with open(_exampleFile) as f:
+        lines = f.read().split('\n')
+    lines[lines.index(fitted)] = changed
+    if angleDefinition:
+        firstDipole = lines.index('    4.000          "AME1"      0.44410    10.11262     0.00000;')
+        lines.insert(firstDipole, '   13.             "    "     48.00000;')
+    inputFile = str(tmp_path / 'FOR002.DAT')
+    with open(inputFile, 'w') as f:
+        f.write('\n'.join(lines))
+    machine = _Machine()
+    pytransport.Convert.Convert(inputFile, output='madx', outputDir=str(tmp_path / 'madx'), machine=machine,
+                                keepName=True, dontSplit=True)
+    return [machine.elements[name] for name in ['AME1', 'AME1_1', 'AME1_2']]
+
+
+def test_fits_dipole_field(tmp_path):
+    # the n-th fitted AME1 updates the n-th AME1, the field is updated for field defined dipoles.
+    dipoles = _ConvertWithFits(tmp_path, angleDefinition=False)
+    assert [dipole['length'] for dipole in dipoles] == [0.4441, 0.6, 0.9441]
+    anglePerField = dipoles[0]['angle'] / (0.4441 * 10.11262)
+    assert dipoles[1]['angle'] == pytest.approx(0.6 * 9.0 * anglePerField, abs=1e-3)
+    assert dipoles[2]['angle'] == pytest.approx(0.9441 * 10.11262 * anglePerField, abs=1e-3)
+
+
+def test_fits_dipole_angle(tmp_path):
+    # after 13. 48. dipoles are defined by angle, which is updated from the fitted angle.
+    dipoles = _ConvertWithFits(tmp_path, angleDefinition=True)
+    assert [dipole['length'] for dipole in dipoles] == [0.4441, 0.6, 0.9441]
+    assert [abs(dipole['angle']) for dipole in dipoles] == \
+        [round(numpy.radians(angle), 4) for angle in [10.57993, 13.0, 22.49158]]
+
+
+def test_writer_log(tmp_path):
+    logfile = str(tmp_path / 'conversion.log')
+    writer = _General._Writer(debugOutput=False, writeToLog=True, logfile=logfile)
+    calls = []
+    writer.DebugPrintout(lambda: calls.append(1) or 'not written')
+    writer.Printout('Element %d of %s', 3, 'QF', outToTerminal=False)
+    assert not calls
+    writer.debug = True
+    writer.DebugPrintout('\tdebug %s', 1.5)
+    writer.Close()
+    with open(logfile) as f:
+        assert f.read() == 'Element 3 of QF\n\tdebug 1.5\n'
+
+
+def test_convert_batch(tmp_path):
+    inputFiles = []
+    for run in ['a', 'b']:
+        os.makedirs(str(tmp_path / run))
+        inputFiles.append(str(tmp_path / run / 'FOR002.DAT'))
+        shutil.copy(_exampleFile, inputFiles[-1])
+    inputFiles.append(str(tmp_path / 'missing.DAT'))
+    cwd = os.getcwd()
+    for workers in [1, 2]:
+        results = list(pytransport.Convert.ConvertBatch(inputFiles, _Machine, output='madx', workers=workers))
+        assert [filename for filename, error, seconds in results] == inputFiles
+        assert results[0][1] is None and results[1][1] is None
+        assert isinstance(results[2][1], IOError)
+        assert all(seconds >= 0 for filename, error, seconds in results)
+    assert os.getcwd() == cwd
+    written = sorted(glob.glob(str(tmp_path / 'a' / 'madx' / '*.madx')))
+    assert written and [os.path.basename(name) for name in written] == \
+        sorted(os.path.basename(name) for name in glob.glob(str(tmp_path / 'b' / 'madx' / '*.madx')))
+
+
+def test_convert_without_machine(tmp_path):
+    inputFile = str(tmp_path / 'FOR002.DAT')
+    shutil.copy(_exampleFile, inputFile)
+    pytransport.Convert.Convert(inputFile, output='bdsim', outputDir=str(tmp_path / 'bdsim'))
+    pytransport.Convert.Convert(inputFile, output='madx', outputDir=str(tmp_path / 'madx'))
+    with open(str(tmp_path / 'bdsim' / 'FOR002_part1.gmad')) as f:
+        gmad = f.read()
+    assert 'DR1: drift, l=1.058*m;' in gmad
+    assert 'l0: line = (MA0, DR1,' in gmad
+    assert 'particle="proton"' in gmad and 'option, physicsList="em";' in gmad
+    with open(str(tmp_path / 'madx' / 'FOR002_part1.madx')) as f:
+        madx = f.read()
+    assert 'DR1: DRIFT, L=1.058;' in madx
+    assert 'BEAM, PARTICLE=PROTON' in madx and 'USE, PERIOD=l0;' in madx
+    # repeated elements are defined once and used more than once in the line.
+    for text, definition in [(gmad, 'MA3: marker;'), (madx, 'MA3: MARKER;')]:
+        assert text.count(definition) == 1 and 'MA3, MA3' in text
+
+
+def test_emitter_write_twice(tmp_path):
+    for target in ['gmad', 'madx']:
+        machine = pytransport._Emitter.Machine(target)
+        machine.AddDrift('DR1', length=1.0)
+        machine.AddMarker('MA1')
+        first, second = str(tmp_path / ('first.' + target)), str(tmp_path / ('second.' + target))
+        machine.Write(first)
+        machine.Write(second)
+        with open(first) as f, open(second) as g:
+            text = f.read()
+            assert g.read() == text
+        # elements added after writing are appended to the line.
+        machine.AddMarker('MA1')
+        machine.AddDrift('DR2', length=2.0)
+        machine.Write(second)
+        with open(second) as g:
+            extended = g.read()
+        assert extended.count('MA1: ') == 1 and 'DR2: ' in extended
+        assert ('l0: line = (DR1, MA1, MA1, DR2);' in extended) or ('l0: LINE = (DR1, MA1, MA1, DR2);' in extended)
+
+
+def test_convert_both(tmp_path):
+    inputFile = str(tmp_path / 'FOR002.DAT')
+    shutil.copy(_exampleFile, inputFile)
+    pytransport.Convert.Convert(inputFile, output='bdsim', outputDir=str(tmp_path / 'single'))
+    pytransport.Convert.Convert(inputFile, output='madx', outputDir=str(tmp_path / 'single'))
+    pytransport.Convert.Convert(inputFile, output='both', outputDir=str(tmp_path / 'both'))
+    for directory, extension in [('both_bdsim', '.gmad'), ('both_madx', '.madx')]:
+        written = sorted(os.listdir(str(tmp_path / directory)))
+        assert written == ['FOR002_part1' + extension, 'FOR002_part2' + extension]
+        for name in written:
+            with open(str(tmp_path / directory / name)) as f, open(str(tmp_path / 'single' / name)) as g:
+                assert f.read() == g.read()
+
+    # each element is added to both machines, the madx machine without the gmad only elements.
+    gmad, madx = _Machine(), _Machine()
+    pytransport.Convert.Convert(inputFile, output='both', outputDir=str(tmp_path / 'pair'), dontSplit=True,
+                                machine=(gmad, madx), options=pytransport._Emitter.Options())
+    assert 'COL1' in gmad.elements and 'COL1' not in madx.elements
+    assert [name for name in gmad.elements if not name.startswith('COL')] == list(madx.elements)
+    with open(str(tmp_path / 'pair_madx' / 'FOR002.madx')) as f:
+        assert f.read().split('\n') == list(madx.elements)
@@ -0,0 +1,254 @@
+import os
+
+import numpy
+import pytest
+
+import pytransport
+
+_exampleFile = os.path.join(os.path.dirname(__file__), '..', 'FOR002-example.DAT')
+
+
+def test_index_sections():
+    index = pytransport.Reader.IndexFile(_exampleFile)
+    assert index.lines[index.indicator] == '0    0'
+    assert index.lines[index.latticeEnd] == '0SENTINEL'
+    assert index.lines[index.opticsStart].split()[0] == '*BEAM*'
+    assert index.lines[index.opticsEnd].split()[0] == '0*LENGTH*'
+    assert index.rMatrixStart is None
+    assert not index.isBeamOutput
+    with open(_exampleFile, 'rb') as f:
+        f.seek(index.ByteOffset(index.opticsEnd))
+        assert f.readline().startswith(b'0*LENGTH*')
+
+
+def test_index_reused():
+    index = pytransport.Reader.IndexFile(_exampleFile)
+    optics = pytransport.Reader.GetOptics(index)
+    assert len(optics) == len(pytransport.Reader.GetOptics(_exampleFile))
+    assert pytransport.Reader.GetLattice(index) == pytransport.Reader.GetLattice(_exampleFile)
+    assert pytransport.Reader.GetFitsSection(index) == pytransport.Reader.GetFitsSection(_exampleFile)
+
+
+def test_index_mmap():
+    index = pytransport.Reader.IndexFile(_exampleFile)
+    mapped = pytransport.Reader.IndexFile(_exampleFile, mmap=True)
+    for section in ['indicator', 'latticeStart', 'latticeEnd', 'opticsStart', 'opticsEnd', 'rMatrixStart']:
+        assert getattr(mapped, section) == getattr(index, section)
+    assert mapped.ElementRanges() == index.ElementRanges()
+    assert list(mapped.lines) == index.lines
+    optics = pytransport.Reader.GetOptics(index)
+    mappedOptics = pytransport.Reader.GetOptics(mapped)
+    assert list(mappedOptics.GetColumn('Beta_x')) == list(optics.GetColumn('Beta_x'))
+
+
+def test_optics_columnar():
+    optics = pytransport.Reader.GetOptics(_exampleFile)
+    columnar = pytransport.Reader.GetOptics(_exampleFile, columnar=True)
+    assert len(columnar) == len(optics)
+    assert columnar.names == optics.names
+    assert columnar.units == optics.units
+    assert columnar[5] == optics[5]
+    assert list(columnar.Name()) == list(optics.Name())
+    assert columnar.ToBDSData() == optics
+
+
+def test_twiss_from_sigma_edge_cases():
+    sig = numpy.array([2.0, 2.0, 0.0, 2.0])
+    sigp = numpy.array([1.0, 1.0, 1.0, 0.0])
+    r = numpy.array([0.5, 1.0, 0.5, 0.5])
+    emitt, beta, alpha = pytransport.Reader._TwissFromSigma(sig, sigp, r)
+    assert beta[0] == pytest.approx(4.0 / (2.0 * numpy.sqrt(0.75)))
+    assert numpy.isfinite(beta[1]) and beta[1] > 0  # correlation of one is reduced slightly
+    assert beta[2] == 0 and alpha[2] == 0  # zero beam size
+    assert beta[3] == 0 and emitt[3] == 0  # zero divergence
+
+
+def test_rmatrix_dispersion():
+    rows = ['    0.205  3.0  SJ1       1.074 *   0.53   0.39  -0.46   0.60   0.18  -0.79  -0.36  -0.95   0.29  -0.98   1.57   0.76  -0.44',
+            '    1.044  5.0  SMA1   *  -0.95   0.67   0.11   0.28  -0.62   0.98   0.71  -0.75  -0.33   0.44  -0.16   0.42  -0.84',
+            '    1.044  1.0  SMA1   *  -0.95   0.67   0.11   0.28  -0.62   0.98   0.71  -0.75  -0.33   0.44  -0.16   0.42  -0.84']
+    dispersion = pytransport.Reader._GetRMatrixDispersion(rows)
+    assert dispersion == {(0.205, 'SJ1'): (1.57, -0.44), (1.044, 'SMA1'): (-0.16, -0.84)}
+
+
+def test_sigma_columns():
+    optics = pytransport.Reader._Optics()
+    elementlist = optics._getOptics(pytransport.Reader.IndexFile(_exampleFile))
+    elements = [element for element, elementType, elementProperties in pytransport.Reader._OpticsElements(elementlist)]
+    columns = pytransport.Reader._ReadSigmaColumns(elements)
+    words = numpy.array([pytransport.Reader._ReadSigmaWords(element[1:7]) for element in elements])
+    for num, key in enumerate(['sigx', 'sigxp', 'sigy', 'sigyp', 'sigp', 'r21', 'r43', 'dx', 'dxp', 'dy', 'dyp']):
+        assert numpy.array_equal(columns[key], words[:, num])
+    # an element that is not column aligned is read by words
+    shifted = [elements[1][0]] + [' ' + line for line in elements[1][1:7]]
+    columns = pytransport.Reader._ReadSigmaColumns([elements[0], shifted])
+    assert columns['sigx'][1] == words[1, 0]
+    assert columns['dyp'][1] == words[1, 10]
+
+
+def test_optics_matrices():
+    optics = pytransport.Reader.GetOptics(_exampleFile, matrices=True)
+    assert optics.sigmaMatrices.shape == (len(optics), 6, 6)
+    assert optics.rMatrices.shape == (len(optics), 6, 6)
+    assert numpy.allclose(numpy.sqrt(optics.sigmaMatrices[:, 0, 0]) / 1000, optics.Sigma_x())
+    assert numpy.allclose(optics.sigmaMatrices, optics.sigmaMatrices.transpose(0, 2, 1))
+    assert numpy.allclose(optics.rMatrices[0], numpy.eye(6))
+
+
+def test_second_order_matrices(tmp_path):
+    with open(_exampleFile) as f:
+        lines = f.readlines()
+    # add second order output after the first order matrix of the first drift
+    drift = [num for num, line in enumerate(lines) if line.startswith(' *DRIFT*')][0]
+    lines[drift + 14:drift + 14] = [' *TRANSFORM 2*\n',
+                                    '    1 11  1.00000E-01   1 12 -2.50000E+00   1 16  3.00000E+00\n',
+                                    '    2 66  4.50000E+00\n']
+    inputFile = str(tmp_path / 'FOR002.DAT')
+    with open(inputFile, 'w') as f:
+        f.writelines(lines)
+
+    optics = pytransport.Reader.GetOptics(inputFile)
+    matrices = pytransport.Reader.GetSecondOrderMatrices(inputFile, outputFile=str(tmp_path / 'T.npy'))
+    assert matrices.shape == (len(optics), 6, 21)
+    element = [num for num in range(len(optics)) if optics.Type()[num] == 'DRIFT'][0]
+    T = pytransport.Reader.UnpackSecondOrderMatrices(matrices[element])
+    assert T[0, 0, 0] == 0.1
+    assert T[0, 0, 1] == T[0, 1, 0] == -2.5
+    assert T[0, 5, 0] == 3.0
+    assert T[1, 5, 5] == 4.5
+    assert numpy.isnan(matrices[element + 1]).all()
+    assert numpy.array_equal(numpy.load(str(tmp_path / 'T.npy')), matrices, equal_nan=True)
+    assert len(list(pytransport.Reader.IterSecondOrderMatrices(inputFile))) == len(optics)
+
+
+def test_optics_batch():
+    inputFiles = [_exampleFile, 'missing-FOR002.DAT', _exampleFile]
+    results = list(pytransport.Reader.GetOpticsBatch(inputFiles, workers=2, maxInFlight=1))
+    assert [filename for filename, optics, error in results] == inputFiles
+    assert results[0][1] == pytransport.Reader.GetOptics(_exampleFile)
+    assert results[1][1] is None and isinstance(results[1][2], IOError)
+    assert results[2][2] is None
+
+
+def test_iter_optics():
+    optics = pytransport.Reader.GetOptics(_exampleFile)
+    elements = pytransport.Reader.IterOptics(_exampleFile)
+    for num in range(5):
+        assert next(elements) == optics[num]
+    elements.close()
+    assert list(pytransport.Reader.IterOptics(_exampleFile)) == [optics[num] for num in range(len(optics))]
+    for mmap in [False, True]:
+        index = pytransport.Reader.IndexFile(_exampleFile, mmap=mmap)
+        assert list(pytransport.Reader.IterOptics(index)) == [optics[num] for num in range(len(optics))]
+
+
+_beamBlock = """
+*QUAD*      z = 0.301 m   QF0
+*SIGMA*
+ Center:         0.000 mm    0.000 mrad    0.000 mm    0.000 mrad
+ horz. Par. :    3.212 mm    1.771 mrad    0.408
+ vert. Par. :    9.025 mm   14.818 mrad   -0.493
+*TWISS PARAMETERS* (for dp/p = 1.289 % )
+   alfax:     betax:         alfay:     betay:
+   7.96725   18.35387 m      2.33905    8.59124 m
+*TRANSFORM 1*
+    horz:                              vert:
+   -5.65023   10.15628   -6.35056   11.92767  -10.47760    4.38583
+  -14.22506   -6.34011  -15.45994    0.52174    1.72136    5.03619"""
+
+
+def test_beam_optics(tmp_path):
+    inputFile = str(tmp_path / 'beam.txt')
+    with open(inputFile, 'w') as f:
+        f.write(' *BEAM*\n' + (_beamBlock + '\n') * 3 + 'EOF -- rewind file\n')
+    optics = pytransport.Reader.GetOptics(inputFile)
+    assert len(optics) == 3
+    assert optics[1]['Name'] == 'QF0'
+    assert optics[1]['Sigma_x'] == pytest.approx(3.212e-3)
+    assert optics[1]['Disp_y'] == pytest.approx(0.438583)
+    assert optics[1]['Disp_xp'] == pytest.approx(-1.545994)
+    assert optics[1]['Disp_yp'] == pytest.approx(0.503619)
+    assert optics[1]['Emitt_x'] == pytest.approx((3.212**2 - (-6.35056 * 0.01289)**2) / 18.35387)
+    assert list(pytransport.Reader.IterOptics(inputFile)) == [optics[num] for num in range(3)]
+
+
+def test_lattice_table():
+    lattice = pytransport.Reader.GetLatticeTable(_exampleFile)
+    beam = lattice[numpy.flatnonzero(lattice.table['typecode'] == 1.0)[0]]
+    assert beam['name'] == 'BEAM'
+    assert beam['momentum'] == 729.0
+    quads = numpy.flatnonzero(lattice.table['typecode'] == 5.0)
+    quad = lattice[quads[0]]
+    assert quad['name'] == 'QMA1'
+    assert list(quad['data']) == [0.35, -7.99, 50.0]
+    assert lattice.GetElementIndex('QMA1') == [quads[0]]
+    assert lattice.length[-1] == pytest.approx(lattice.table['length'].sum())
+    # views write to the table
+    quad['data'][1] = -8.0
+    assert lattice.table['params'][quads[0], 1] == -8.0
+    end = lattice.length[-1]
+    lattice.SetLength(quads[0], 0.5)
+    assert lattice.length[-1] == pytest.approx(end + 0.15)
+    assert lattice.GetElementStartSPosition('QMA1')[0] == pytest.approx(lattice.length[quads[0]] - 0.5)
+
+
+def test_lattice_name_index():
+    lattice = pytransport.Data.Lattice()
+    for num, name in enumerate(['D1', 'Q1', 'D1', None, 'D1']):
+        lattice.AddElement(3.0, name, 1.0 + num)
+    assert lattice.GetElementIndex('D1') == [0, 2, 4]
+    assert lattice.GetElementIndex('missing') == []
+    assert lattice.GetElementEndSPosition('Q1') == [3.0]
+    assert lattice.GetElementStartSPosition('D1') == [0.0, 3.0, 10.0]
+    lattice[3]['name'] = 'D1'
+    lattice[2]['name'] = 'Q1'
+    assert lattice.GetElementIndex('D1') == [0, 3, 4]
+    assert lattice.GetElementIndex('Q1') == [1, 2]
+
+
+def test_lattice_set_lengths():
+    lattice = pytransport.Data.Lattice()
+    lattice.AddElement(3.0, 'D0', 1.0)
+    lattice.UpdateLength({'length': 0.5})  # length not in the table, e.g. an unnamed fitted element
+    for num in range(1, 100):
+        lattice.AddElement(3.0, 'D' + str(num), 1.0)
+    for num in range(0, 100, 2):
+        lattice.SetLength(num, 2.0)
+    assert lattice.GetElementEndSPosition('D0') == [2.0]
+    assert lattice.GetElementStartSPosition('D1') == [2.5]
+    assert lattice.length[-1] == pytest.approx(150.5)
+    lattice.AddElement(3.0, 'D100', 1.0)
+    assert lattice.GetElementEndSPosition('D100') == [pytest.approx(151.5)]
+
+
+def test_lattice_match_elements():
+    lattice = pytransport.Data.Lattice()
+    fits = pytransport.Data.Lattice()
+    for typecode, name in [(3.0, 'D1'), (4.0, 'B1'), (3.0, 'D1'), (5.0, 'Q1'), (4.0, 'B1'), (3.0, None)]:
+        lattice.AddElement(typecode, name, 1.0)
+    for typecode, name in [(4.0, 'B1'), (4.0, 'B1'), (4.0, 'B1'), (3.0, 'D1'), (3.0, 'D2'), (3.0, None)]:
+        fits.AddElement(typecode, name, 2.0)
+    indices, fitIndices = lattice.MatchElements(fits)
+    assert list(indices) == [1, 4, 0]
+    assert list(fitIndices) == [0, 1, 3]
+    indices, fitIndices = lattice.MatchElements(fits, typecodes=(3.0,))
+    assert list(indices) == [0] and list(fitIndices) == [3]
+
+
+def test_single_line_applied(tmp_path):
+    index = pytransport.Reader.IndexFile(_exampleFile)
+    assert not index.singleLineApplied
+    assert not pytransport._General.CheckSingleLineOutputApplied(index)
+    with open(_exampleFile) as f:
+        lines = f.readlines()
+    beam = [num for num, line in enumerate(lines) if line.startswith(' *BEAM*')][0]
+    lines.insert(beam + 1, 'IO: UNDEFINED TYPE CODE 13. 19. ;\n')
+    inputFile = str(tmp_path / 'FOR002.DAT')
+    with open(inputFile, 'w') as f:
+        f.writelines(lines)
+    assert pytransport.Reader.IndexFile(inputFile).singleLineApplied
+    assert pytransport.Reader.IndexFile(inputFile, mmap=True).singleLineApplied
+    deck = str(tmp_path / 'deck.txt')
+    with open(deck, 'w') as f:
+        f.write('0    0\n13. 19. ;\nSENTINEL\n')
+    assert not pytransport.Reader.IndexFile(deck).singleLineApplied